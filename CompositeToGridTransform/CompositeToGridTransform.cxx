@@ -1,4 +1,5 @@
 #include "CompositeToGridTransformCLP.h"
+#include "TransformSampling.h"
 
 // MRML includes
 #include <vtkMRMLTransformNode.h>
@@ -11,61 +12,23 @@
 #include <vtkImageData.h>
 #include <vtkMatrix4x4.h>
 #include <vtkOrientedGridTransform.h>
-#include <vtkOrientedGridTransform.h>
 
-// Use an anonymous namespace to keep class types and function names
-// from colliding when module is used as shared object module.  Every
-// thing should be in an anonymous namespace except for the module
-// entry point, e.g. main()
-//
 namespace
 {
-void GetTransformedPointSamplesAsVectorImage(vtkImageData* vectorImage, vtkMRMLTransformNode* inputTransformNode, vtkMatrix4x4* ijkToRAS)
-{
-  vtkNew<vtkGeneralTransform> inputTransform;
-  inputTransformNode->GetTransformFromWorld(inputTransform.GetPointer());
-
-  // The orientation of the volume cannot be set in the image
-  // therefore the volume will not appear in the correct position
-  // if the direction matrix is not identity.
-  vectorImage->AllocateScalars(VTK_FLOAT, 3);
-
-  double point_RAS[4] = { 0, 0, 0, 1 };
-  double transformedPoint_RAS[4] = { 0, 0, 0, 1 };
-  double point_IJK[4] = { 0, 0, 0, 1 };
-  float* voxelPtr = static_cast<float*>(vectorImage->GetScalarPointer());
-  int* extent = vectorImage->GetExtent();
-  int* dim = vectorImage->GetDimensions();
-  float numberOfVoxels = dim[0] * dim[1] * dim[2];
-  unsigned int voxelCount = 0;
-  for (point_IJK[2] = extent[4]; point_IJK[2] <= extent[5]; point_IJK[2]++)
-  {
-    for (point_IJK[1] = extent[2]; point_IJK[1] <= extent[3]; point_IJK[1]++)
+  // Displacement grid of the transform node, either stored from or to parent
+  vtkOrientedGridTransform* GetGridTransform(vtkMRMLTransformNode* transformNode)
+  {
+    vtkOrientedGridTransform* gridTransform = vtkOrientedGridTransform::SafeDownCast(
+      transformNode->GetTransformFromParentAs("vtkOrientedGridTransform", false /* don't report conversion error */));
+    if (gridTransform == nullptr)
     {
-      for (point_IJK[0] = extent[0]; point_IJK[0] <= extent[1]; point_IJK[0]++)
-      {
-        ijkToRAS->MultiplyPoint(point_IJK, point_RAS);
-
-        inputTransform->TransformPoint(point_RAS, transformedPoint_RAS);
-
-        // store the pointDislocationVector_RAS components in the image
-        *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[0] - point_RAS[0]);
-        *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[1] - point_RAS[1]);
-        *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[2] - point_RAS[2]);
-
-        voxelCount++;
-        if (voxelCount % 10000 == 0)
-        {
-          std::cout << "<filter-progress>" << (voxelCount / numberOfVoxels) << "</filter-progress>" << std::endl << std::flush;
-        }
-      }
+      gridTransform = vtkOrientedGridTransform::SafeDownCast(
+        transformNode->GetTransformToParentAs("vtkOrientedGridTransform", false /* don't report conversion error */));
     }
+    return gridTransform;
   }
-
 }
 
-} // end of anonymous namespace
-
 int main( int argc, char * argv[] )
 {
   PARSE_ARGS;
@@ -89,6 +52,10 @@ int main( int argc, char * argv[] )
     std::cerr << "Failed to read input transform 1 from file " << std::endl;
     return EXIT_FAILURE;
   }
+  if (invertTransform1)
+  {
+    transform1Node->Inverse();
+  }
 
   // INPUT TRANSFORM 2
 
@@ -109,6 +76,10 @@ int main( int argc, char * argv[] )
     std::cerr << "Failed to read input transform 2 from file " << std::endl;
     return EXIT_FAILURE;
   }
+  if (invertTransform2)
+  {
+    transform2Node->Inverse();
+  }
 
   // REFERENCE VOLUME
 
@@ -210,12 +181,66 @@ int main( int argc, char * argv[] )
 
   // RUN
 
-  vtkNew<vtkGeneralTransform> hardeningTransform;
-  transform2Node->GetTransformToWorld(hardeningTransform.GetPointer());
-  transform1Node->ApplyTransform(hardeningTransform.GetPointer());
+  vtkMRMLTransformNode* boundedTransformNode = nullptr;
+  if (boundedRegionTransform == "Transform1")
+  {
+    boundedTransformNode = transform1Node;
+  }
+  else if (boundedRegionTransform == "Transform2")
+  {
+    boundedTransformNode = transform2Node;
+  }
+
+  vtkOrientedGridTransform* boundedGrid = nullptr;
+  if (boundedTransformNode != nullptr)
+  {
+    boundedGrid = GetGridTransform(boundedTransformNode);
+    if (boundedGrid == nullptr)
+    {
+      std::cerr << "Bounded region transform is not a grid transform, composing in the whole volume." << std::endl;
+    }
+  }
+
+  if (boundedGrid != nullptr)
+  {
+    // only compose where the bounded transform (e.g. a local correction) is not the identity
+    double boundedRegion[6];
+    if (TransformSampling::GetDisplacedRegion(boundedGrid, boundedRegion))
+    {
+      for (int a=0; a<3; a++)
+      {
+        boundedRegion[2*a] -= boundedRegionMargin;
+        boundedRegion[2*a+1] += boundedRegionMargin;
+      }
+    }
+    bool boundedIsTransform1 = boundedTransformNode == transform1Node.GetPointer();
+    vtkMRMLTransformNode* otherTransformNode = boundedIsTransform1 ? transform2Node.GetPointer() : transform1Node.GetPointer();
+    vtkOrientedGridTransform* otherGrid = GetGridTransform(otherTransformNode);
+    double otherMaximumDisplacement = otherGrid != nullptr ? TransformSampling::GetMaximumDisplacement(otherGrid) : -1;
+
+    vtkNew<vtkGeneralTransform> inputTransform1;
+    transform1Node->GetTransformFromWorld(inputTransform1.GetPointer());
+    vtkNew<vtkGeneralTransform> inputTransform2;
+    transform2Node->GetTransformFromWorld(inputTransform2.GetPointer());
+    vtkOrientedGridTransform* otherFromParentGrid = vtkOrientedGridTransform::SafeDownCast(
+      otherTransformNode->GetTransformFromParentAs("vtkOrientedGridTransform", false /* don't report conversion error */));
+
+    std::cout << "<filter-comment>" << "Computing" << "</filter-comment>" << std::endl << std::flush;
+    TransformSampling::GetBoundedCompositeSamplesAsVectorImage(outputVolume, inputTransform1.GetPointer(), inputTransform2.GetPointer(),
+      boundedIsTransform1, boundedRegion, otherMaximumDisplacement, otherFromParentGrid, ijkToRas.GetPointer(), numberOfThreads);
+  }
+  else
+  {
+    vtkNew<vtkGeneralTransform> hardeningTransform;
+    transform2Node->GetTransformToWorld(hardeningTransform.GetPointer());
+    transform1Node->ApplyTransform(hardeningTransform.GetPointer());
 
-  std::cout << "<filter-comment>" << "Computing" << "</filter-comment>" << std::endl << std::flush;
-  GetTransformedPointSamplesAsVectorImage(outputVolume, transform1Node, ijkToRas.GetPointer());
+    vtkNew<vtkGeneralTransform> inputTransform;
+    transform1Node->GetTransformFromWorld(inputTransform.GetPointer());
+
+    std::cout << "<filter-comment>" << "Computing" << "</filter-comment>" << std::endl << std::flush;
+    TransformSampling::GetTransformedPointSamplesAsVectorImage(outputVolume, inputTransform.GetPointer(), ijkToRas.GetPointer(), numberOfThreads);
+  }
 
   std::cout << "<filter-comment>" << "Writing" << "</filter-comment>" << std::endl << std::flush;
   vtkNew<vtkMRMLTransformStorageNode> storageNode;
@@ -0,0 +1,177 @@
+// Compare the reference and the multi-threaded sampling of a composite of two grid transforms
+// on a MNI sized grid (193 x 229 x 193 at 1mm), and the bounded region sampling, composing only
+// around the local correction, for both orders of the transforms.
+// Usage: CompositeToGridTransformBenchmark [spacing] [numberOfThreads]
+
+#include "TransformSampling.h"
+
+// VTK includes
+#include <vtkGeneralTransform.h>
+#include <vtkImageData.h>
+#include <vtkMatrix4x4.h>
+#include <vtkNew.h>
+#include <vtkOrientedGridTransform.h>
+
+// STD includes
+#include <chrono>
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+
+namespace
+{
+  const int MNIDimensions[3] = {193, 229, 193};
+  const double MNIOrigin[3] = {-96, -132, -78};
+
+  void SetUpGrid(vtkImageData* image, double spacing)
+  {
+    image->SetOrigin(MNIOrigin[0], MNIOrigin[1], MNIOrigin[2]);
+    image->SetSpacing(spacing, spacing, spacing);
+    image->SetDimensions(static_cast<int>(MNIDimensions[0] / spacing), static_cast<int>(MNIDimensions[1] / spacing), static_cast<int>(MNIDimensions[2] / spacing));
+  }
+
+  // Fill a grid transform with displacement(p) computed for each grid point
+  template <typename TFunction>
+  void FillDisplacement(vtkOrientedGridTransform* transform, double spacing, TFunction displacement)
+  {
+    vtkNew<vtkImageData> grid;
+    SetUpGrid(grid, spacing);
+    grid->AllocateScalars(VTK_FLOAT, 3);
+    float* voxelPtr = static_cast<float*>(grid->GetScalarPointer());
+    int* dim = grid->GetDimensions();
+    for (int k=0; k<dim[2]; k++)
+    {
+      for (int j=0; j<dim[1]; j++)
+      {
+        for (int i=0; i<dim[0]; i++)
+        {
+          double p[3] = {MNIOrigin[0] + i * spacing, MNIOrigin[1] + j * spacing, MNIOrigin[2] + k * spacing};
+          displacement(p, voxelPtr);
+          voxelPtr += 3;
+        }
+      }
+    }
+    transform->SetDisplacementGridData(grid);
+    transform->SetInterpolationModeToCubic();
+  }
+
+  double ElapsedSeconds(std::chrono::steady_clock::time_point start)
+  {
+    return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+  }
+
+  double GetMaximumDifference(vtkImageData* referenceImage, vtkImageData* image)
+  {
+    const float* referenceBuffer = static_cast<float*>(referenceImage->GetScalarPointer());
+    const float* buffer = static_cast<float*>(image->GetScalarPointer());
+    size_t numberOfValues = 3 * static_cast<size_t>(image->GetNumberOfPoints());
+    double maxDifference = 0;
+    for (size_t v=0; v<numberOfValues; v++)
+    {
+      maxDifference = std::max(maxDifference, static_cast<double>(fabs(referenceBuffer[v] - buffer[v])));
+    }
+    return maxDifference;
+  }
+}
+
+int main(int argc, char * argv[])
+{
+  double spacing = argc > 1 ? atof(argv[1]) : 1.0;
+  int numberOfThreads = argc > 2 ? atoi(argv[2]) : 0;
+
+  // smooth full field warp, as a normalization
+  vtkNew<vtkOrientedGridTransform> warp;
+  FillDisplacement(warp, 1.0, [](const double p[3], float* d) {
+    d[0] = 3 * sin(p[1] / 20.0);
+    d[1] = 3 * sin(p[2] / 25.0);
+    d[2] = 3 * sin(p[0] / 30.0);
+  });
+
+  // local correction, as from WarpDrive (truncated at 3 radius)
+  vtkNew<vtkOrientedGridTransform> correction;
+  FillDisplacement(correction, 2.0, [](const double p[3], float* d) {
+    double r2 = (p[0] - 12) * (p[0] - 12) + (p[1] + 13) * (p[1] + 13) + (p[2] + 7) * (p[2] + 7);
+    double g = r2 < 45.0 * 45.0 ? exp(-r2 / (15.0 * 15.0)) : 0.0;
+    d[0] = 2 * g;
+    d[1] = -g;
+    d[2] = g;
+  });
+
+  vtkNew<vtkGeneralTransform> composite;
+  composite->Concatenate(warp);
+  composite->Concatenate(correction);
+
+  vtkNew<vtkMatrix4x4> ijkToRAS;
+  for (int c=0; c<3; c++)
+  {
+    ijkToRAS->SetElement(c, c, spacing);
+    ijkToRAS->SetElement(c, 3, MNIOrigin[c]);
+  }
+
+  vtkNew<vtkImageData> referenceImage;
+  SetUpGrid(referenceImage, spacing);
+  auto start = std::chrono::steady_clock::now();
+  TransformSampling::GetTransformedPointSamplesAsVectorImageReference(referenceImage, composite, ijkToRAS);
+  double referenceTime = ElapsedSeconds(start);
+
+  vtkNew<vtkImageData> image;
+  SetUpGrid(image, spacing);
+  start = std::chrono::steady_clock::now();
+  TransformSampling::GetTransformedPointSamplesAsVectorImage(image, composite, ijkToRAS, numberOfThreads, 0.1);
+  double time = ElapsedSeconds(start);
+
+  double maxDifference = GetMaximumDifference(referenceImage, image);
+
+  int* dim = image->GetDimensions();
+  std::cout << "grid: " << dim[0] << "x" << dim[1] << "x" << dim[2]
+            << " reference: " << referenceTime << "s"
+            << " threaded: " << time << "s"
+            << " speedup: " << referenceTime / time
+            << " max abs difference: " << maxDifference << std::endl;
+
+  if (maxDifference > 1e-5)
+  {
+    std::cerr << "Sampled displacement differs from the reference" << std::endl;
+    return EXIT_FAILURE;
+  }
+
+  // bounded region sampling, correction applied first (forward warp) and last (inverse warp)
+  double correctionRegion[6];
+  TransformSampling::GetDisplacedRegion(correction, correctionRegion);
+  vtkNew<vtkGeneralTransform> inverseComposite;
+  inverseComposite->Concatenate(correction);
+  inverseComposite->Concatenate(warp);
+  for (bool correctionIsTransform1 : {false, true})
+  {
+    vtkAbstractTransform* transform1 = correctionIsTransform1 ? correction.GetPointer() : warp.GetPointer();
+    vtkAbstractTransform* transform2 = correctionIsTransform1 ? warp.GetPointer() : correction.GetPointer();
+
+    vtkNew<vtkImageData> fullImage;
+    SetUpGrid(fullImage, spacing);
+    start = std::chrono::steady_clock::now();
+    TransformSampling::GetTransformedPointSamplesAsVectorImage(fullImage, correctionIsTransform1 ? inverseComposite.GetPointer() : composite.GetPointer(),
+                                                               ijkToRAS, numberOfThreads, 0.1);
+    double fullTime = ElapsedSeconds(start);
+
+    vtkNew<vtkImageData> boundedImage;
+    SetUpGrid(boundedImage, spacing);
+    start = std::chrono::steady_clock::now();
+    TransformSampling::GetBoundedCompositeSamplesAsVectorImage(boundedImage, transform1, transform2, correctionIsTransform1, correctionRegion,
+                                                               TransformSampling::GetMaximumDisplacement(warp), warp, ijkToRAS, numberOfThreads, 0.1);
+    double boundedTime = ElapsedSeconds(start);
+
+    maxDifference = GetMaximumDifference(fullImage, boundedImage);
+    std::cout << "correction applied " << (correctionIsTransform1 ? "last" : "first")
+              << " full: " << fullTime << "s"
+              << " bounded: " << boundedTime << "s"
+              << " speedup: " << fullTime / boundedTime
+              << " max abs difference: " << maxDifference << std::endl;
+
+    if (maxDifference > 1e-5)
+    {
+      std::cerr << "Bounded region sampling differs from the full composition" << std::endl;
+      return EXIT_FAILURE;
+    }
+  }
+  return EXIT_SUCCESS;
+}
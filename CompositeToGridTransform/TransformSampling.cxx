@@ -0,0 +1,433 @@
+// Sampling of a transform on the points of a grid, used by CompositeToGridTransform.
+
+#include "TransformSampling.h"
+
+// VTK includes
+#include <vtkDataArray.h>
+#include <vtkNew.h>
+#include <vtkPointData.h>
+#include <vtkSmartPointer.h>
+
+// STD includes
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <iostream>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+namespace
+{
+  // Cubic interpolation of the grid transforms reaches two samples away
+  const int InterpolationSupport = 2;
+
+  // Sample the voxels of slice k (relative to the extent)
+  void SampleSlice(vtkImageData* vectorImage, vtkAbstractTransform* transform, vtkMatrix4x4* ijkToRAS, int k)
+  {
+    int* extent = vectorImage->GetExtent();
+    int* dim = vectorImage->GetDimensions();
+    float* voxelPtr = static_cast<float*>(vectorImage->GetScalarPointer()) + 3 * static_cast<size_t>(dim[0]) * dim[1] * k;
+
+    double point_RAS[4] = { 0, 0, 0, 1 };
+    double transformedPoint_RAS[4] = { 0, 0, 0, 1 };
+    double point_IJK[4] = { 0, 0, static_cast<double>(extent[4] + k), 1 };
+    for (point_IJK[1] = extent[2]; point_IJK[1] <= extent[3]; point_IJK[1]++)
+    {
+      for (point_IJK[0] = extent[0]; point_IJK[0] <= extent[1]; point_IJK[0]++)
+      {
+        ijkToRAS->MultiplyPoint(point_IJK, point_RAS);
+
+        transform->InternalTransformPoint(point_RAS, transformedPoint_RAS);
+
+        // store the pointDislocationVector_RAS components in the image
+        *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[0] - point_RAS[0]);
+        *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[1] - point_RAS[1]);
+        *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[2] - point_RAS[2]);
+      }
+    }
+  }
+
+  unsigned int GetNumberOfThreads(int numberOfThreads, int numberOfSlices)
+  {
+    unsigned int n = numberOfThreads > 0 ? numberOfThreads : std::thread::hardware_concurrency();
+    return std::max(1u, std::min(n, static_cast<unsigned int>(numberOfSlices)));
+  }
+
+  // One copy of the transform per thread, made here as copying is not thread safe.
+  // Grid transforms share their displacement grids with the copies.
+  std::vector< vtkSmartPointer<vtkAbstractTransform> > CopyTransform(vtkAbstractTransform* transform, unsigned int n)
+  {
+    transform->Update();
+    std::vector< vtkSmartPointer<vtkAbstractTransform> > transforms(n);
+    for (unsigned int t=0; t<n; t++)
+    {
+      transforms[t] = vtkSmartPointer<vtkAbstractTransform>::Take(transform->MakeTransform());
+      transforms[t]->DeepCopy(transform);
+      transforms[t]->Update();
+    }
+    return transforms;
+  }
+
+  // Call sampleSlice(k, threadIndex) for each slice k, distributing the slices over n threads
+  template <typename TFunction>
+  void ForEachSlice(int numberOfSlices, unsigned int n, double progressStep, TFunction sampleSlice)
+  {
+    if (progressStep <= 0)
+    {
+      progressStep = 0.01;
+    }
+    std::atomic<int> nextSlice(0);
+    std::mutex progressMutex;
+    int completedSlices = 0;
+    double nextProgress = progressStep;
+
+    auto worker = [&](unsigned int t) {
+      for (int k = nextSlice++; k < numberOfSlices; k = nextSlice++)
+      {
+        sampleSlice(k, t);
+
+        std::lock_guard<std::mutex> lock(progressMutex);
+        double progress = static_cast<double>(++completedSlices) / numberOfSlices;
+        if (progress >= nextProgress || completedSlices == numberOfSlices)
+        {
+          std::cout << "<filter-progress>" << progress << "</filter-progress>" << std::endl << std::flush;
+          while (nextProgress <= progress)
+          {
+            nextProgress += progressStep;
+          }
+        }
+      }
+    };
+
+    std::vector<std::thread> threads;
+    for (unsigned int t=1; t<n; t++)
+    {
+      threads.emplace_back(worker, t);
+    }
+    worker(0);
+    for (auto & thread : threads)
+    {
+      thread.join();
+    }
+  }
+
+  // Position of the grid samples: origin + direction * (spacing * ijk)
+  void GetGridIJKToRAS(vtkOrientedGridTransform* gridTransform, vtkMatrix4x4* ijkToRAS)
+  {
+    vtkImageData* grid = gridTransform->GetDisplacementGrid();
+    double* origin = grid->GetOrigin();
+    double* spacing = grid->GetSpacing();
+    vtkMatrix4x4* direction = gridTransform->GetGridDirectionMatrix();
+    ijkToRAS->Identity();
+    for (int r=0; r<3; r++)
+    {
+      for (int c=0; c<3; c++)
+      {
+        double directionElement = direction != nullptr ? direction->GetElement(r, c) : (r == c ? 1.0 : 0.0);
+        ijkToRAS->SetElement(r, c, directionElement * spacing[c]);
+      }
+      ijkToRAS->SetElement(r, 3, origin[r]);
+    }
+  }
+
+  void GetGridDisplacement(vtkDataArray* displacements, double scale, double shift, vtkIdType id, double displacement[3])
+  {
+    for (int a=0; a<3; a++)
+    {
+      displacement[a] = displacements->GetComponent(id, a) * scale + shift;
+    }
+  }
+
+  bool InRegion(const double region[6], const double point[3])
+  {
+    return point[0] >= region[0] && point[0] <= region[1]
+        && point[1] >= region[2] && point[1] <= region[3]
+        && point[2] >= region[4] && point[2] <= region[5];
+  }
+}
+
+namespace TransformSampling
+{
+  void GetTransformedPointSamplesAsVectorImageReference(vtkImageData* vectorImage, vtkAbstractTransform* inputTransform, vtkMatrix4x4* ijkToRAS)
+  {
+    // The orientation of the volume cannot be set in the image
+    // therefore the volume will not appear in the correct position
+    // if the direction matrix is not identity.
+    vectorImage->AllocateScalars(VTK_FLOAT, 3);
+
+    double point_RAS[4] = { 0, 0, 0, 1 };
+    double transformedPoint_RAS[4] = { 0, 0, 0, 1 };
+    double point_IJK[4] = { 0, 0, 0, 1 };
+    float* voxelPtr = static_cast<float*>(vectorImage->GetScalarPointer());
+    int* extent = vectorImage->GetExtent();
+    int* dim = vectorImage->GetDimensions();
+    float numberOfVoxels = dim[0] * dim[1] * dim[2];
+    unsigned int voxelCount = 0;
+    for (point_IJK[2] = extent[4]; point_IJK[2] <= extent[5]; point_IJK[2]++)
+    {
+      for (point_IJK[1] = extent[2]; point_IJK[1] <= extent[3]; point_IJK[1]++)
+      {
+        for (point_IJK[0] = extent[0]; point_IJK[0] <= extent[1]; point_IJK[0]++)
+        {
+          ijkToRAS->MultiplyPoint(point_IJK, point_RAS);
+
+          inputTransform->TransformPoint(point_RAS, transformedPoint_RAS);
+
+          // store the pointDislocationVector_RAS components in the image
+          *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[0] - point_RAS[0]);
+          *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[1] - point_RAS[1]);
+          *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[2] - point_RAS[2]);
+
+          voxelCount++;
+          if (voxelCount % 10000 == 0)
+          {
+            std::cout << "<filter-progress>" << (voxelCount / numberOfVoxels) << "</filter-progress>" << std::endl << std::flush;
+          }
+        }
+      }
+    }
+  }
+
+  void GetTransformedPointSamplesAsVectorImage(vtkImageData* vectorImage, vtkAbstractTransform* inputTransform, vtkMatrix4x4* ijkToRAS,
+                                               int numberOfThreads, double progressStep)
+  {
+    vectorImage->AllocateScalars(VTK_FLOAT, 3);
+
+    const int numberOfSlices = vectorImage->GetDimensions()[2];
+    unsigned int n = GetNumberOfThreads(numberOfThreads, numberOfSlices);
+    std::vector< vtkSmartPointer<vtkAbstractTransform> > transforms = CopyTransform(inputTransform, n);
+
+    ForEachSlice(numberOfSlices, n, progressStep, [&](int k, unsigned int t) {
+      SampleSlice(vectorImage, transforms[t], ijkToRAS, k);
+    });
+  }
+
+  bool GetDisplacedRegion(vtkOrientedGridTransform* gridTransform, double region[6])
+  {
+    for (int a=0; a<3; a++)
+    {
+      region[2*a] = VTK_DOUBLE_MAX;
+      region[2*a+1] = -VTK_DOUBLE_MAX;
+    }
+    vtkImageData* grid = gridTransform->GetDisplacementGrid();
+    if (grid == nullptr)
+    {
+      return false;
+    }
+    vtkDataArray* displacements = grid->GetPointData()->GetScalars();
+    const double scale = gridTransform->GetDisplacementScale();
+    const double shift = gridTransform->GetDisplacementShift();
+    int* extent = grid->GetExtent();
+
+    // index bounding box of the non-zero displacements
+    int begin[3] = { extent[1] + 1, extent[3] + 1, extent[5] + 1 };
+    int end[3] = { extent[0] - 1, extent[2] - 1, extent[4] - 1 };
+    double maximumNorm2 = 0;
+    vtkIdType id = 0;
+    for (int k = extent[4]; k <= extent[5]; k++)
+    {
+      for (int j = extent[2]; j <= extent[3]; j++)
+      {
+        for (int i = extent[0]; i <= extent[1]; i++, id++)
+        {
+          double d[3];
+          GetGridDisplacement(displacements, scale, shift, id, d);
+          double norm2 = d[0] * d[0] + d[1] * d[1] + d[2] * d[2];
+          if (norm2 > 0)
+          {
+            const int index[3] = { i, j, k };
+            for (int a=0; a<3; a++)
+            {
+              begin[a] = std::min(begin[a], index[a]);
+              end[a] = std::max(end[a], index[a]);
+            }
+            maximumNorm2 = std::max(maximumNorm2, norm2);
+          }
+        }
+      }
+    }
+    if (maximumNorm2 == 0)
+    {
+      return false;
+    }
+
+    for (int a=0; a<3; a++)
+    {
+      if (begin[a] == extent[2*a] || end[a] == extent[2*a+1])
+      {
+        // displacements reaching the grid boundary are extended out of it: no bounded region
+        for (int b=0; b<3; b++)
+        {
+          region[2*b] = -VTK_DOUBLE_MAX;
+          region[2*b+1] = VTK_DOUBLE_MAX;
+        }
+        return true;
+      }
+    }
+
+    vtkNew<vtkMatrix4x4> gridIJKToRAS;
+    GetGridIJKToRAS(gridTransform, gridIJKToRAS);
+    const double maximumDisplacement = sqrt(maximumNorm2);
+    for (int corner=0; corner<8; corner++)
+    {
+      double point_IJK[4] = { 0, 0, 0, 1 };
+      double point_RAS[4] = { 0, 0, 0, 1 };
+      for (int a=0; a<3; a++)
+      {
+        point_IJK[a] = (corner & (1 << a)) ? end[a] + InterpolationSupport : begin[a] - InterpolationSupport;
+      }
+      gridIJKToRAS->MultiplyPoint(point_IJK, point_RAS);
+      for (int a=0; a<3; a++)
+      {
+        region[2*a] = std::min(region[2*a], point_RAS[a] - maximumDisplacement);
+        region[2*a+1] = std::max(region[2*a+1], point_RAS[a] + maximumDisplacement);
+      }
+    }
+    return true;
+  }
+
+  double GetMaximumDisplacement(vtkOrientedGridTransform* gridTransform)
+  {
+    vtkImageData* grid = gridTransform->GetDisplacementGrid();
+    if (grid == nullptr)
+    {
+      return 0;
+    }
+    vtkDataArray* displacements = grid->GetPointData()->GetScalars();
+    const double scale = gridTransform->GetDisplacementScale();
+    const double shift = gridTransform->GetDisplacementShift();
+    double maximumNorm2 = 0;
+    for (vtkIdType id=0; id<displacements->GetNumberOfTuples(); id++)
+    {
+      double d[3];
+      GetGridDisplacement(displacements, scale, shift, id, d);
+      maximumNorm2 = std::max(maximumNorm2, d[0] * d[0] + d[1] * d[1] + d[2] * d[2]);
+    }
+    return sqrt(maximumNorm2);
+  }
+
+  bool HasSameGeometry(vtkOrientedGridTransform* gridTransform, vtkImageData* image, vtkMatrix4x4* ijkToRAS)
+  {
+    vtkImageData* grid = gridTransform->GetDisplacementGrid();
+    if (grid == nullptr || gridTransform->GetInverseFlag())
+    {
+      return false;
+    }
+    int* gridExtent = grid->GetExtent();
+    int* extent = image->GetExtent();
+    for (int e=0; e<6; e++)
+    {
+      if (gridExtent[e] != extent[e])
+      {
+        return false;
+      }
+    }
+    vtkNew<vtkMatrix4x4> gridIJKToRAS;
+    GetGridIJKToRAS(gridTransform, gridIJKToRAS);
+    for (int r=0; r<3; r++)
+    {
+      for (int c=0; c<4; c++)
+      {
+        double value = ijkToRAS->GetElement(r, c);
+        if (fabs(gridIJKToRAS->GetElement(r, c) - value) > 1e-6 * std::max(1.0, fabs(value)))
+        {
+          return false;
+        }
+      }
+    }
+    return true;
+  }
+
+  void GetBoundedCompositeSamplesAsVectorImage(vtkImageData* vectorImage, vtkAbstractTransform* transform1, vtkAbstractTransform* transform2,
+                                               bool boundedIsTransform1, const double boundedRegion[6], double otherMaximumDisplacement,
+                                               vtkOrientedGridTransform* otherGrid, vtkMatrix4x4* ijkToRAS,
+                                               int numberOfThreads, double progressStep)
+  {
+    vectorImage->AllocateScalars(VTK_FLOAT, 3);
+
+    int* extent = vectorImage->GetExtent();
+    int* dim = vectorImage->GetDimensions();
+    const int numberOfSlices = dim[2];
+    unsigned int n = GetNumberOfThreads(numberOfThreads, numberOfSlices);
+    std::vector< vtkSmartPointer<vtkAbstractTransform> > transforms1 = CopyTransform(transform1, n);
+    std::vector< vtkSmartPointer<vtkAbstractTransform> > transforms2 = CopyTransform(transform2, n);
+
+    // out of the bounded region only the other transform is sampled, copied from its grid if possible
+    vtkDataArray* otherDisplacements = nullptr;
+    double scale = 1;
+    double shift = 0;
+    if (otherGrid != nullptr && HasSameGeometry(otherGrid, vectorImage, ijkToRAS))
+    {
+      otherDisplacements = otherGrid->GetDisplacementGrid()->GetPointData()->GetScalars();
+      scale = otherGrid->GetDisplacementScale();
+      shift = otherGrid->GetDisplacementShift();
+    }
+
+    // points out of this region are not moved into the bounded region by transform2
+    double compositionRegion[6];
+    for (int a=0; a<3; a++)
+    {
+      double expansion = 0;
+      if (boundedIsTransform1)
+      {
+        expansion = otherMaximumDisplacement >= 0 ? otherMaximumDisplacement : VTK_DOUBLE_MAX;
+      }
+      compositionRegion[2*a] = std::max(boundedRegion[2*a] - expansion, -VTK_DOUBLE_MAX);
+      compositionRegion[2*a+1] = std::min(boundedRegion[2*a+1] + expansion, VTK_DOUBLE_MAX);
+    }
+
+    ForEachSlice(numberOfSlices, n, progressStep, [&](int k, unsigned int t) {
+      vtkAbstractTransform* t1 = transforms1[t];
+      vtkAbstractTransform* t2 = transforms2[t];
+      vtkAbstractTransform* other = boundedIsTransform1 ? t2 : t1;
+      vtkIdType id = static_cast<vtkIdType>(dim[0]) * dim[1] * k;
+      float* voxelPtr = static_cast<float*>(vectorImage->GetScalarPointer()) + 3 * id;
+
+      double point_RAS[4] = { 0, 0, 0, 1 };
+      double intermediatePoint_RAS[3] = { 0, 0, 0 };
+      double displacement_RAS[3] = { 0, 0, 0 };
+      double point_IJK[4] = { 0, 0, static_cast<double>(extent[4] + k), 1 };
+      for (point_IJK[1] = extent[2]; point_IJK[1] <= extent[3]; point_IJK[1]++)
+      {
+        for (point_IJK[0] = extent[0]; point_IJK[0] <= extent[1]; point_IJK[0]++, id++)
+        {
+          ijkToRAS->MultiplyPoint(point_IJK, point_RAS);
+
+          double transformedPoint_RAS[3] = { point_RAS[0], point_RAS[1], point_RAS[2] };
+          if (!InRegion(compositionRegion, point_RAS))
+          {
+            if (otherDisplacements != nullptr)
+            {
+              GetGridDisplacement(otherDisplacements, scale, shift, id, displacement_RAS);
+              for (int a=0; a<3; a++)
+              {
+                transformedPoint_RAS[a] += displacement_RAS[a];
+              }
+            }
+            else
+            {
+              other->InternalTransformPoint(point_RAS, transformedPoint_RAS);
+            }
+          }
+          else
+          {
+            t2->InternalTransformPoint(point_RAS, intermediatePoint_RAS);
+            if (!boundedIsTransform1 || InRegion(boundedRegion, intermediatePoint_RAS))
+            {
+              t1->InternalTransformPoint(intermediatePoint_RAS, transformedPoint_RAS);
+            }
+            else
+            {
+              std::copy(intermediatePoint_RAS, intermediatePoint_RAS + 3, transformedPoint_RAS);
+            }
+          }
+
+          *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[0] - point_RAS[0]);
+          *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[1] - point_RAS[1]);
+          *(voxelPtr++) = static_cast<float>(transformedPoint_RAS[2] - point_RAS[2]);
+        }
+      }
+    });
+  }
+}
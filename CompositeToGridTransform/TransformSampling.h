@@ -0,0 +1,49 @@
+// Sampling of a transform on the points of a grid, used by CompositeToGridTransform.
+
+#ifndef __TransformSampling_h
+#define __TransformSampling_h
+
+// VTK includes
+#include <vtkAbstractTransform.h>
+#include <vtkImageData.h>
+#include <vtkMatrix4x4.h>
+#include <vtkOrientedGridTransform.h>
+
+namespace TransformSampling
+{
+  // Single threaded sampling visiting the voxels one by one, printing progress every 10000 voxels.
+  // Kept as reference for testing and benchmarking.
+  void GetTransformedPointSamplesAsVectorImageReference(vtkImageData* vectorImage, vtkAbstractTransform* inputTransform, vtkMatrix4x4* ijkToRAS);
+
+  // Store in vectorImage (allocated here as 3 component float) the displacement of inputTransform
+  // at each voxel position. Slices are distributed over numberOfThreads threads (<= 0 uses all
+  // available cores), each one evaluating its own copy of the transform. Progress is reported in
+  // steps of progressStep (fraction of the total).
+  void GetTransformedPointSamplesAsVectorImage(vtkImageData* vectorImage, vtkAbstractTransform* inputTransform, vtkMatrix4x4* ijkToRAS,
+                                               int numberOfThreads, double progressStep = 0.01);
+
+  // Axis aligned RAS region (xmin, xmax, ymin, ymax, zmin, zmax) containing all the points displaced
+  // by the grid transform or by its inverse: the non-zero displacements bounding box, expanded by the
+  // cubic interpolation support and by the largest displacement. Returns false (and an empty region)
+  // if all the displacements are zero.
+  bool GetDisplacedRegion(vtkOrientedGridTransform* gridTransform, double region[6]);
+
+  // Largest displacement magnitude of the grid transform (also bounds the one of its inverse).
+  double GetMaximumDisplacement(vtkOrientedGridTransform* gridTransform);
+
+  // Same as GetTransformedPointSamplesAsVectorImage for the composite transform1(transform2(p)), where the
+  // bounded transform (transform1 if boundedIsTransform1, transform2 otherwise) is the identity out of
+  // boundedRegion. The composition is only evaluated where the bounded transform may contribute, elsewhere
+  // only the other transform is: copied from otherGrid if given (same geometry as the sampled image required)
+  // or evaluated. If transform1 is bounded, otherMaximumDisplacement (< 0 if unknown) is used to skip
+  // evaluating the composition out of the region expanded by it.
+  void GetBoundedCompositeSamplesAsVectorImage(vtkImageData* vectorImage, vtkAbstractTransform* transform1, vtkAbstractTransform* transform2,
+                                               bool boundedIsTransform1, const double boundedRegion[6], double otherMaximumDisplacement,
+                                               vtkOrientedGridTransform* otherGrid, vtkMatrix4x4* ijkToRAS,
+                                               int numberOfThreads, double progressStep = 0.01);
+
+  // Whether the grid transform samples are at the voxel positions of the image placed with ijkToRAS.
+  bool HasSameGeometry(vtkOrientedGridTransform* gridTransform, vtkImageData* image, vtkMatrix4x4* ijkToRAS);
+}
+
+#endif
@@ -3,16 +3,14 @@
 // https://gitlab.com/plastimatch/plastimatch
 
 #include "FiducialRegistrationVariableRBFCLP.h"
+#include "VariableRBF.h"
+#include "VariableRBFState.h"
 
 // ITK includes
 #include <itkImage.h>
 
 #include "SimpleITK.h"
 
-#ifndef M_PI
-  #define M_PI 3.14159265358979323846
-#endif
-
 namespace sitk = itk::simple;
 
 // Use an anonymous namespace to keep class types and function names
@@ -32,145 +30,6 @@ namespace
     return p;
   }
 
-  static float RBFValue (itk::Point<double, 3> * rbf_center, itk::Point<double, 3> * loc, float radius)
-  {
-    float r = rbf_center->EuclideanDistanceTo(*loc) / radius;
-    float val = exp( -r*r );   
-    return val;
-  }
-
-  void RBFGaussUpdateVectorField( 
-    sitk::Image *vectorField, 
-    float *coeff, 
-    std::vector< itk::Point<double, 3> > * fixedLandmarks,
-    float * adaptRadius)
-  {
-    unsigned int i, landmarkIndex, imageLinearIndex;
-    float rbf;
-    unsigned int numLandmarks = fixedLandmarks->size();
-
-    itk::Point<double, 3> physicalPointITK;
-    std::vector<double> physicalPoint;
-
-    std::vector<unsigned int> size = vectorField->GetSize();
-    float * buffer = vectorField->GetBufferAsFloat();
-    std::vector<itk::int64_t> ijk {0,0,0};
-
-    for(ijk[0]=0; ijk[0]<size[0]; ijk[0]=ijk[0]+1){
-    for(ijk[1]=0; ijk[1]<size[1]; ijk[1]=ijk[1]+1){
-    for(ijk[2]=0; ijk[2]<size[2]; ijk[2]=ijk[2]+1){
-
-      physicalPoint = vectorField->TransformIndexToPhysicalPoint(ijk);
-      for (i=0; i<3; i++){
-        physicalPointITK[i] = physicalPoint[i];
-      }
-
-      imageLinearIndex = ijk[0] + (size[0] * (ijk[1] + size[1] * ijk[2]));
-
-      for (landmarkIndex=0; landmarkIndex < numLandmarks; landmarkIndex++) {
-        
-        rbf = RBFValue(&fixedLandmarks->at(landmarkIndex), &physicalPointITK, adaptRadius[landmarkIndex]);
-
-        for (i=0; i<3; i++){
-          buffer[3*imageLinearIndex+i] += coeff[3*landmarkIndex+i] * rbf;
-        }
-      }
-
-    }
-    }
-    }
-
-  }
-
-  float * BSplineRBFFindCoeffs(
-    std::vector< itk::Point<double, 3> > * fixedLandmarks, 
-    std::vector< itk::Point<double, 3> > * movingLandmarks,
-    float * adaptRadius,
-    float stiffness)
-  {
-    float rbfv1, rbfv2;
-    int i, j, k, d;
-    float rbf_prefactor, reg_term, r2, tmp;
-    unsigned int numLandmarks = fixedLandmarks->size();
-
-    float * coeff = (float*) malloc (3 * numLandmarks * sizeof(float));
-
-    typedef vnl_matrix <double> Vnl_matrix;
-    typedef vnl_svd <double> SVDSolverType;
-    Vnl_matrix A, b;
-
-    float RBFRadius = 0.0;
-    for (i=0; i<numLandmarks; i++){
-      RBFRadius += adaptRadius[i];
-    }
-    RBFRadius = RBFRadius / numLandmarks;
-
-    A.set_size (3 * numLandmarks, 3 * numLandmarks);
-    A.fill(0.);
-
-    b.set_size (3 * numLandmarks, 1);
-    b.fill (0.0);
-
-    // right-hand side
-    for (i=0; i<numLandmarks; i++) {
-	  for (j=0; j<numLandmarks; j++) {
-	    rbfv1 = RBFValue (&fixedLandmarks->at(i), &fixedLandmarks->at(j), adaptRadius[j]);
-		
-	    for (d=0;d<3;d++) {
-		    b (3*i +d, 0) -= rbfv1 * (fixedLandmarks->at(j)[d] - movingLandmarks->at(j)[d]);
-	    }
-	  }
-    }
-
-    // matrix
-    for (i = 0; i < numLandmarks; i++) {
-	  for (j = 0; j < numLandmarks; j++) {
-	    tmp = 0;
-	    for (k = 0; k < numLandmarks; k++) {
-
-		  rbfv1 = RBFValue (&fixedLandmarks->at(k), &fixedLandmarks->at(i), adaptRadius[k]);
-		  rbfv2 = RBFValue (&fixedLandmarks->at(k), &fixedLandmarks->at(j), adaptRadius[k]);
-
-		  tmp += rbfv1*rbfv2;
-	    }
-	    for (d=0;d<3;d++){
-		    A(3*i+d, 3*j+d) = tmp;
-	    }
-	  }
-    }
-
-    //add regularization terms to the matrix
-    rbf_prefactor = sqrt(M_PI/2.)*sqrt(M_PI/2.)*sqrt(M_PI/2.)/RBFRadius;
-    for (d=0;d<3;d++) {
-	  for (i=0;i<numLandmarks;i++) {
-	    for (j=0;j<numLandmarks;j++) {
-        tmp = A(3*i+d, 3*j+d);
-        reg_term = 0.;			
-        if (i==j) {
-            reg_term = rbf_prefactor * 15.;
-        }
-        else
-        {
-          // r2 = sq distance between landmarks i,j in mm
-          float d = fixedLandmarks->at(i).EuclideanDistanceTo(fixedLandmarks->at(j));
-          r2 = (d * d) / (adaptRadius[i] * adaptRadius[j]);
-          reg_term = rbf_prefactor * exp(-r2/2.) * (-10 + (r2-5.)*(r2-5.));
-        }
-        A (3*i+d,3*j+d) = tmp + reg_term * stiffness;
-      } 
-	  }
-    }
-
-    SVDSolverType svd (A, 1e-6);
-    Vnl_matrix x = svd.solve (b);
-
-    for (i=0; i<3*numLandmarks; i++) {
-	    coeff[i] = x(i,0);
-    }
-    return coeff;
-  }
-
-
 } // end of anonymous namespace
 
 int main( int argc, char * argv[] )
@@ -210,7 +69,7 @@ int main( int argc, char * argv[] )
     }
   }
 
-  typedef std::vector< itk::Point<double, 3> > PointList;
+  typedef VariableRBF::PointList PointList;
 
   PointList fixedPoints(fixedFiducials.size());
   PointList movingPoints(movingFiducials.size());
@@ -227,7 +86,7 @@ int main( int argc, char * argv[] )
 
   // BSpline coeff
 
-  float * coeff = BSplineRBFFindCoeffs(&fixedPoints, &movingPoints, adaptRadius, stiffness);
+  float * coeff = VariableRBF::BSplineRBFFindCoeffs(&fixedPoints, &movingPoints, adaptRadius, stiffness, cutoffRadiusFactor);
 
   // Create vector field
   sitk::ImageFileReader reader;
@@ -239,7 +98,38 @@ int main( int argc, char * argv[] )
   output.SetSpacing(referenceImage.GetSpacing());
   output.SetDirection(referenceImage.GetDirection());
 
-  RBFGaussUpdateVectorField(&output, coeff, &fixedPoints, adaptRadius);
+  // Update the previous field where coefficients changed, if available
+  int numberOfUpdatedLandmarks = -1;
+  VariableRBF::State state;
+  std::vector<float> representedCoeff;
+  if (!stateDirectory.empty()){
+    sitk::Image previousField;
+    if (VariableRBF::ReadState(stateDirectory, state, previousField)){
+      numberOfUpdatedLandmarks = VariableRBF::UpdateVectorFieldIncrementally(&output, state, previousField, coeff, &fixedPoints, adaptRadius,
+                                                                             cutoffRadiusFactor, numberOfThreads, maximumChangedFraction, representedCoeff);
+    }
+  }
+
+  if (numberOfUpdatedLandmarks < 0){
+    VariableRBF::RBFGaussUpdateVectorField(&output, coeff, &fixedPoints, adaptRadius, cutoffRadiusFactor, numberOfThreads);
+    representedCoeff.assign(coeff, coeff + 3 * numFiducials);
+    std::cout << "Evaluated the displacement field of " << numFiducials << " landmarks" << std::endl;
+  }
+  else{
+    std::cout << "Updated the displacement field of " << numberOfUpdatedLandmarks << " changed landmarks" << std::endl;
+  }
+
+  if (!stateDirectory.empty()){
+    state.Size = output.GetSize();
+    state.Origin = output.GetOrigin();
+    state.Spacing = output.GetSpacing();
+    state.Direction = output.GetDirection();
+    state.CutoffFactor = cutoffRadiusFactor;
+    state.FixedLandmarks = fixedPoints;
+    state.Radius.assign(adaptRadius, adaptRadius + numFiducials);
+    state.Coefficients.swap(representedCoeff);
+    VariableRBF::WriteState(stateDirectory, state, output);
+  }
 
   sitk::WriteImage(output, outputDisplacementField);
 
@@ -0,0 +1,106 @@
+// Compare the reference (brute force) and the multi-threaded displacement field evaluation.
+// Usage: FiducialRegistrationVariableRBFBenchmark [gridSize] [cutoffRadiusFactor] [numberOfThreads] [numLandmarks ...]
+
+#include "VariableRBF.h"
+
+// STD includes
+#include <chrono>
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+#include <random>
+
+namespace sitk = itk::simple;
+
+namespace
+{
+  sitk::Image CreateField(unsigned int gridSize)
+  {
+    std::vector<unsigned int> size(3, gridSize);
+    sitk::Image field(size, sitk::sitkVectorFloat32);
+    field.SetOrigin({-50.0, -60.0, -40.0});
+    field.SetSpacing({100.0 / gridSize, 110.0 / gridSize, 90.0 / gridSize});
+    // slightly oblique direction
+    double c = cos(0.2), s = sin(0.2);
+    field.SetDirection({c, -s, 0, s, c, 0, 0, 0, 1});
+    return field;
+  }
+
+  double ElapsedSeconds(std::chrono::steady_clock::time_point start)
+  {
+    return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+  }
+}
+
+int main(int argc, char * argv[])
+{
+  unsigned int gridSize = argc > 1 ? atoi(argv[1]) : 64;
+  float cutoffRadiusFactor = argc > 2 ? atof(argv[2]) : 4.0;
+  int numberOfThreads = argc > 3 ? atoi(argv[3]) : 0;
+  std::vector<unsigned int> landmarkCounts;
+  for (int a=4; a<argc; a++){
+    landmarkCounts.push_back(atoi(argv[a]));
+  }
+  if (landmarkCounts.empty()){
+    landmarkCounts = {10, 100, 500};
+  }
+
+  std::mt19937 generator(0);
+  std::uniform_real_distribution<double> position(-35.0, 35.0);
+  std::uniform_real_distribution<double> displacement(-3.0, 3.0);
+  std::uniform_real_distribution<float> radius(5.0, 25.0);
+
+  bool success = true;
+
+  for (unsigned int numLandmarks : landmarkCounts){
+
+    VariableRBF::PointList fixedPoints(numLandmarks), movingPoints(numLandmarks);
+    std::vector<float> adaptRadius(numLandmarks);
+    for (unsigned int l=0; l<numLandmarks; l++){
+      for (int d=0; d<3; d++){
+        fixedPoints[l][d] = position(generator);
+        movingPoints[l][d] = fixedPoints[l][d] + displacement(generator);
+      }
+      adaptRadius[l] = radius(generator);
+    }
+
+    float * coeff = VariableRBF::BSplineRBFFindCoeffs(&fixedPoints, &movingPoints, adaptRadius.data(), 0.1, cutoffRadiusFactor);
+
+    sitk::Image referenceField = CreateField(gridSize);
+    auto start = std::chrono::steady_clock::now();
+    VariableRBF::RBFGaussUpdateVectorFieldReference(&referenceField, coeff, &fixedPoints, adaptRadius.data());
+    double referenceTime = ElapsedSeconds(start);
+
+    sitk::Image field = CreateField(gridSize);
+    start = std::chrono::steady_clock::now();
+    VariableRBF::RBFGaussUpdateVectorField(&field, coeff, &fixedPoints, adaptRadius.data(), cutoffRadiusFactor, numberOfThreads);
+    double time = ElapsedSeconds(start);
+
+    free(coeff);
+
+    const float * referenceBuffer = referenceField.GetBufferAsFloat();
+    const float * buffer = field.GetBufferAsFloat();
+    size_t numberOfValues = 3 * static_cast<size_t>(gridSize) * gridSize * gridSize;
+    double maxDifference = 0, maxValue = 0;
+    for (size_t v=0; v<numberOfValues; v++){
+      maxDifference = std::max(maxDifference, static_cast<double>(fabs(referenceBuffer[v] - buffer[v])));
+      maxValue = std::max(maxValue, static_cast<double>(fabs(referenceBuffer[v])));
+    }
+
+    std::cout << "landmarks: " << numLandmarks
+              << " voxels: " << gridSize << "^3"
+              << " reference: " << referenceTime << "s"
+              << " threaded: " << time << "s"
+              << " speedup: " << referenceTime / time
+              << " max abs difference: " << maxDifference
+              << " (max abs displacement: " << maxValue << ")" << std::endl;
+
+    // the truncated tail is bounded by exp(-cutoffRadiusFactor^2) per landmark
+    if (maxDifference > 1e-3 * std::max(1.0, maxValue)){
+      std::cerr << "Displacement field differs from the reference evaluation" << std::endl;
+      success = false;
+    }
+  }
+
+  return success ? EXIT_SUCCESS : EXIT_FAILURE;
+}
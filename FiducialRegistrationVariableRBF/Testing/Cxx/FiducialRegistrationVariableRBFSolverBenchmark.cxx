@@ -0,0 +1,98 @@
+// Time the RBF coefficient solve and compare it against the dense SVD reference.
+// Usage: FiducialRegistrationVariableRBFSolverBenchmark [cutoffRadiusFactor] [maxReferenceLandmarks] [numLandmarks ...]
+
+#include "VariableRBF.h"
+
+// STD includes
+#include <chrono>
+#include <cmath>
+#include <cstdlib>
+#include <iostream>
+#include <random>
+
+namespace
+{
+  const char * SolverName(VariableRBF::SolverType solver)
+  {
+    switch (solver){
+      case VariableRBF::SolverType::Cholesky: return "Cholesky";
+      case VariableRBF::SolverType::ConjugateGradient: return "ConjugateGradient";
+      default: return "SVD";
+    }
+  }
+
+  double ElapsedSeconds(std::chrono::steady_clock::time_point start)
+  {
+    return std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+  }
+}
+
+int main(int argc, char * argv[])
+{
+  float cutoffRadiusFactor = argc > 1 ? atof(argv[1]) : 4.0;
+  unsigned int maxReferenceLandmarks = argc > 2 ? atoi(argv[2]) : 500;
+  std::vector<unsigned int> landmarkCounts;
+  for (int a=3; a<argc; a++){
+    landmarkCounts.push_back(atoi(argv[a]));
+  }
+  if (landmarkCounts.empty()){
+    landmarkCounts = {100, 1000, 5000};
+  }
+
+  std::mt19937 generator(0);
+  std::uniform_real_distribution<double> displacement(-3.0, 3.0);
+  std::uniform_real_distribution<float> radius(5.0, 15.0);
+
+  bool success = true;
+
+  for (unsigned int numLandmarks : landmarkCounts){
+
+    // keep the landmark density constant (one per 30mm cube). Clustered landmarks with overlapping
+    // kernels make the system ill-conditioned, in which case the SVD fallback is reported
+    std::uniform_real_distribution<double> position(0.0, 30.0 * cbrt(static_cast<double>(numLandmarks)));
+
+    VariableRBF::PointList fixedPoints(numLandmarks), movingPoints(numLandmarks);
+    std::vector<float> adaptRadius(numLandmarks);
+    for (unsigned int l=0; l<numLandmarks; l++){
+      for (int d=0; d<3; d++){
+        fixedPoints[l][d] = position(generator);
+        movingPoints[l][d] = fixedPoints[l][d] + displacement(generator);
+      }
+      adaptRadius[l] = radius(generator);
+    }
+
+    VariableRBF::SolverType solver;
+    auto start = std::chrono::steady_clock::now();
+    float * coeff = VariableRBF::BSplineRBFFindCoeffs(&fixedPoints, &movingPoints, adaptRadius.data(), 0.1, cutoffRadiusFactor, &solver);
+    double time = ElapsedSeconds(start);
+
+    std::cout << "landmarks: " << numLandmarks << " solver: " << SolverName(solver) << " time: " << time << "s";
+
+    if (numLandmarks <= maxReferenceLandmarks){
+      start = std::chrono::steady_clock::now();
+      float * referenceCoeff = VariableRBF::BSplineRBFFindCoeffsReference(&fixedPoints, &movingPoints, adaptRadius.data(), 0.1);
+      double referenceTime = ElapsedSeconds(start);
+
+      double differenceNorm = 0, referenceNorm = 0;
+      for (unsigned int i=0; i<3*numLandmarks; i++){
+        differenceNorm += (coeff[i] - referenceCoeff[i]) * (coeff[i] - referenceCoeff[i]);
+        referenceNorm += referenceCoeff[i] * referenceCoeff[i];
+      }
+      double relativeDifference = sqrt(differenceNorm / std::max(referenceNorm, 1e-20));
+      free(referenceCoeff);
+
+      std::cout << " reference: " << referenceTime << "s speedup: " << referenceTime / time
+                << " relative difference: " << relativeDifference;
+
+      if (relativeDifference > 1e-3){
+        std::cerr << std::endl << "Coefficients differ from the reference solution" << std::endl;
+        success = false;
+      }
+    }
+    std::cout << std::endl;
+
+    free(coeff);
+  }
+
+  return success ? EXIT_SUCCESS : EXIT_FAILURE;
+}
@@ -0,0 +1,602 @@
+// Variable radius Gaussian RBF kernels used by FiducialRegistrationVariableRBF.
+// The logic of this computation is taken from plastimatch and modified to use variable RBF Radius.
+// Instead of using plastimatch classes, here ITK and SimpleITK abstractions are used.
+// https://gitlab.com/plastimatch/plastimatch
+
+#include "VariableRBF.h"
+
+// ITK includes
+#include <vnl/algo/vnl_cholesky.h>
+#include <vnl/algo/vnl_svd.h>
+
+// STD includes
+#include <algorithm>
+#include <atomic>
+#include <cmath>
+#include <thread>
+
+#ifndef M_PI
+  #define M_PI 3.14159265358979323846
+#endif
+
+namespace sitk = itk::simple;
+
+namespace
+{
+  // Voxel (i,j,k) is at Origin + i * Step[0] + j * Step[1] + k * Step[2]
+  struct GridGeometry
+  {
+    unsigned int Size[3];
+    double Origin[3];
+    double Step[3][3];
+  };
+
+  GridGeometry GetGridGeometry(sitk::Image * image)
+  {
+    GridGeometry geometry;
+    std::vector<unsigned int> size = image->GetSize();
+    std::vector<double> origin = image->GetOrigin();
+    std::vector<double> spacing = image->GetSpacing();
+    std::vector<double> direction = image->GetDirection();
+    for (int c=0; c<3; c++){
+      geometry.Size[c] = size[c];
+      geometry.Origin[c] = origin[c];
+      for (int r=0; r<3; r++){
+        geometry.Step[c][r] = direction[3*r+c] * spacing[c];
+      }
+    }
+    return geometry;
+  }
+
+  // Voxel index range [Begin, End) covering the support sphere of a landmark
+  struct LandmarkSupport
+  {
+    int Begin[3];
+    int End[3];
+  };
+
+  std::vector<LandmarkSupport> GetLandmarkSupports(
+    const GridGeometry & geometry,
+    VariableRBF::PointList * landmarks,
+    float * adaptRadius,
+    float cutoffFactor)
+  {
+    // inverse of the index to physical matrix, columns are Step[0..2]
+    const double (*m)[3] = geometry.Step;
+    double det = m[0][0] * (m[1][1] * m[2][2] - m[2][1] * m[1][2])
+               - m[1][0] * (m[0][1] * m[2][2] - m[2][1] * m[0][2])
+               + m[2][0] * (m[0][1] * m[1][2] - m[1][1] * m[0][2]);
+    double inv[3][3]; // inv[a][r]: row a maps physical offsets to index a
+    inv[0][0] = (m[1][1] * m[2][2] - m[2][1] * m[1][2]) / det;
+    inv[0][1] = (m[2][0] * m[1][2] - m[1][0] * m[2][2]) / det;
+    inv[0][2] = (m[1][0] * m[2][1] - m[2][0] * m[1][1]) / det;
+    inv[1][0] = (m[2][1] * m[0][2] - m[0][1] * m[2][2]) / det;
+    inv[1][1] = (m[0][0] * m[2][2] - m[2][0] * m[0][2]) / det;
+    inv[1][2] = (m[2][0] * m[0][1] - m[0][0] * m[2][1]) / det;
+    inv[2][0] = (m[0][1] * m[1][2] - m[1][1] * m[0][2]) / det;
+    inv[2][1] = (m[1][0] * m[0][2] - m[0][0] * m[1][2]) / det;
+    inv[2][2] = (m[0][0] * m[1][1] - m[1][0] * m[0][1]) / det;
+
+    double rowNorm[3];
+    for (int a=0; a<3; a++){
+      rowNorm[a] = sqrt(inv[a][0]*inv[a][0] + inv[a][1]*inv[a][1] + inv[a][2]*inv[a][2]);
+    }
+
+    std::vector<LandmarkSupport> supports(landmarks->size());
+    for (size_t l=0; l<landmarks->size(); l++){
+      LandmarkSupport & support = supports[l];
+      for (int a=0; a<3; a++){
+        support.Begin[a] = 0;
+        support.End[a] = geometry.Size[a];
+      }
+      if (cutoffFactor <= 0){
+        continue;
+      }
+      const VariableRBF::PointType & p = landmarks->at(l);
+      double offset[3] = {p[0] - geometry.Origin[0], p[1] - geometry.Origin[1], p[2] - geometry.Origin[2]};
+      double cutoffDistance = cutoffFactor * adaptRadius[l];
+      for (int a=0; a<3; a++){
+        double center = inv[a][0] * offset[0] + inv[a][1] * offset[1] + inv[a][2] * offset[2];
+        double halfExtent = cutoffDistance * rowNorm[a];
+        double begin = std::max(0.0, std::ceil(center - halfExtent));
+        double end = std::min(static_cast<double>(geometry.Size[a]), std::floor(center + halfExtent) + 1);
+        support.Begin[a] = static_cast<int>(begin);
+        support.End[a] = static_cast<int>(std::max(begin, end));
+      }
+    }
+    return supports;
+  }
+
+  // Systems up to this size are factorized densely, larger ones are solved iteratively
+  const unsigned int MaximumDenseLandmarks = 1000;
+  // Below this reciprocal condition number the (pseudo-inverse) SVD solution is used
+  const double MinimumReciprocalCondition = 1e-10;
+
+  // Non zero entries of a row of the symmetric n x n system matrix
+  struct SparseRow
+  {
+    std::vector<unsigned int> Index;
+    std::vector<double> Value;
+  };
+
+  // Value of the kernel centered at landmark k evaluated at landmark i, truncated
+  // beyond cutoffFactor times the kernel radius
+  double KernelValue(VariableRBF::PointList * landmarks, float * adaptRadius, float cutoffFactor, unsigned int k, unsigned int i)
+  {
+    double dist2 = landmarks->at(k).SquaredEuclideanDistanceTo(landmarks->at(i));
+    double radius2 = static_cast<double>(adaptRadius[k]) * adaptRadius[k];
+    if (cutoffFactor > 0 && dist2 > cutoffFactor * cutoffFactor * radius2){
+      return 0;
+    }
+    return exp(-dist2 / radius2);
+  }
+
+  // Build A = P^T P + stiffness * R, where P[k][i] is the kernel of landmark k at landmark i.
+  // The system is block diagonal with the same block for x, y and z, so only the n x n block is
+  // assembled. P is stored by columns of non zero entries and the product is accumulated row by
+  // row, so the cost scales with the overlap of the truncated kernels instead of n^3.
+  std::vector<SparseRow> GetSystemMatrix(VariableRBF::PointList * landmarks, float * adaptRadius, float stiffness, float cutoffFactor)
+  {
+    const unsigned int numLandmarks = landmarks->size();
+
+    // kernels[k]: landmarks reached by kernel k. reached[i]: kernels reaching landmark i
+    std::vector<SparseRow> kernels(numLandmarks), reached(numLandmarks);
+    for (unsigned int k=0; k<numLandmarks; k++){
+      for (unsigned int i=0; i<numLandmarks; i++){
+        double value = KernelValue(landmarks, adaptRadius, cutoffFactor, k, i);
+        if (value > 0){
+          kernels[k].Index.push_back(i);
+          kernels[k].Value.push_back(value);
+          reached[i].Index.push_back(k);
+          reached[i].Value.push_back(value);
+        }
+      }
+    }
+
+    double meanRadius = 0.0;
+    for (unsigned int i=0; i<numLandmarks; i++){
+      meanRadius += adaptRadius[i];
+    }
+    meanRadius = meanRadius / numLandmarks;
+    const double rbf_prefactor = sqrt(M_PI/2.)*sqrt(M_PI/2.)*sqrt(M_PI/2.)/meanRadius;
+    // the regularization term decays as exp(-r2/2), truncate it at twice the kernel cutoff
+    const double regularizationCutoff2 = 4.0 * cutoffFactor * cutoffFactor;
+
+    std::vector<SparseRow> A(numLandmarks);
+    std::vector<double> accumulator(numLandmarks, 0.0);
+    std::vector<char> used(numLandmarks, 0);
+    for (unsigned int i=0; i<numLandmarks; i++){
+      std::vector<unsigned int> & index = A[i].Index;
+      auto add = [&](unsigned int j, double value) {
+        if (!used[j]){
+          used[j] = 1;
+          index.push_back(j);
+        }
+        accumulator[j] += value;
+      };
+
+      for (size_t a=0; a<reached[i].Index.size(); a++){
+        const SparseRow & kernel = kernels[reached[i].Index[a]];
+        for (size_t c=0; c<kernel.Index.size(); c++){
+          add(kernel.Index[c], reached[i].Value[a] * kernel.Value[c]);
+        }
+      }
+
+      if (stiffness != 0){
+        for (unsigned int j=0; j<numLandmarks; j++){
+          double reg_term;
+          if (i==j){
+            reg_term = rbf_prefactor * 15.;
+          }
+          else{
+            // r2 = sq distance between landmarks i,j in mm
+            double r2 = landmarks->at(i).SquaredEuclideanDistanceTo(landmarks->at(j)) / (adaptRadius[i] * adaptRadius[j]);
+            if (cutoffFactor > 0 && r2 > regularizationCutoff2){
+              continue;
+            }
+            reg_term = rbf_prefactor * exp(-r2/2.) * (-10 + (r2-5.)*(r2-5.));
+          }
+          add(j, reg_term * stiffness);
+        }
+      }
+
+      std::sort(index.begin(), index.end());
+      A[i].Value.resize(index.size());
+      for (size_t c=0; c<index.size(); c++){
+        A[i].Value[c] = accumulator[index[c]];
+        accumulator[index[c]] = 0;
+        used[index[c]] = 0;
+      }
+    }
+    return A;
+  }
+
+  vnl_matrix<double> ToDense(const std::vector<SparseRow> & A)
+  {
+    vnl_matrix<double> dense(A.size(), A.size(), 0.0);
+    for (size_t i=0; i<A.size(); i++){
+      for (size_t c=0; c<A[i].Index.size(); c++){
+        dense(i, A[i].Index[c]) = A[i].Value[c];
+      }
+    }
+    return dense;
+  }
+
+  // Jacobi preconditioned conjugate gradient for each column of b. Returns false if any
+  // column does not converge or the matrix is found not to be positive definite.
+  bool ConjugateGradient(const std::vector<SparseRow> & A, const vnl_matrix<double> & b, vnl_matrix<double> & x)
+  {
+    const size_t n = A.size();
+    const unsigned int maximumIterations = std::max<size_t>(1000, n);
+    const double tolerance = 1e-8;
+
+    std::vector<double> inverseDiagonal(n, 0.0);
+    for (size_t i=0; i<n; i++){
+      for (size_t c=0; c<A[i].Index.size(); c++){
+        if (A[i].Index[c] == i && A[i].Value[c] > 0){
+          inverseDiagonal[i] = 1.0 / A[i].Value[c];
+        }
+      }
+      if (inverseDiagonal[i] == 0){
+        return false;
+      }
+    }
+
+    auto multiply = [&](const std::vector<double> & v, std::vector<double> & result) {
+      for (size_t i=0; i<n; i++){
+        double sum = 0;
+        for (size_t c=0; c<A[i].Index.size(); c++){
+          sum += A[i].Value[c] * v[A[i].Index[c]];
+        }
+        result[i] = sum;
+      }
+    };
+    auto dot = [&](const std::vector<double> & u, const std::vector<double> & v) {
+      double sum = 0;
+      for (size_t i=0; i<n; i++){
+        sum += u[i] * v[i];
+      }
+      return sum;
+    };
+
+    x.set_size(n, b.cols());
+    std::vector<double> solution(n), residual(n), preconditioned(n), direction(n), product(n);
+    for (unsigned int d=0; d<b.cols(); d++){
+      for (size_t i=0; i<n; i++){
+        solution[i] = 0;
+        residual[i] = b(i, d);
+        preconditioned[i] = inverseDiagonal[i] * residual[i];
+        direction[i] = preconditioned[i];
+      }
+      const double bNorm = sqrt(dot(residual, residual));
+      double rz = dot(residual, preconditioned);
+      bool converged = bNorm == 0;
+      for (unsigned int iteration=0; iteration<maximumIterations && !converged; iteration++){
+        multiply(direction, product);
+        double curvature = dot(direction, product);
+        if (curvature <= 0){
+          return false;
+        }
+        double alpha = rz / curvature;
+        for (size_t i=0; i<n; i++){
+          solution[i] += alpha * direction[i];
+          residual[i] -= alpha * product[i];
+        }
+        converged = sqrt(dot(residual, residual)) <= tolerance * bNorm;
+        for (size_t i=0; i<n; i++){
+          preconditioned[i] = inverseDiagonal[i] * residual[i];
+        }
+        double rzNext = dot(residual, preconditioned);
+        for (size_t i=0; i<n; i++){
+          direction[i] = preconditioned[i] + (rzNext / rz) * direction[i];
+        }
+        rz = rzNext;
+      }
+      if (!converged){
+        return false;
+      }
+      for (size_t i=0; i<n; i++){
+        x(i, d) = solution[i];
+      }
+    }
+    return true;
+  }
+
+  unsigned int GetNumberOfThreads(int numberOfThreads, unsigned int numberOfJobs)
+  {
+    unsigned int n = numberOfThreads > 0 ? numberOfThreads : std::thread::hardware_concurrency();
+    return std::max(1u, std::min(n, numberOfJobs));
+  }
+
+  // Run sliceFunction(k) for every k in [0, numberOfSlices) distributing slices dynamically over the threads
+  template <typename TFunction>
+  void ParallelForSlices(unsigned int numberOfSlices, int numberOfThreads, TFunction sliceFunction)
+  {
+    std::atomic<unsigned int> nextSlice(0);
+    auto worker = [&]() {
+      for (unsigned int k = nextSlice++; k < numberOfSlices; k = nextSlice++){
+        sliceFunction(k);
+      }
+    };
+    unsigned int n = GetNumberOfThreads(numberOfThreads, numberOfSlices);
+    std::vector<std::thread> threads;
+    for (unsigned int t=1; t<n; t++){
+      threads.emplace_back(worker);
+    }
+    worker();
+    for (auto & thread : threads){
+      thread.join();
+    }
+  }
+}
+
+namespace VariableRBF
+{
+  float RBFValue(const PointType * rbf_center, const PointType * loc, float radius)
+  {
+    float r = rbf_center->EuclideanDistanceTo(*loc) / radius;
+    float val = exp( -r*r );
+    return val;
+  }
+
+  void RBFGaussUpdateVectorFieldReference(
+    sitk::Image *vectorField,
+    float *coeff,
+    PointList * fixedLandmarks,
+    float * adaptRadius)
+  {
+    unsigned int i, landmarkIndex, imageLinearIndex;
+    float rbf;
+    unsigned int numLandmarks = fixedLandmarks->size();
+
+    PointType physicalPointITK;
+    std::vector<double> physicalPoint;
+
+    std::vector<unsigned int> size = vectorField->GetSize();
+    float * buffer = vectorField->GetBufferAsFloat();
+    std::vector<itk::int64_t> ijk {0,0,0};
+
+    for(ijk[0]=0; ijk[0]<size[0]; ijk[0]=ijk[0]+1){
+    for(ijk[1]=0; ijk[1]<size[1]; ijk[1]=ijk[1]+1){
+    for(ijk[2]=0; ijk[2]<size[2]; ijk[2]=ijk[2]+1){
+
+      physicalPoint = vectorField->TransformIndexToPhysicalPoint(ijk);
+      for (i=0; i<3; i++){
+        physicalPointITK[i] = physicalPoint[i];
+      }
+
+      imageLinearIndex = ijk[0] + (size[0] * (ijk[1] + size[1] * ijk[2]));
+
+      for (landmarkIndex=0; landmarkIndex < numLandmarks; landmarkIndex++) {
+
+        rbf = RBFValue(&fixedLandmarks->at(landmarkIndex), &physicalPointITK, adaptRadius[landmarkIndex]);
+
+        for (i=0; i<3; i++){
+          buffer[3*imageLinearIndex+i] += coeff[3*landmarkIndex+i] * rbf;
+        }
+      }
+
+    }
+    }
+    }
+
+  }
+
+  void RBFGaussUpdateVectorField(
+    sitk::Image *vectorField,
+    float *coeff,
+    PointList * fixedLandmarks,
+    float * adaptRadius,
+    float cutoffFactor,
+    int numberOfThreads)
+  {
+    const unsigned int numLandmarks = fixedLandmarks->size();
+    const GridGeometry geometry = GetGridGeometry(vectorField);
+    const std::vector<LandmarkSupport> supports = GetLandmarkSupports(geometry, fixedLandmarks, adaptRadius, cutoffFactor);
+    float * buffer = vectorField->GetBufferAsFloat();
+    const bool truncate = cutoffFactor > 0;
+
+    // index: landmarks touching each slice, in landmark order so that each voxel
+    // accumulates the contributions in the same order as the reference evaluation
+    std::vector< std::vector<unsigned int> > sliceLandmarks(geometry.Size[2]);
+    for (unsigned int l=0; l<numLandmarks; l++){
+      for (int k=supports[l].Begin[2]; k<supports[l].End[2]; k++){
+        sliceLandmarks[k].push_back(l);
+      }
+    }
+
+    std::vector<double> invRadius2(numLandmarks), cutoffDistance2(numLandmarks);
+    for (unsigned int l=0; l<numLandmarks; l++){
+      invRadius2[l] = 1.0 / (static_cast<double>(adaptRadius[l]) * adaptRadius[l]);
+      cutoffDistance2[l] = static_cast<double>(cutoffFactor * adaptRadius[l]) * (cutoffFactor * adaptRadius[l]);
+    }
+
+    ParallelForSlices(geometry.Size[2], numberOfThreads, [&](unsigned int k) {
+
+      const size_t sliceOffset = static_cast<size_t>(geometry.Size[0]) * geometry.Size[1] * k;
+
+      for (unsigned int l : sliceLandmarks[k]){
+
+        const LandmarkSupport & support = supports[l];
+        const PointType & p = fixedLandmarks->at(l);
+        const float c[3] = {coeff[3*l+0], coeff[3*l+1], coeff[3*l+2]};
+
+        // landmark to voxel (Begin[0], j, k) vector, updated incrementally
+        double rowStart[3];
+        for (int d=0; d<3; d++){
+          rowStart[d] = geometry.Origin[d] + k * geometry.Step[2][d] + support.Begin[0] * geometry.Step[0][d] - p[d];
+        }
+
+        for (int j=support.Begin[1]; j<support.End[1]; j++){
+
+          double v[3];
+          for (int d=0; d<3; d++){
+            v[d] = rowStart[d] + j * geometry.Step[1][d];
+          }
+          float * voxel = buffer + 3 * (sliceOffset + static_cast<size_t>(geometry.Size[0]) * j + support.Begin[0]);
+
+          for (int i=support.Begin[0]; i<support.End[0]; i++, voxel+=3){
+            double dist2 = v[0]*v[0] + v[1]*v[1] + v[2]*v[2];
+            for (int d=0; d<3; d++){
+              v[d] += geometry.Step[0][d];
+            }
+            if (truncate && dist2 > cutoffDistance2[l]){
+              continue;
+            }
+            float rbf = exp(-dist2 * invRadius2[l]);
+            voxel[0] += c[0] * rbf;
+            voxel[1] += c[1] * rbf;
+            voxel[2] += c[2] * rbf;
+          }
+        }
+      }
+    });
+  }
+
+  float * BSplineRBFFindCoeffs(
+    PointList * fixedLandmarks,
+    PointList * movingLandmarks,
+    float * adaptRadius,
+    float stiffness,
+    float cutoffFactor,
+    SolverType * usedSolver)
+  {
+    const unsigned int numLandmarks = fixedLandmarks->size();
+    const std::vector<SparseRow> A = GetSystemMatrix(fixedLandmarks, adaptRadius, stiffness, cutoffFactor);
+
+    // right-hand side b = - P^T (fixed - moving), one column per axis
+    vnl_matrix<double> b(numLandmarks, 3, 0.0);
+    for (unsigned int j=0; j<numLandmarks; j++){
+      for (unsigned int i=0; i<numLandmarks; i++){
+        double value = KernelValue(fixedLandmarks, adaptRadius, cutoffFactor, j, i);
+        for (int d=0; d<3; d++){
+          b(i, d) -= value * (fixedLandmarks->at(j)[d] - movingLandmarks->at(j)[d]);
+        }
+      }
+    }
+
+    vnl_matrix<double> x;
+    SolverType solver = SolverType::SVD;
+    if (numLandmarks <= MaximumDenseLandmarks){
+      vnl_matrix<double> dense = ToDense(A);
+      vnl_cholesky cholesky(dense, vnl_cholesky::estimate_condition);
+      if (cholesky.rank_deficiency() == 0 && cholesky.rcond() > MinimumReciprocalCondition){
+        x.set_size(numLandmarks, 3);
+        for (int d=0; d<3; d++){
+          x.set_column(d, cholesky.solve(b.get_column(d)));
+        }
+        solver = SolverType::Cholesky;
+      }
+      else{
+        x = vnl_svd<double>(dense, 1e-6).solve(b);
+      }
+    }
+    else if (ConjugateGradient(A, b, x)){
+      solver = SolverType::ConjugateGradient;
+    }
+    else{
+      x = vnl_svd<double>(ToDense(A), 1e-6).solve(b);
+    }
+
+    if (usedSolver){
+      *usedSolver = solver;
+    }
+
+    float * coeff = (float*) malloc (3 * numLandmarks * sizeof(float));
+    for (unsigned int i=0; i<numLandmarks; i++){
+      for (int d=0; d<3; d++){
+        coeff[3*i+d] = x(i, d);
+      }
+    }
+    return coeff;
+  }
+
+  float * BSplineRBFFindCoeffsReference(
+    PointList * fixedLandmarks,
+    PointList * movingLandmarks,
+    float * adaptRadius,
+    float stiffness)
+  {
+    float rbfv1, rbfv2;
+    int i, j, k, d;
+    float rbf_prefactor, reg_term, r2, tmp;
+    unsigned int numLandmarks = fixedLandmarks->size();
+
+    float * coeff = (float*) malloc (3 * numLandmarks * sizeof(float));
+
+    typedef vnl_matrix <double> Vnl_matrix;
+    typedef vnl_svd <double> SVDSolverType;
+    Vnl_matrix A, b;
+
+    float RBFRadius = 0.0;
+    for (i=0; i<numLandmarks; i++){
+      RBFRadius += adaptRadius[i];
+    }
+    RBFRadius = RBFRadius / numLandmarks;
+
+    A.set_size (3 * numLandmarks, 3 * numLandmarks);
+    A.fill(0.);
+
+    b.set_size (3 * numLandmarks, 1);
+    b.fill (0.0);
+
+    // right-hand side
+    for (i=0; i<numLandmarks; i++) {
+	  for (j=0; j<numLandmarks; j++) {
+	    rbfv1 = RBFValue (&fixedLandmarks->at(i), &fixedLandmarks->at(j), adaptRadius[j]);
+
+	    for (d=0;d<3;d++) {
+		    b (3*i +d, 0) -= rbfv1 * (fixedLandmarks->at(j)[d] - movingLandmarks->at(j)[d]);
+	    }
+	  }
+    }
+
+    // matrix
+    for (i = 0; i < numLandmarks; i++) {
+	  for (j = 0; j < numLandmarks; j++) {
+	    tmp = 0;
+	    for (k = 0; k < numLandmarks; k++) {
+
+		  rbfv1 = RBFValue (&fixedLandmarks->at(k), &fixedLandmarks->at(i), adaptRadius[k]);
+		  rbfv2 = RBFValue (&fixedLandmarks->at(k), &fixedLandmarks->at(j), adaptRadius[k]);
+
+		  tmp += rbfv1*rbfv2;
+	    }
+	    for (d=0;d<3;d++){
+		    A(3*i+d, 3*j+d) = tmp;
+	    }
+	  }
+    }
+
+    //add regularization terms to the matrix
+    rbf_prefactor = sqrt(M_PI/2.)*sqrt(M_PI/2.)*sqrt(M_PI/2.)/RBFRadius;
+    for (d=0;d<3;d++) {
+	  for (i=0;i<numLandmarks;i++) {
+	    for (j=0;j<numLandmarks;j++) {
+        tmp = A(3*i+d, 3*j+d);
+        reg_term = 0.;
+        if (i==j) {
+            reg_term = rbf_prefactor * 15.;
+        }
+        else
+        {
+          // r2 = sq distance between landmarks i,j in mm
+          float d = fixedLandmarks->at(i).EuclideanDistanceTo(fixedLandmarks->at(j));
+          r2 = (d * d) / (adaptRadius[i] * adaptRadius[j]);
+          reg_term = rbf_prefactor * exp(-r2/2.) * (-10 + (r2-5.)*(r2-5.));
+        }
+        A (3*i+d,3*j+d) = tmp + reg_term * stiffness;
+      }
+	  }
+    }
+
+    SVDSolverType svd (A, 1e-6);
+    Vnl_matrix x = svd.solve (b);
+
+    for (i=0; i<3*numLandmarks; i++) {
+	    coeff[i] = x(i,0);
+    }
+    return coeff;
+  }
+
+} // end of VariableRBF namespace
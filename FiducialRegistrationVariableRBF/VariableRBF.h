@@ -0,0 +1,73 @@
+// Variable radius Gaussian RBF kernels used by FiducialRegistrationVariableRBF.
+// The logic of this computation is taken from plastimatch and modified to use variable RBF Radius.
+// https://gitlab.com/plastimatch/plastimatch
+
+#ifndef __VariableRBF_h
+#define __VariableRBF_h
+
+// ITK includes
+#include <itkPoint.h>
+
+#include "SimpleITK.h"
+
+// STD includes
+#include <vector>
+
+namespace VariableRBF
+{
+  typedef itk::Point<double, 3> PointType;
+  typedef std::vector< PointType > PointList;
+
+  float RBFValue(const PointType * rbf_center, const PointType * loc, float radius);
+
+  enum class SolverType
+  {
+    Cholesky,
+    ConjugateGradient,
+    SVD
+  };
+
+  // Solve the landmark system and return 3 * numLandmarks coefficients (caller frees).
+  // The n x n Gram matrix is assembled once and shared by x, y and z. Kernels are truncated at
+  // cutoffFactor * adaptRadius (<= 0 disables it) so the matrix is sparse for spread landmarks.
+  // Small systems use a dense Cholesky factorization, large ones Jacobi preconditioned conjugate
+  // gradient, and SVD is kept as fallback for ill-conditioned systems. usedSolver is optional.
+  float * BSplineRBFFindCoeffs(
+    PointList * fixedLandmarks,
+    PointList * movingLandmarks,
+    float * adaptRadius,
+    float stiffness,
+    float cutoffFactor,
+    SolverType * usedSolver = nullptr);
+
+  // Dense 3n x 3n assembly solved with SVD. Kept as reference for testing and benchmarking.
+  float * BSplineRBFFindCoeffsReference(
+    PointList * fixedLandmarks,
+    PointList * movingLandmarks,
+    float * adaptRadius,
+    float stiffness);
+
+  // Brute force evaluation visiting every landmark for every voxel on a single thread.
+  // Kept as reference for testing and benchmarking.
+  void RBFGaussUpdateVectorFieldReference(
+    itk::simple::Image * vectorField,
+    float * coeff,
+    PointList * fixedLandmarks,
+    float * adaptRadius);
+
+  // Multi-threaded evaluation. Each landmark only writes into the voxel sub-block bounding its
+  // support sphere of radius cutoffFactor * adaptRadius, so the cost scales with the total support
+  // volume instead of voxels times landmarks. Landmarks are indexed per slice and slices are
+  // distributed over the threads. A cutoffFactor <= 0 disables the truncation.
+  // numberOfThreads <= 0 uses all available cores.
+  void RBFGaussUpdateVectorField(
+    itk::simple::Image * vectorField,
+    float * coeff,
+    PointList * fixedLandmarks,
+    float * adaptRadius,
+    float cutoffFactor,
+    int numberOfThreads);
+
+} // end of VariableRBF namespace
+
+#endif
@@ -0,0 +1,231 @@
+// Persistent solution of FiducialRegistrationVariableRBF, used to update the displacement
+// field incrementally when only a few landmarks change between consecutive runs.
+
+#include "VariableRBFState.h"
+
+// ITK includes
+#include <itksys/SystemTools.hxx>
+
+// STD includes
+#include <algorithm>
+#include <array>
+#include <cmath>
+#include <fstream>
+#include <limits>
+#include <map>
+
+namespace sitk = itk::simple;
+
+namespace
+{
+  const char * StateFileName = "/VariableRBFState.txt";
+  const char * FieldFileName = "/VariableRBFField.nrrd";
+  const int StateVersion = 1;
+
+  // Coefficient changes below this fraction of the largest coefficient are ignored
+  const float CoefficientTolerance = 1e-4;
+
+  template <typename T>
+  bool ReadValues(std::istream & stream, const std::string & name, std::vector<T> & values, size_t count)
+  {
+    std::string key;
+    stream >> key;
+    if (key != name){
+      return false;
+    }
+    values.resize(count);
+    for (size_t i=0; i<count; i++){
+      stream >> values[i];
+    }
+    return !stream.fail();
+  }
+
+  template <typename T>
+  void WriteValues(std::ostream & stream, const std::string & name, const std::vector<T> & values)
+  {
+    stream << name;
+    for (const T & value : values){
+      stream << " " << value;
+    }
+    stream << "\n";
+  }
+
+  bool SameValues(const std::vector<double> & a, const std::vector<double> & b)
+  {
+    if (a.size() != b.size()){
+      return false;
+    }
+    for (size_t i=0; i<a.size(); i++){
+      if (fabs(a[i] - b[i]) > 1e-5 * std::max(1.0, fabs(a[i]))){
+        return false;
+      }
+    }
+    return true;
+  }
+}
+
+namespace VariableRBF
+{
+  bool ReadState(const std::string & directory, State & state, sitk::Image & vectorField)
+  {
+    std::ifstream stream(directory + StateFileName);
+    if (!stream.is_open() || !itksys::SystemTools::FileExists(directory + FieldFileName)){
+      return false;
+    }
+
+    std::string key;
+    int version = 0;
+    size_t numLandmarks = 0;
+    stream >> key >> version;
+    if (key != "version" || version != StateVersion){
+      return false;
+    }
+    if (!ReadValues(stream, "size", state.Size, 3) ||
+        !ReadValues(stream, "origin", state.Origin, 3) ||
+        !ReadValues(stream, "spacing", state.Spacing, 3) ||
+        !ReadValues(stream, "direction", state.Direction, 9)){
+      return false;
+    }
+    stream >> key >> state.CutoffFactor;
+    if (key != "cutoffFactor"){
+      return false;
+    }
+    stream >> key >> numLandmarks;
+    if (key != "landmarks" || stream.fail()){
+      return false;
+    }
+    state.FixedLandmarks.resize(numLandmarks);
+    state.Radius.resize(numLandmarks);
+    state.Coefficients.resize(3 * numLandmarks);
+    for (size_t l=0; l<numLandmarks; l++){
+      stream >> state.FixedLandmarks[l][0] >> state.FixedLandmarks[l][1] >> state.FixedLandmarks[l][2] >> state.Radius[l]
+             >> state.Coefficients[3*l+0] >> state.Coefficients[3*l+1] >> state.Coefficients[3*l+2];
+    }
+    if (stream.fail()){
+      return false;
+    }
+
+    vectorField = sitk::ReadImage(directory + FieldFileName);
+    return vectorField.GetPixelID() == sitk::sitkVectorFloat32 && vectorField.GetSize() == state.Size;
+  }
+
+  void WriteState(const std::string & directory, const State & state, const sitk::Image & vectorField)
+  {
+    itksys::SystemTools::MakeDirectory(directory);
+    // remove the previous state first so that an interrupted write is never read back
+    itksys::SystemTools::RemoveFile(directory + StateFileName);
+    sitk::WriteImage(vectorField, directory + FieldFileName);
+
+    std::ofstream stream(directory + StateFileName);
+    stream.precision(std::numeric_limits<double>::max_digits10);
+    stream << "version " << StateVersion << "\n";
+    WriteValues(stream, "size", state.Size);
+    WriteValues(stream, "origin", state.Origin);
+    WriteValues(stream, "spacing", state.Spacing);
+    WriteValues(stream, "direction", state.Direction);
+    stream << "cutoffFactor " << state.CutoffFactor << "\n";
+    stream << "landmarks " << state.FixedLandmarks.size() << "\n";
+    for (size_t l=0; l<state.FixedLandmarks.size(); l++){
+      stream << state.FixedLandmarks[l][0] << " " << state.FixedLandmarks[l][1] << " " << state.FixedLandmarks[l][2] << " "
+             << state.Radius[l] << " "
+             << state.Coefficients[3*l+0] << " " << state.Coefficients[3*l+1] << " " << state.Coefficients[3*l+2] << "\n";
+    }
+  }
+
+  int UpdateVectorFieldIncrementally(
+    sitk::Image * vectorField,
+    const State & previousState,
+    sitk::Image & previousField,
+    float * coeff,
+    PointList * fixedLandmarks,
+    float * adaptRadius,
+    float cutoffFactor,
+    int numberOfThreads,
+    float maximumChangedFraction,
+    std::vector<float> & representedCoeff)
+  {
+    if (cutoffFactor <= 0 || previousState.CutoffFactor != cutoffFactor ||
+        vectorField->GetSize() != previousState.Size ||
+        !SameValues(vectorField->GetOrigin(), previousState.Origin) ||
+        !SameValues(vectorField->GetSpacing(), previousState.Spacing) ||
+        !SameValues(vectorField->GetDirection(), previousState.Direction)){
+      return -1;
+    }
+
+    const size_t numLandmarks = fixedLandmarks->size();
+    const size_t numPreviousLandmarks = previousState.FixedLandmarks.size();
+
+    float maximumCoefficient = 0;
+    for (size_t i=0; i<3*numLandmarks; i++){
+      maximumCoefficient = std::max(maximumCoefficient, std::fabs(coeff[i]));
+    }
+    for (float c : previousState.Coefficients){
+      maximumCoefficient = std::max(maximumCoefficient, std::fabs(c));
+    }
+    const float tolerance = CoefficientTolerance * maximumCoefficient;
+
+    // previous landmarks by position and radius
+    typedef std::array<double, 4> KeyType;
+    std::map< KeyType, std::vector<size_t> > previousLandmarks;
+    for (size_t l=numPreviousLandmarks; l-- > 0;){
+      const PointType & p = previousState.FixedLandmarks[l];
+      previousLandmarks[KeyType{{p[0], p[1], p[2], previousState.Radius[l]}}].push_back(l);
+    }
+
+    PointList changedLandmarks;
+    std::vector<float> changedRadius, changedCoefficients;
+    auto addChange = [&](const PointType & p, float radius, const float delta[3], float minimumDelta) {
+      if (std::fabs(delta[0]) > minimumDelta || std::fabs(delta[1]) > minimumDelta || std::fabs(delta[2]) > minimumDelta){
+        changedLandmarks.push_back(p);
+        changedRadius.push_back(radius);
+        changedCoefficients.insert(changedCoefficients.end(), delta, delta + 3);
+        return true;
+      }
+      return false;
+    };
+
+    std::vector<float> represented(coeff, coeff + 3 * numLandmarks);
+
+    std::vector<char> matched(numPreviousLandmarks, 0);
+    for (size_t l=0; l<numLandmarks; l++){
+      const PointType & p = fixedLandmarks->at(l);
+      float delta[3] = {coeff[3*l+0], coeff[3*l+1], coeff[3*l+2]};
+      auto found = previousLandmarks.find(KeyType{{p[0], p[1], p[2], adaptRadius[l]}});
+      if (found != previousLandmarks.end() && !found->second.empty()){
+        size_t m = found->second.back();
+        found->second.pop_back();
+        matched[m] = 1;
+        for (int d=0; d<3; d++){
+          delta[d] -= previousState.Coefficients[3*m+d];
+        }
+        if (!addChange(p, adaptRadius[l], delta, tolerance)){
+          std::copy(&previousState.Coefficients[3*m], &previousState.Coefficients[3*m] + 3, &represented[3*l]);
+        }
+      }
+      else if (!addChange(p, adaptRadius[l], delta, tolerance)){
+        std::fill(&represented[3*l], &represented[3*l] + 3, 0.0f);
+      }
+    }
+    for (size_t m=0; m<numPreviousLandmarks; m++){
+      if (!matched[m]){
+        // removed landmarks are always subtracted, their residual would not be represented by any current landmark
+        const float delta[3] = {-previousState.Coefficients[3*m+0], -previousState.Coefficients[3*m+1], -previousState.Coefficients[3*m+2]};
+        addChange(previousState.FixedLandmarks[m], previousState.Radius[m], delta, 0.0f);
+      }
+    }
+
+    if (changedLandmarks.size() > maximumChangedFraction * std::max(numLandmarks, numPreviousLandmarks)){
+      return -1;
+    }
+
+    const size_t numberOfValues = 3 * static_cast<size_t>(previousState.Size[0]) * previousState.Size[1] * previousState.Size[2];
+    std::copy(previousField.GetBufferAsFloat(), previousField.GetBufferAsFloat() + numberOfValues, vectorField->GetBufferAsFloat());
+
+    if (!changedLandmarks.empty()){
+      RBFGaussUpdateVectorField(vectorField, changedCoefficients.data(), &changedLandmarks, changedRadius.data(), cutoffFactor, numberOfThreads);
+    }
+    representedCoeff.swap(represented);
+    return changedLandmarks.size();
+  }
+
+} // end of VariableRBF namespace
@@ -0,0 +1,56 @@
+// Persistent solution of FiducialRegistrationVariableRBF, used to update the displacement
+// field incrementally when only a few landmarks change between consecutive runs.
+
+#ifndef __VariableRBFState_h
+#define __VariableRBFState_h
+
+#include "VariableRBF.h"
+
+// STD includes
+#include <string>
+
+namespace VariableRBF
+{
+  // Landmarks, radius and coefficients used to compute a displacement field, together with the
+  // field geometry. The field itself is stored next to it.
+  struct State
+  {
+    std::vector<unsigned int> Size;
+    std::vector<double> Origin;
+    std::vector<double> Spacing;
+    std::vector<double> Direction;
+    float CutoffFactor;
+    PointList FixedLandmarks;
+    std::vector<float> Radius;
+    std::vector<float> Coefficients;
+  };
+
+  // Read the state and displacement field stored in directory. Returns false if not available.
+  bool ReadState(const std::string & directory, State & state, itk::simple::Image & vectorField);
+
+  void WriteState(const std::string & directory, const State & state, const itk::simple::Image & vectorField);
+
+  // Set vectorField to the field of the new coefficients starting from previousField, the field of
+  // previousState. Landmarks are matched by position and radius, and only the ones whose
+  // coefficients changed (including added and removed ones) are evaluated, with their coefficient
+  // difference. Changes of current landmarks negligible compared to the largest coefficient are
+  // skipped and representedCoeff is set to the coefficients actually represented by vectorField, to
+  // be stored in the next state so that skipped changes never accumulate. Removed landmarks are
+  // always subtracted, as they have no coefficient to carry their residual. Returns the number of evaluated
+  // landmarks, or -1 if the geometry of vectorField does not match the previous one or more than
+  // maximumChangedFraction of the landmarks changed, in which case vectorField is left untouched.
+  int UpdateVectorFieldIncrementally(
+    itk::simple::Image * vectorField,
+    const State & previousState,
+    itk::simple::Image & previousField,
+    float * coeff,
+    PointList * fixedLandmarks,
+    float * adaptRadius,
+    float cutoffFactor,
+    int numberOfThreads,
+    float maximumChangedFraction,
+    std::vector<float> & representedCoeff);
+
+} // end of VariableRBF namespace
+
+#endif
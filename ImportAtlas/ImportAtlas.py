@@ -148,11 +148,22 @@ class ImportAtlasLogic(ScriptedLoadableModuleLogic):
     shNode.SetItemDataNode(folderID, displayNode)
     shNode.ItemModified(folderID)
 
-  def readAtlas(self, atlasPath, atlasName=None):
+  def readAtlas(self, atlasPath, atlasName=None, cache=None, lazy=None):
     """
     Run the actual algorithm
+    cache: optional object with get(key) and add(key, value, memorySize) keeping
+    the structures poly data between calls (see WarpDrive DataCache)
+    lazy: hidden structures are created as empty placeholder nodes and their geometry is
+    built when first shown. Defaults to the lazyAtlasLoading preference (off unless enabled).
+    The slice intersections of the models use a decimated mesh if the atlasDecimation
+    preference (target reduction in percent) is set.
     """
 
+    from NetstimPreferences import LazyAtlasLoading, AtlasDecimation
+    if lazy is None:
+      lazy = LazyAtlasLoading().getValue()
+    targetReduction = AtlasDecimation().getValue() / 100.0
+
     atlasName = atlasName if atlasName else os.path.basename(os.path.dirname(atlasPath))
 
     shNode = slicer.mrmlScene.GetSubjectHierarchyNode()
@@ -162,6 +173,19 @@ class ImportAtlasLogic(ScriptedLoadableModuleLogic):
 
     atlas = LeadDBSAtlas(atlasPath)
 
+    structureSides = []
+    for structure in atlas.structures:
+      if lazy and not structure.isInitiallyVisible():
+        continue
+      if structure.isBilateral():
+        structureSides.extend([(structure, 0), (structure, 1)])
+      else:
+        structureSides.append((structure, 1 if structure.type == 2 else 0))
+    polyDatas = atlas.getStructuresPolyData(structureSides, cache)
+    decimatedPolyDatas = atlas.getStructuresDecimatedPolyData(structureSides, polyDatas, targetReduction, cache) if targetReduction else {}
+    lazyLoader = LazyStructureLoader(atlas, cache, targetReduction)
+
+    # nodes are created in the main thread
     for structure in atlas.structures:
       
       if structure.isBilateral():
@@ -177,14 +201,90 @@ class ImportAtlasLogic(ScriptedLoadableModuleLogic):
         sideIndexes = [1] if structure.type == 2 else [0]
         subFolderID = folderID
 
+      sideNodes = []
       for sideIndex, sideName in zip(sideIndexes, subName):
-        node = structure.getStructureNode(sideIndex)
+        # nodes get their own poly data, sharing the arrays of the built (and maybe cached) one
+        nodePolyData = vtk.vtkPolyData()
+        if (structure.index, sideIndex) in polyDatas:
+          nodePolyData.ShallowCopy(polyDatas[(structure.index, sideIndex)])
+        node = structure.createNode(nodePolyData)
         node.SetName(sideName)
+        if (structure.index, sideIndex) in decimatedPolyDatas:
+          structure.setSliceIntersectionPolyData(node, decimatedPolyDatas[(structure.index, sideIndex)])
         shNode.SetItemParent(shNode.GetItemChildWithName(shNode.GetSceneItemID(), sideName), subFolderID)
         shNode.SetItemAttribute(shNode.GetItemByDataNode(node), 'atlas', '1')
+        sideNodes.append((node, sideIndex))
+
+      if (structure.index, sideIndexes[0]) not in polyDatas:
+        lazyLoader.addStructure(structure, sideNodes, shNode.GetItemDataNode(subFolderID) if structure.isBilateral() else None)
 
     return folderID
 
+#
+# Lazy loading
+#
+
+class LazyStructureLoader:
+  """
+  Builds the geometry of placeholder atlas nodes the first time they, or their structure
+  folder, are made visible. Only node IDs are kept so that the observers don't keep the
+  nodes alive after they are removed from the scene.
+  """
+
+  def __init__(self, atlas, cache=None, targetReduction=0):
+    self.atlas = atlas
+    self.cache = cache
+    self.targetReduction = targetReduction
+    self.pending = {} # node ID -> (structure, sideIndex)
+    self.observations = [] # (display node ID, observer tag)
+
+  def addStructure(self, structure, sideNodes, folderDisplayNode=None):
+    nodeIDs = []
+    for node, sideIndex in sideNodes:
+      self.pending[node.GetID()] = (structure, sideIndex)
+      self.observe(node.GetDisplayNode(), [node.GetID()])
+      nodeIDs.append(node.GetID())
+    if folderDisplayNode is not None:
+      self.observe(folderDisplayNode, nodeIDs)
+
+  def observe(self, displayNode, nodeIDs):
+    tag = displayNode.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda caller, event, nodeIDs=nodeIDs: self.onDisplayNodeModified(caller, nodeIDs))
+    self.observations.append((displayNode.GetID(), tag))
+
+  def onDisplayNodeModified(self, displayNode, nodeIDs):
+    if displayNode.GetVisibility():
+      self.loadNodes([nodeID for nodeID in nodeIDs if nodeID in self.pending])
+
+  def loadNodes(self, nodeIDs):
+    if not nodeIDs:
+      return
+    structureSides = [self.pending[nodeID] for nodeID in nodeIDs]
+    qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
+    try:
+      polyDatas = self.atlas.getStructuresPolyData(structureSides, self.cache)
+      decimatedPolyDatas = self.atlas.getStructuresDecimatedPolyData(structureSides, polyDatas, self.targetReduction, self.cache) if self.targetReduction else {}
+    finally:
+      qt.QApplication.restoreOverrideCursor()
+    for nodeID, (structure, sideIndex) in zip(nodeIDs, structureSides):
+      del self.pending[nodeID]
+      node = slicer.mrmlScene.GetNodeByID(nodeID)
+      if node is None:
+        continue
+      nodePolyData = vtk.vtkPolyData()
+      nodePolyData.ShallowCopy(polyDatas[(structure.index, sideIndex)])
+      node.SetAndObservePolyData(nodePolyData)
+      if (structure.index, sideIndex) in decimatedPolyDatas:
+        structure.setSliceIntersectionPolyData(node, decimatedPolyDatas[(structure.index, sideIndex)])
+    if not self.pending:
+      self.removeObservers()
+
+  def removeObservers(self):
+    for displayNodeID, tag in self.observations:
+      displayNode = slicer.mrmlScene.GetNodeByID(displayNodeID)
+      if displayNode is not None:
+        displayNode.RemoveObserver(tag)
+    self.observations = []
+
 #
 # Atlas Structure
 #
@@ -201,7 +301,10 @@ class LeadDBSAtlasStructure:
   def isBilateral(self):
     return self.type in [3,4]
 
-  def getStructureNode(self, sideIndex):
+  def isInitiallyVisible(self):
+    return self.visibility
+
+  def getStructurePolyData(self, sideIndex):
     pass
 
   def createNode(self, polyData, nodeType):
@@ -216,37 +319,37 @@ class LeadDBSAtlasStructure:
 class ModelStructure(LeadDBSAtlasStructure):
   def __init__(self):
       super().__init__()
+      self.sliceIntersectionPolyDatas = {} # model node ID -> decimated poly data
 
-  def getStructureNode(self, sideIndex):
+  def getStructurePolyData(self, sideIndex):
     faces, vertices = self.getFacesVertices(sideIndex)
-    polyData = self.getPolyData(faces, vertices)
-    modelNode = self.createNode(polyData)
-    return modelNode
+    return self.getPolyData(faces, vertices)
 
-  def getFacesVertices(self, sideIndex):
+  def getFacesVertices(self, sideIndex, atlasFile=None):
+    if atlasFile is None:
+      import h5py
+      with h5py.File(self.atlasPath,'r') as atlasFile:
+        return self.getFacesVertices(sideIndex, atlasFile)
     smooth = slicer.util.settingsValue("NetstimPreferences/useSmoothAtlas", True, converter=slicer.util.toBool)
-    import h5py
-    with h5py.File(self.atlasPath,'r') as atlasFile:
-      roi = atlasFile['atlases']['roi']
-      ref = roi[sideIndex][self.index]
-      fvKey = 'sfv' if (smooth and 'sfv' in atlasFile[ref].keys()) else 'fv'
-      fv = atlasFile[ref][fvKey]
-      vertices = fv['vertices'][()].transpose()
-      faces = fv['faces'][()].transpose()
+    roi = atlasFile['atlases']['roi']
+    ref = roi[sideIndex][self.index]
+    fvKey = 'sfv' if (smooth and 'sfv' in atlasFile[ref].keys()) else 'fv'
+    fv = atlasFile[ref][fvKey]
+    vertices = fv['vertices'][()].transpose()
+    faces = fv['faces'][()].transpose()
     return faces, vertices
 
   def getPolyData(self, faces, vertices):
+    from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+    # arrays are handed to VTK without copy, the vtk arrays keep a reference to them
     points = vtk.vtkPoints()
-    for v in vertices:
-      points.InsertNextPoint(*v)
+    points.SetData(numpy_to_vtk(np.ascontiguousarray(vertices, dtype=np.float64)))
+
+    connectivity = np.ascontiguousarray(faces, dtype=np.int64).ravel() - 1 # fix 1based matlab index
+    offsets = np.arange(0, connectivity.size + 1, 3, dtype=np.int64)
     triangles = vtk.vtkCellArray()
+    triangles.SetData(numpy_to_vtkIdTypeArray(offsets), numpy_to_vtkIdTypeArray(connectivity))
 
-    for f in faces:
-      triangle = vtk.vtkTriangle()
-      for j in range(3):
-        triangle.GetPointIds().SetId(j,int(f[j])-1) # fix 1based matlab index
-      triangles.InsertNextCell(triangle)
-    
     pd = vtk.vtkPolyData()
     pd.SetPoints(points)
     pd.SetPolys(triangles)
@@ -260,21 +363,78 @@ class ModelStructure(LeadDBSAtlasStructure):
 
     return normals.GetOutput()
 
+  def getDecimatedPolyData(self, polyData, targetReduction):
+    decimation = vtk.vtkQuadricDecimation()
+    decimation.SetInputData(polyData)
+    decimation.SetTargetReduction(targetReduction)
+    decimation.VolumePreservationOn()
+    decimation.Update()
+    return decimation.GetOutput()
+
   def createNode(self, polyData):
     node = super().createNode(polyData, 'vtkMRMLModelNode')
     node.GetDisplayNode().SetVisibility2D(1)
     return node
 
+  def setSliceIntersectionPolyData(self, node, polyData):
+    """
+    Show polyData in the slice views instead of the node poly data, using a second display node
+    visible in 2D only. Its visibility, color and opacity follow the node display node, and
+    polyData is set again as its input when the node poly data changes.
+    """
+    sliceDisplayNode = self.getSliceIntersectionDisplayNode(node)
+    if sliceDisplayNode is None:
+      displayNode = node.GetDisplayNode()
+      sliceDisplayNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelDisplayNode')
+      sliceDisplayNode.SetAttribute('ImportAtlas.SliceIntersection', '1')
+      sliceDisplayNode.SetVisibility3D(0)
+      sliceDisplayNode.SetVisibility2D(1)
+      node.AddAndObserveDisplayNodeID(sliceDisplayNode.GetID())
+      displayNode.SetVisibility2D(0)
+      self.updateSliceIntersectionDisplayNode(displayNode, sliceDisplayNode.GetID())
+      displayNode.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda caller, event, sliceDisplayNodeID=sliceDisplayNode.GetID(): self.updateSliceIntersectionDisplayNode(caller, sliceDisplayNodeID))
+      node.AddObserver(slicer.vtkMRMLModelNode.MeshModifiedEvent, lambda caller, event: self.updateSliceIntersectionInput(caller))
+    self.sliceIntersectionPolyDatas[node.GetID()] = polyData
+    self.updateSliceIntersectionInput(node)
+
+  @staticmethod
+  def getSliceIntersectionDisplayNode(node):
+    for i in range(node.GetNumberOfDisplayNodes()):
+      if node.GetNthDisplayNode(i) and node.GetNthDisplayNode(i).GetAttribute('ImportAtlas.SliceIntersection'):
+        return node.GetNthDisplayNode(i)
+    return None
+
+  @staticmethod
+  def updateSliceIntersectionDisplayNode(displayNode, sliceDisplayNodeID):
+    sliceDisplayNode = slicer.mrmlScene.GetNodeByID(sliceDisplayNodeID)
+    if sliceDisplayNode is None:
+      return
+    wasModifying = sliceDisplayNode.StartModify()
+    sliceDisplayNode.SetVisibility(displayNode.GetVisibility())
+    sliceDisplayNode.SetColor(displayNode.GetColor())
+    sliceDisplayNode.SetOpacity(displayNode.GetOpacity())
+    sliceDisplayNode.SetSliceIntersectionOpacity(displayNode.GetSliceIntersectionOpacity())
+    sliceDisplayNode.SetSliceIntersectionThickness(displayNode.GetSliceIntersectionThickness())
+    sliceDisplayNode.EndModify(wasModifying)
+
+  def updateSliceIntersectionInput(self, node):
+    # the model node sets its poly data as input of all its display nodes when it changes
+    sliceDisplayNode = self.getSliceIntersectionDisplayNode(node)
+    polyData = self.sliceIntersectionPolyDatas.get(node.GetID())
+    if sliceDisplayNode is None or polyData is None:
+      return
+    producer = vtk.vtkTrivialProducer()
+    producer.SetOutput(polyData)
+    sliceDisplayNode.SetInputMeshConnection(producer.GetOutputPort())
+
 
 class FibersStructure(LeadDBSAtlasStructure):
   def __init__(self):
       super().__init__()
   
-  def getStructureNode(self, sideIndex):
-    points = self.getPointsIdx(sideIndex)
-    polyData = self.getPolyData(points)
-    fiberNode = self.createNode(polyData)
-    return fiberNode
+  def getStructurePolyData(self, sideIndex):
+    points, offsets = self.getPointsIdx(sideIndex)
+    return self.getPolyData(points, offsets)
 
   def getPointsIdx(self, sideIndex):
     if self.isBilateral():
@@ -285,27 +445,25 @@ class FibersStructure(LeadDBSAtlasStructure):
       fibersPath = glob.glob(os.path.join(os.path.dirname(self.atlasPath), '*', self.name+'.mat'))[0]
     import h5py
     with h5py.File(fibersPath,'r') as fibersFile:
-      points = fibersFile['fibers'][()].transpose()
-    return points
+      # rows: x, y, z, fiber index (1 based, sorted). Read row by row into the points array
+      fibers = fibersFile['fibers']
+      points = np.empty((fibers.shape[1], 3))
+      for i in range(3):
+        points[:,i] = fibers[i]
+      fiberIndex = fibers[3]
+    lastFiberIndex = int(fiberIndex[-1]) if len(fiberIndex) else 0
+    offsets = np.append(np.searchsorted(fiberIndex, np.arange(1, lastFiberIndex + 1)), len(fiberIndex)).astype(np.int64)
+    return points, offsets
+
+  def getPolyData(self, points, offsets):
+    from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+    # one polyline per offsets interval, the points array is handed to VTK without copy
+    lines = vtk.vtkCellArray()
+    lines.SetData(numpy_to_vtkIdTypeArray(offsets), numpy_to_vtkIdTypeArray(np.arange(len(points), dtype=np.int64)))
 
-  def getPolyData(self, points):
     vtkPoints = vtk.vtkPoints()
-    lines = vtk.vtkCellArray()
-    ptsIndex = 0
-    lineIndex = 1
-    finish = False
-    while not finish:
-      line = vtk.vtkPolyLine()
-      while lineIndex == points[ptsIndex,3]:
-        vtkPoints.InsertNextPoint(points[ptsIndex,0:3])
-        line.GetPointIds().InsertNextId(ptsIndex)
-        ptsIndex = ptsIndex + 1
-        if ptsIndex == points.shape[0]:
-          finish = True
-          break
-      lines.InsertNextCell(line)
-      lineIndex = lineIndex + 1
-    
+    vtkPoints.SetData(numpy_to_vtk(points))
+
     pd = vtk.vtkPolyData()
     pd.SetPoints(vtkPoints)
     pd.SetLines(lines)
@@ -321,43 +479,44 @@ class DiscFibersStructure(FibersStructure):
   def __init__(self):
       super().__init__()
 
-  def getStructureNode(self, sideIndex):
-    points, scalars = self.getPointsIdx(sideIndex)
-    polyData = self.getPolyData(points, scalars)
-    fiberNode = self.createNode(polyData)
-    return fiberNode
+  def getStructurePolyData(self, sideIndex):
+    points, offsets, scalars = self.getPointsIdx(sideIndex)
+    return self.getPolyData(points, offsets, scalars)
 
   def getPointsIdx(self, sideIndex):
     import glob
     fibersPath = glob.glob(os.path.join(os.path.dirname(self.atlasPath), '*', self.name+'.mat'))[0]
     import h5py
-    fiberCount = 1
     with h5py.File(fibersPath,'r') as fibersFile:
+      # collect the fiber datasets first so that the output arrays are allocated once
+      fibers = []
+      values = []
       for i in range(fibersFile['fibcell'].shape[0]):
-        ref = fibersFile['fibcell'][i,0]
-        for j in range(fibersFile[ref].shape[1]):
-          fiber = fibersFile[fibersFile[ref][0,j]][()].transpose()
-          fiber = np.concatenate((fiber, fiberCount*np.ones((fiber.shape[0],1))), axis=1)
-          scalar = fibersFile[fibersFile['vals'][i,0]][0][j]
-          if fiberCount == 1:
-            points = fiber
-            scalars = scalar * np.ones((fiber.shape[0],1))
-          else:
-            points = np.concatenate((points, fiber), axis=0)
-            scalars = np.concatenate((scalars, scalar * np.ones((fiber.shape[0],1))), axis=0)
-          fiberCount = fiberCount + 1
-    return points, scalars
-
-  def getPolyData(self, points, scalars):
-    pd = super().getPolyData(points)
-    vtkValuesArray = vtk.vtkDoubleArray()
+        fiberRefs = fibersFile[fibersFile['fibcell'][i,0]][0]
+        fiberValues = fibersFile[fibersFile['vals'][i,0]][0]
+        for j, fiberRef in enumerate(fiberRefs):
+          fibers.append(fibersFile[fiberRef])
+          values.append(fiberValues[j])
+      offsets = np.concatenate(([0], np.cumsum([fiber.shape[1] for fiber in fibers], dtype=np.int64)))
+      points = np.empty((offsets[-1], 3))
+      scalars = np.empty(offsets[-1])
+      for fiberCount, fiber in enumerate(fibers):
+        points[offsets[fiberCount]:offsets[fiberCount+1]] = fiber[()].transpose()
+        scalars[offsets[fiberCount]:offsets[fiberCount+1]] = values[fiberCount]
+    return points, offsets, scalars
+
+  def getPolyData(self, points, offsets, scalars):
+    from vtk.util.numpy_support import numpy_to_vtk
+    pd = super().getPolyData(points, offsets)
+    vtkValuesArray = numpy_to_vtk(scalars)
     vtkValuesArray.SetName('values')
-    for scalar in scalars:
-      vtkValuesArray.InsertNextTuple((scalar,))
     pd.GetPointData().AddArray(vtkValuesArray)
     pd.GetPointData().SetScalars(vtkValuesArray)
     return pd
 
+  def isInitiallyVisible(self):
+    return True
+
   def createNode(self, polyData):
     node = super().createNode(polyData)
     node.GetDisplayNode().SetVisibility(True)
@@ -373,18 +532,32 @@ class DiscFibersStructure(FibersStructure):
 class LeadDBSAtlas:
   def __init__(self, atlasPath):
 
-    try:
-      import h5py
-    except:
-      slicer.util.pip_install('h5py')
-      import h5py
-      
-    with h5py.File(atlasPath,'r') as atlasFile:
-      names = self.readNames(atlasFile)
-      colors = self.readColors(atlasFile)
-      types = self.readTypes(atlasFile)
-      showIndex = self.readShowIndex(atlasFile)
-      pixdimTypes = self.readPixdimType(atlasFile)
+    self.atlasPath = atlasPath
+    self.cachePath = self.getCachePath()
+
+    metadata = self.readCachedMetadata()
+    if metadata is None:
+      try:
+        import h5py
+      except:
+        slicer.util.pip_install('h5py')
+        import h5py
+
+      with h5py.File(atlasPath,'r') as atlasFile:
+        metadata = {
+          'names': self.readNames(atlasFile),
+          'colors': [[float(c) for c in color] for color in self.readColors(atlasFile)],
+          'types': [int(t) for t in self.readTypes(atlasFile)],
+          'showIndex': [int(i) for i in self.readShowIndex(atlasFile)],
+          'pixdimTypes': self.readPixdimType(atlasFile)
+          }
+      self.writeCachedMetadata(metadata)
+
+    names = metadata['names']
+    colors = metadata['colors']
+    types = metadata['types']
+    showIndex = metadata['showIndex']
+    pixdimTypes = metadata['pixdimTypes']
 
     self.structures = []
 
@@ -406,6 +579,166 @@ class LeadDBSAtlas:
       structure.visibility = i in showIndex
       self.structures.append(structure)
 
+  def getStructuresPolyData(self, structureSides, cache=None):
+    """
+    Poly data of each (structure, sideIndex), returned in a dict keyed by (structure index, side index).
+    The models geometry is read in a single pass over the atlas file, then the poly data
+    (including normals) are built in a thread pool as the VTK filters release the GIL.
+    Built models are written to the disk cache and read from there next time.
+    """
+    smooth = slicer.util.settingsValue("NetstimPreferences/useSmoothAtlas", True, converter=slicer.util.toBool)
+    atlasKey = (os.path.abspath(self.atlasPath), os.path.getmtime(self.atlasPath))
+    polyDatas = {}
+    toBuild = []
+    for structure, sideIndex in structureSides:
+      key = atlasKey + (structure.index, sideIndex, smooth)
+      polyData = cache.get(key) if cache is not None else None
+      if polyData is None:
+        toBuild.append((structure, sideIndex, key))
+      else:
+        polyDatas[(structure.index, sideIndex)] = polyData
+
+    facesVertices = {}
+    modelsToRead = [(structure, sideIndex) for structure, sideIndex, _ in toBuild
+                    if isinstance(structure, ModelStructure) and not os.path.isfile(self.getCachedPolyDataPath(structure, sideIndex))]
+    if modelsToRead:
+      os.makedirs(self.cachePath, exist_ok=True)
+      import h5py
+      with h5py.File(self.atlasPath,'r') as atlasFile:
+        for structure, sideIndex in modelsToRead:
+          facesVertices[(structure.index, sideIndex)] = structure.getFacesVertices(sideIndex, atlasFile)
+
+    def buildPolyData(item):
+      structure, sideIndex, _ = item
+      if not isinstance(structure, ModelStructure):
+        return structure.getStructurePolyData(sideIndex)
+      cachedPolyDataPath = self.getCachedPolyDataPath(structure, sideIndex)
+      if (structure.index, sideIndex) not in facesVertices:
+        return self.readCachedPolyData(cachedPolyDataPath)
+      polyData = structure.getPolyData(*facesVertices[(structure.index, sideIndex)])
+      self.writeCachedPolyData(polyData, cachedPolyDataPath)
+      return polyData
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor() as executor:
+      for (structure, sideIndex, key), polyData in zip(toBuild, executor.map(buildPolyData, toBuild)):
+        polyDatas[(structure.index, sideIndex)] = polyData
+        if cache is not None:
+          cache.add(key, polyData, polyData.GetActualMemorySize() * 1024)
+    return polyDatas
+
+  def getStructuresDecimatedPolyData(self, structureSides, polyDatas, targetReduction, cache=None):
+    """
+    Decimated version of the models poly data (see getStructuresPolyData), used for the slice
+    intersections. Built once with vtkQuadricDecimation and kept in the memory and disk caches.
+    """
+    smooth = slicer.util.settingsValue("NetstimPreferences/useSmoothAtlas", True, converter=slicer.util.toBool)
+    atlasKey = (os.path.abspath(self.atlasPath), os.path.getmtime(self.atlasPath))
+    decimatedPolyDatas = {}
+    toBuild = []
+    for structure, sideIndex in structureSides:
+      if not isinstance(structure, ModelStructure):
+        continue
+      key = atlasKey + (structure.index, sideIndex, smooth, 'decimated', targetReduction)
+      polyData = cache.get(key) if cache is not None else None
+      if polyData is None:
+        toBuild.append((structure, sideIndex, key))
+      else:
+        decimatedPolyDatas[(structure.index, sideIndex)] = polyData
+
+    if toBuild:
+      os.makedirs(self.cachePath, exist_ok=True)
+
+    def buildDecimatedPolyData(item):
+      structure, sideIndex, _ = item
+      cachedPolyDataPath = self.getCachedPolyDataPath(structure, sideIndex, targetReduction)
+      if os.path.isfile(cachedPolyDataPath):
+        return self.readCachedPolyData(cachedPolyDataPath)
+      polyData = structure.getDecimatedPolyData(polyDatas[(structure.index, sideIndex)], targetReduction)
+      self.writeCachedPolyData(polyData, cachedPolyDataPath)
+      return polyData
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor() as executor:
+      for (structure, sideIndex, key), polyData in zip(toBuild, executor.map(buildDecimatedPolyData, toBuild)):
+        decimatedPolyDatas[(structure.index, sideIndex)] = polyData
+        if cache is not None:
+          cache.add(key, polyData, polyData.GetActualMemorySize() * 1024)
+    return decimatedPolyDatas
+
+  def readCachedPolyData(self, cachedPolyDataPath):
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(cachedPolyDataPath)
+    reader.Update()
+    return reader.GetOutput()
+
+  def writeCachedPolyData(self, polyData, cachedPolyDataPath):
+    # write next to the final name first so that partially written files are never read
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(cachedPolyDataPath + '.tmp')
+    writer.SetInputData(polyData)
+    writer.SetDataModeToAppended()
+    writer.EncodeAppendedDataOff()
+    writer.SetCompressorTypeToNone()
+    if writer.Write():
+      os.replace(cachedPolyDataPath + '.tmp', cachedPolyDataPath)
+
+  def getCachePath(self):
+    # derived data is stored in Slicer's cache directory, keyed by the atlas file content and the smooth preference
+    smooth = slicer.util.settingsValue("NetstimPreferences/useSmoothAtlas", True, converter=slicer.util.toBool)
+    return os.path.join(slicer.app.cachePath, 'ImportAtlas', self.getAtlasHash() + ('_smooth' if smooth else ''))
+
+  def getAtlasHash(self):
+    # the content hash is kept in an index by path, size and modification time, and only computed when these change
+    import hashlib, json
+    indexPath = os.path.join(slicer.app.cachePath, 'ImportAtlas', 'index.json')
+    atlasPath = os.path.abspath(self.atlasPath)
+    stat = os.stat(atlasPath)
+    try:
+      with open(indexPath, 'r') as f:
+        index = json.load(f)
+    except (OSError, ValueError):
+      index = {}
+    entry = index.get(atlasPath)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+      return entry['hash']
+    atlasHash = hashlib.sha1()
+    with open(atlasPath, 'rb') as f:
+      for chunk in iter(lambda: f.read(16 * 1024 * 1024), b''):
+        atlasHash.update(chunk)
+    index[atlasPath] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': atlasHash.hexdigest()}
+    try:
+      os.makedirs(os.path.dirname(indexPath), exist_ok=True)
+      with open(indexPath + '.tmp', 'w') as f:
+        json.dump(index, f)
+      os.replace(indexPath + '.tmp', indexPath)
+    except OSError as e:
+      logging.warning('Could not write atlas cache index: %s' % e)
+    return atlasHash.hexdigest()
+
+  def getCachedPolyDataPath(self, structure, sideIndex, targetReduction=0):
+    if targetReduction:
+      return os.path.join(self.cachePath, '%d_%d_decimated%d.vtp' % (structure.index, sideIndex, round(targetReduction * 100)))
+    return os.path.join(self.cachePath, '%d_%d.vtp' % (structure.index, sideIndex))
+
+  def readCachedMetadata(self):
+    import json
+    try:
+      with open(os.path.join(self.cachePath, 'metadata.json'), 'r') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def writeCachedMetadata(self, metadata):
+    import json
+    try:
+      os.makedirs(self.cachePath, exist_ok=True)
+      with open(os.path.join(self.cachePath, 'metadata.json.tmp'), 'w') as f:
+        json.dump(metadata, f)
+      os.replace(os.path.join(self.cachePath, 'metadata.json.tmp'), os.path.join(self.cachePath, 'metadata.json'))
+    except OSError as e:
+      logging.warning('Could not write atlas cache: %s' % e)
+
   def readColors(self, atlasFile):
     colorIndex = atlasFile['atlases']['colors'][()].squeeze()
     if not colorIndex.shape:
@@ -529,6 +862,12 @@ class ImportAtlasTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_ImportAtlas1()
+    self.setUp()
+    self.test_ImportAtlasLazy()
+    self.setUp()
+    self.test_ImportAtlasDecimation()
+    self.setUp()
+    self.test_ImportAtlasBenchmark()
 
   def test_ImportAtlas1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -557,3 +896,92 @@ class ImportAtlasTest(ScriptedLoadableModuleTest):
     #logic = ImportAtlasLogic()
     #self.assertIsNotNone( logic.hasImageData(volumeNode) )
     self.delayDisplay('Test passed!')
+
+  def test_ImportAtlasLazy(self):
+    """ Hidden structures are imported as empty models and get their geometry when shown.
+    """
+    logic = ImportAtlasLogic()
+    atlasPath = os.path.join(logic.getAtlasesPath(), 'DISTAL Minimal (Ewert 2017)', 'atlas_index.mat')
+    if not os.path.isfile(atlasPath):
+      self.delayDisplay('DISTAL Minimal atlas not found. Set the Lead-DBS path in the preferences to run the test.')
+      return
+
+    logic.readAtlas(atlasPath, lazy=True)
+    shNode = slicer.mrmlScene.GetSubjectHierarchyNode()
+    modelNodes = [node for node in slicer.util.getNodesByClass('vtkMRMLModelNode') if shNode.GetItemAttribute(shNode.GetItemByDataNode(node), 'atlas')]
+    hiddenNodes = [node for node in modelNodes if not node.GetDisplayNode().GetVisibility()]
+    for node in modelNodes:
+      self.assertEqual(node.GetPolyData().GetNumberOfPoints() == 0, node in hiddenNodes)
+
+    if hiddenNodes:
+      hiddenNodes[0].GetDisplayNode().SetVisibility(True)
+      self.assertGreater(hiddenNodes[0].GetPolyData().GetNumberOfPoints(), 0)
+    self.delayDisplay('Test passed!')
+
+  def test_ImportAtlasDecimation(self):
+    """ Slice intersections of decimated atlases should follow the visibility and color of the models.
+    """
+    from NetstimPreferences import AtlasDecimation
+    logic = ImportAtlasLogic()
+    atlasPath = os.path.join(logic.getAtlasesPath(), 'DISTAL Minimal (Ewert 2017)', 'atlas_index.mat')
+    if not os.path.isfile(atlasPath):
+      self.delayDisplay('DISTAL Minimal atlas not found. Set the Lead-DBS path in the preferences to run the test.')
+      return
+
+    previousDecimation = AtlasDecimation().getValue()
+    AtlasDecimation().setValue(50)
+    try:
+      logic.readAtlas(atlasPath, lazy=False)
+    finally:
+      AtlasDecimation().setValue(previousDecimation)
+
+    shNode = slicer.mrmlScene.GetSubjectHierarchyNode()
+    node = [node for node in slicer.util.getNodesByClass('vtkMRMLModelNode') if shNode.GetItemAttribute(shNode.GetItemByDataNode(node), 'atlas')][0]
+    sliceDisplayNode = ModelStructure.getSliceIntersectionDisplayNode(node)
+    self.assertIsNotNone(sliceDisplayNode)
+    decimatedNumberOfPoints = sliceDisplayNode.GetOutputMesh().GetNumberOfPoints()
+    self.assertLess(decimatedNumberOfPoints, node.GetPolyData().GetNumberOfPoints())
+
+    # hidden and colored as the model
+    node.GetDisplayNode().SetVisibility(False)
+    self.assertFalse(sliceDisplayNode.GetVisibility())
+    node.GetDisplayNode().SetVisibility(True)
+    self.assertTrue(sliceDisplayNode.GetVisibility())
+    node.GetDisplayNode().SetColor(0.1, 0.2, 0.3)
+    np.testing.assert_allclose(sliceDisplayNode.GetColor(), (0.1, 0.2, 0.3))
+
+    # decimated mesh kept after the model poly data changes
+    polyData = vtk.vtkPolyData()
+    polyData.DeepCopy(node.GetPolyData())
+    node.SetAndObservePolyData(polyData)
+    self.assertEqual(sliceDisplayNode.GetOutputMesh().GetNumberOfPoints(), decimatedNumberOfPoints)
+    self.delayDisplay('Test passed!')
+
+  def test_ImportAtlasBenchmark(self):
+    """ Import every atlas found in the Lead-DBS atlases path and report the time taken by each one.
+    """
+    import time
+    logic = ImportAtlasLogic()
+    atlasesPath = logic.getAtlasesPath()
+    atlasPaths = sorted(glob.glob(os.path.join(atlasesPath, '*', 'atlas_index.mat'))) if atlasesPath else []
+    if not atlasPaths:
+      self.delayDisplay('No Lead-DBS atlases found. Set the Lead-DBS path in the preferences to run the benchmark.')
+      return
+
+    totalTime = 0
+    for atlasPath in atlasPaths:
+      atlasName = os.path.basename(os.path.dirname(atlasPath))
+      slicer.mrmlScene.Clear(0)
+      startTime = time.time()
+      try:
+        logic.readAtlas(atlasPath)
+      except Exception as e:
+        logging.warning('%s: failed to import (%s)' % (atlasName, e))
+        continue
+      elapsedTime = time.time() - startTime
+      totalTime += elapsedTime
+      numberOfModels = slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLModelNode')
+      logging.info('%s: %.2fs (%d models)' % (atlasName, elapsedTime, numberOfModels))
+    slicer.mrmlScene.Clear(0)
+
+    self.delayDisplay('Imported %d atlases in %.2fs' % (len(atlasPaths), totalTime))
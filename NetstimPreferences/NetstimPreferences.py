@@ -66,6 +66,31 @@ class NetstimPreferencesSettingsUI:
       self.useSmoothAtlasCheckBox.connect("toggled(bool)", self.onUseSmoothAtlasCheckBoxToggled)
       layout.addRow("Use smooth atlases: ", self.useSmoothAtlasCheckBox)
 
+      self.lazyAtlasLoadingCheckBox = qt.QCheckBox()
+      self.lazyAtlasLoadingCheckBox.checked = LazyAtlasLoading().getValue()
+      self.lazyAtlasLoadingCheckBox.setToolTip("When checked, atlas structures hidden by default are loaded when first shown.")
+      self.lazyAtlasLoadingCheckBox.connect("toggled(bool)", lambda checked: LazyAtlasLoading().setValue(checked))
+      layout.addRow("Load hidden structures on demand: ", self.lazyAtlasLoadingCheckBox)
+
+      self.atlasDecimationSpinBox = qt.QSpinBox()
+      self.atlasDecimationSpinBox.setRange(0, 95)
+      self.atlasDecimationSpinBox.setSingleStep(5)
+      self.atlasDecimationSpinBox.setSuffix(" %")
+      self.atlasDecimationSpinBox.setSpecialValueText("Off")
+      self.atlasDecimationSpinBox.value = AtlasDecimation().getValue()
+      self.atlasDecimationSpinBox.setToolTip("Reduction of the atlas models triangles used for the slice views intersections. 3D views keep the full resolution.")
+      self.atlasDecimationSpinBox.connect("valueChanged(int)", lambda value: AtlasDecimation().setValue(value))
+      layout.addRow("Atlas slice intersection decimation: ", self.atlasDecimationSpinBox)
+
+      self.dataCacheSizeSpinBox = qt.QSpinBox()
+      self.dataCacheSizeSpinBox.setRange(0, 65536)
+      self.dataCacheSizeSpinBox.setSingleStep(256)
+      self.dataCacheSizeSpinBox.setSuffix(" MB")
+      self.dataCacheSizeSpinBox.value = DataCacheSize().getValue()
+      self.dataCacheSizeSpinBox.setToolTip("Memory used to keep templates and atlases loaded between subjects. Applies to new sessions.")
+      self.dataCacheSizeSpinBox.connect("valueChanged(int)", lambda value: DataCacheSize().setValue(value))
+      layout.addRow("Data cache size: ", self.dataCacheSizeSpinBox)
+
       # initial set-up
       previousSpace = LeadDBSSpace().getValue()
       if previousSpace:
@@ -121,4 +146,25 @@ class UseSmoothAtlas(NetstimPreference):
       super().__init__()
       self.key = "useSmoothAtlas"
       self.default = True
-      self.converter = slicer.util.toBool
\ No newline at end of file
+      self.converter = slicer.util.toBool
+
+class LazyAtlasLoading(NetstimPreference):
+  def __init__(self):
+      super().__init__()
+      self.key = "lazyAtlasLoading"
+      self.default = False
+      self.converter = slicer.util.toBool
+
+class AtlasDecimation(NetstimPreference):
+  def __init__(self):
+      super().__init__()
+      self.key = "atlasDecimation"
+      self.default = 0
+      self.converter = int
+
+class DataCacheSize(NetstimPreference):
+  def __init__(self):
+      super().__init__()
+      self.key = "dataCacheSize"
+      self.default = 2048
+      self.converter = int
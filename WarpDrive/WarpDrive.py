@@ -9,7 +9,7 @@ import json
 import numpy as np
 
 from WarpDriveLib.Tools import NoneTool, SmudgeTool, DrawTool, PointToPointTool, ShrinkExpandTool
-from WarpDriveLib.Helpers import GridNodeHelper, LeadDBSCall
+from WarpDriveLib.Helpers import GridNodeHelper, LeadDBSCall, VariableRBF
 from WarpDriveLib.Widgets import Tables, Toolbar
 
 #
@@ -148,6 +148,7 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self.ui.spacingSameAsInputCheckBox.connect("toggled(bool)", self.updateParameterNodeFromGUI)
     self.ui.spacingSpinBox.connect("valueChanged(double)", self.updateParameterNodeFromGUI)
     self.ui.stiffnessSpinBox.connect("valueChanged(double)", self.updateParameterNodeFromGUI)
+    self.ui.backendComboBox.connect("currentIndexChanged(int)", self.updateParameterNodeFromGUI)
     self.ui.drawModeMenu.triggered.connect(self.updateParameterNodeFromGUI)
     self.ui.shrinkExpandModeMenu.triggered.connect(self.updateParameterNodeFromGUI)
     self.ui.shrinkExpandAmmountSlider.valueChanged.connect(self.updateParameterNodeFromGUI)
@@ -353,6 +354,7 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     self.ui.spacingSpinBox.value = float(self._parameterNode.GetParameter("Spacing"))
     self.ui.stiffnessSpinBox.value = float(self._parameterNode.GetParameter("Stiffness"))
+    self.ui.backendComboBox.currentText = self._parameterNode.GetParameter("Backend")
 
     self.ui.outputSelector.enabled = self._parameterNode.GetNodeReference("InputNode")
     self.ui.toolsCollapsibleButton.enabled = self._parameterNode.GetNodeReference("InputNode") and self._parameterNode.GetNodeReference("OutputGridTransform")
@@ -401,6 +403,7 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     self._parameterNode.SetParameter("ShrinkExpandAmmount", str(self.ui.shrinkExpandAmmountSlider.value))
     self._parameterNode.SetParameter("Radius", "%.2f" % self.ui.radiusSlider.value)
     self._parameterNode.SetParameter("Stiffness", str(self.ui.stiffnessSpinBox.value))
+    self._parameterNode.SetParameter("Backend", self.ui.backendComboBox.currentText)
     # spacing
     if self.ui.spacingSameAsInputCheckBox.checked:
       size,origin,spacing,directionMatrix = GridNodeHelper.getGridDefinition(currentInputNode)
@@ -448,6 +451,7 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         RBFRadius.append(targetFiducial.GetNthControlPointDescription(i))
     RBFRadius = ",".join(RBFRadius)
     stiffness = float(self._parameterNode.GetParameter("Stiffness"))
+    backend = self._parameterNode.GetParameter("Backend")
     # snap
     snapOptionsLoad = json.loads(self._parameterNode.GetParameter("SnapOptions"))
     if snapOptionsLoad['SnapRun']:
@@ -467,7 +471,7 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     qt.QApplication.processEvents()
 
     self._parameterNode.SetParameter("Running", "true")
-    cliNode = self.logic.run(auxVolumeNode, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness)
+    cliNode = self.logic.run(auxVolumeNode, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness, backend)
 
     if cliNode is not None:
       # set up for UI
@@ -476,6 +480,9 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
       cliNode.AddObserver(slicer.vtkMRMLCommandLineModuleNode.StatusModifiedEvent, \
         lambda c,e,o=outputNode,v=visualizationNodes,a=auxVolumeNode,s=snapOptions: self.onStatusModifiedEvent(c,o,v,a,s))
     else:
+      # computed in-process, or no corrections
+      if backend == "In-process" and RBFRadius != "":
+        self.autoApplySnap(snapOptions)
       self.onStatusModifiedEvent(None,outputNode,visualizationNodes,auxVolumeNode,snapOptions)
 
   
@@ -485,8 +492,7 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
       if caller.GetStatusString() == 'Completed':
         # delete cli Node
         qt.QTimer.singleShot(1000, lambda: slicer.mrmlScene.RemoveNode(caller))
-        if snapOptions and snapOptions['AutoApply'] and not snapOptions['SnapRun']:
-          qt.QTimer.singleShot(1000, lambda m=snapOptions['Mode'],s=snapOptions['SourceID'],t=snapOptions['TargetID'],f=self._parameterNode.GetNodeReferenceID("TargetFiducial"): self.logic.runSnap(m, s, t, f))
+        self.autoApplySnap(snapOptions)
       else:
         return
 
@@ -502,6 +508,10 @@ class WarpDriveWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
     self._parameterNode.SetParameter("Running", "false")
 
+  def autoApplySnap(self, snapOptions):
+    if snapOptions and snapOptions['AutoApply'] and not snapOptions['SnapRun']:
+      qt.QTimer.singleShot(1000, lambda m=snapOptions['Mode'],s=snapOptions['SourceID'],t=snapOptions['TargetID'],f=self._parameterNode.GetNodeReferenceID("TargetFiducial"): self.logic.runSnap(m, s, t, f))
+
 
 
 #
@@ -549,6 +559,8 @@ class WarpDriveLogic(ScriptedLoadableModuleLogic):
       parameterNode.SetParameter("RBFRadius", "30")
     if not parameterNode.GetParameter("Stiffness"):
       parameterNode.SetParameter("Stiffness", "0.1")
+    if not parameterNode.GetParameter("Backend"):
+      parameterNode.SetParameter("Backend", "CLI")
     if not parameterNode.GetParameter("DrawMode"):
       parameterNode.SetParameter("DrawMode", 'To Nearest Model')
     if not parameterNode.GetParameter("ShrinkExpandMode"):
@@ -564,18 +576,21 @@ class WarpDriveLogic(ScriptedLoadableModuleLogic):
     if not parameterNode.GetParameter("InverseMode"):
       parameterNode.SetParameter("InverseMode", "0")
 
-  def run(self, referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness):
+  def run(self, referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness, backend="CLI"):
 
     # run landmark registration if points available
-    if RBFRadius != "":
-      cliNode = self.computeWarp(referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness)
+    if RBFRadius != "" and backend == "In-process":
+      self.computeWarpInProcess(referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness)
+      return
+    elif RBFRadius != "":
+      cliNode = self.computeWarp(referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness, stateDirectory=self.getRBFStateDirectory())
     else:
       size, origin, spacing, directionMatrix = GridNodeHelper.getGridDefinition(referenceVolume)
       GridNodeHelper.emptyGridTransform(size, origin, spacing, directionMatrix, outputNode)
       return
     return cliNode
 
-  def computeWarp(self, referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness, wait_for_completion=False):
+  def computeWarp(self, referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness, wait_for_completion=False, stateDirectory=None):
 
     # Compute the warp with FiducialRegistrationVariableRBF
     cliParams = {
@@ -587,10 +602,32 @@ class WarpDriveLogic(ScriptedLoadableModuleLogic):
       "stiffness" : stiffness,
       } 
 
+    # keep the solution between runs so that only the region of new corrections is updated
+    if stateDirectory is not None:
+      cliParams["stateDirectory"] = stateDirectory
+
     cliNode = slicer.cli.run(slicer.modules.fiducialregistrationvariablerbf, None, cliParams, wait_for_completion, update_display=False)
 
     return cliNode
 
+  def computeWarpInProcess(self, referenceVolume, outputNode, sourceFiducial, targetFiducial, RBFRadius, stiffness):
+
+    # Same computation as FiducialRegistrationVariableRBF, written directly into the output grid
+    fixedPoints = np.array([targetFiducial.GetNthControlPointPosition(i) for i in range(targetFiducial.GetNumberOfControlPoints()) if targetFiducial.GetNthControlPointSelected(i)])
+    movingPoints = np.array([sourceFiducial.GetNthControlPointPosition(i) for i in range(sourceFiducial.GetNumberOfControlPoints()) if sourceFiducial.GetNthControlPointSelected(i)])
+    radius = np.array(RBFRadius.split(","), dtype=float) * np.ones(len(fixedPoints))
+
+    size, origin, spacing, directionMatrix = GridNodeHelper.getGridDefinition(referenceVolume)
+    direction = np.array([[directionMatrix.GetElement(row, col) for col in range(3)] for row in range(3)])
+    GridNodeHelper.emptyGridTransform(size, origin, spacing, directionMatrix, outputNode)
+
+    displacement = slicer.util.arrayFromGridTransform(outputNode)
+    VariableRBF.computeDisplacementField(displacement, origin, spacing, direction, fixedPoints, movingPoints, radius, stiffness)
+    slicer.util.arrayFromGridTransformModified(outputNode)
+
+  def getRBFStateDirectory(self):
+    return os.path.join(slicer.app.temporaryPath, 'WarpDrive', 'RBFState')
+
   def previewWarp(self, source, target):
     if isinstance(source, slicer.vtkMRMLMarkupsFiducialNode) and isinstance(target, slicer.vtkMRMLMarkupsFiducialNode):
       sourcePoints = vtk.vtkPoints()
@@ -774,6 +811,10 @@ class WarpDriveTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_WarpDrive1()
+    self.setUp()
+    self.test_WarpDriveBackends()
+    self.setUp()
+    self.test_WarpDriveCorrectionStore()
 
   def test_WarpDrive1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -805,3 +846,121 @@ class WarpDriveTest(ScriptedLoadableModuleTest):
     parameterNode.EndModify(wasModified)
 
     self.delayDisplay('Test passed')
+
+  def test_WarpDriveBackends(self):
+    """ The in-process and CLI backends should compute the same warp.
+    """
+
+    self.delayDisplay("Starting the backends test")
+
+    import WarpDrive
+    logic = WarpDrive.WarpDriveLogic()
+
+    # oblique reference grid
+    directionMatrix = vtk.vtkMatrix4x4()
+    transform = vtk.vtkTransform()
+    transform.RotateWXYZ(20, 1, 2, 3)
+    transform.GetMatrix(directionMatrix)
+    referenceVolume = GridNodeHelper.emptyVolume([40, 35, 30], [-40, -35, -30], [2, 2, 2], directionMatrix)
+
+    sourceFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+    targetFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+    rng = np.random.default_rng(0)
+    sourcePoints = rng.uniform(-15, 15, (12, 3))
+    targetPoints = sourcePoints + rng.uniform(-4, 4, (12, 3))
+    for sourcePoint, targetPoint in zip(sourcePoints, targetPoints):
+      sourceFiducial.AddControlPoint(vtk.vtkVector3d(sourcePoint))
+      targetFiducial.AddControlPoint(vtk.vtkVector3d(targetPoint))
+    RBFRadius = ",".join(["%.1f" % r for r in rng.uniform(8, 15, 12)])
+
+    cliOutputNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLGridTransformNode')
+    cliNode = logic.computeWarp(referenceVolume, cliOutputNode, sourceFiducial, targetFiducial, RBFRadius, 0.1, wait_for_completion=True)
+    self.assertEqual(cliNode.GetStatusString(), 'Completed')
+
+    inProcessOutputNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLGridTransformNode')
+    logic.computeWarpInProcess(referenceVolume, inProcessOutputNode, sourceFiducial, targetFiducial, RBFRadius, 0.1)
+
+    # compare the transformed points, independent of how each backend stores the grid
+    for point in np.vstack((targetPoints, rng.uniform(-35, 35, (50, 3)))):
+      cliPoint = cliOutputNode.GetTransformFromParent().TransformPoint(point)
+      inProcessPoint = inProcessOutputNode.GetTransformFromParent().TransformPoint(point)
+      np.testing.assert_allclose(cliPoint, inProcessPoint, atol=1e-2)
+
+    self.delayDisplay('Test passed')
+
+  def test_WarpDriveCorrectionStore(self):
+    """ Corrections saved in the store should load as they were saved, and the store should be used unless the legacy files were modified since.
+    """
+
+    self.delayDisplay("Starting the correction store test")
+
+    import tempfile
+    from WarpDriveLib.Helpers.CorrectionStore import CorrectionStore
+
+    def addCorrection(name, radius, numberOfPoints):
+      for i in range(numberOfPoints):
+        sourceFiducial.AddControlPoint(vtk.vtkVector3d(rng.uniform(-30, 30, 3)), name)
+        targetFiducial.AddControlPoint(vtk.vtkVector3d(rng.uniform(-30, 30, 3)), name)
+        targetFiducial.SetNthControlPointDescription(targetFiducial.GetNumberOfControlPoints()-1, radius)
+
+    def assertStored(store):
+      storedSource, storedTarget = store.load()
+      for node, storedNode in [(sourceFiducial, storedSource), (targetFiducial, storedTarget)]:
+        self.assertEqual(node.GetNumberOfControlPoints(), storedNode.GetNumberOfControlPoints())
+        for i in range(node.GetNumberOfControlPoints()):
+          np.testing.assert_allclose(node.GetNthControlPointPositionWorld(i), storedNode.GetNthControlPointPositionWorld(i), atol=1e-4)
+      for i in range(targetFiducial.GetNumberOfControlPoints()):
+        self.assertEqual(targetFiducial.GetNthControlPointLabel(i), storedTarget.GetNthControlPointLabel(i))
+        self.assertEqual(float(targetFiducial.GetNthControlPointDescription(i)), float(storedTarget.GetNthControlPointDescription(i)))
+        self.assertEqual(targetFiducial.GetNthControlPointSelected(i), storedTarget.GetNthControlPointSelected(i))
+
+    rng = np.random.default_rng(0)
+    sourceFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+    targetFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+
+    with tempfile.TemporaryDirectory() as directory:
+      store = CorrectionStore(directory)
+      addCorrection('smudge', '15.0', 20)
+      store.save(sourceFiducial, targetFiducial)
+      assertStored(store)
+      # added
+      addCorrection('drawing', '10.0', 30)
+      addCorrection('smudge', '5.0', 3)
+      store.save(sourceFiducial, targetFiducial)
+      assertStored(store)
+      # removed and modified
+      targetFiducial.SetNthControlPointSelected(0, False)
+      targetFiducial.RemoveNthControlPoint(21)
+      sourceFiducial.RemoveNthControlPoint(21)
+      store.save(sourceFiducial, targetFiducial)
+      assertStored(store)
+      # unchanged corrections are not rewritten
+      modifiedTime = os.stat(store.path).st_mtime_ns
+      store.save(sourceFiducial, targetFiducial)
+      self.assertEqual(modifiedTime, os.stat(store.path).st_mtime_ns)
+      # saved, exported and saved again, as with calculate followed by saving the subject
+      store.exportJSON(sourceFiducial, targetFiducial)
+      LeadDBSCall.saveSourceTarget(directory, sourceFiducial, targetFiducial)
+      self.assertFalse(store.isJSONModified())
+      loadedSource, loadedTarget = LeadDBSCall.loadSourceTarget(directory)
+      self.assertEqual(loadedTarget.GetNumberOfControlPoints(), targetFiducial.GetNumberOfControlPoints())
+      # store has the corrections added after the export
+      addCorrection('smudge', '5.0', 2)
+      LeadDBSCall.saveSourceTarget(directory, sourceFiducial, targetFiducial)
+      self.assertFalse(store.isJSONModified())
+      loadedSource, loadedTarget = LeadDBSCall.loadSourceTarget(directory)
+      self.assertEqual(loadedTarget.GetNumberOfControlPoints(), targetFiducial.GetNumberOfControlPoints())
+      # legacy markups modified elsewhere are imported
+      targetFiducial.RemoveNthControlPoint(0)
+      sourceFiducial.RemoveNthControlPoint(0)
+      slicer.util.saveNode(sourceFiducial, store.sourceJSONPath)
+      slicer.util.saveNode(targetFiducial, store.targetJSONPath)
+      futureTime = os.stat(store.path).st_mtime_ns + 10**9
+      os.utime(store.targetJSONPath, ns=(futureTime, futureTime))
+      self.assertTrue(store.isJSONModified())
+      loadedSource, loadedTarget = LeadDBSCall.loadSourceTarget(directory)
+      self.assertEqual(loadedTarget.GetNumberOfControlPoints(), targetFiducial.GetNumberOfControlPoints())
+      self.assertFalse(store.isJSONModified())
+      assertStored(store)
+
+    self.delayDisplay('Test passed')
@@ -1,6 +1,7 @@
 import vtk, qt, slicer
 
 import numpy as np
+from vtk.util import numpy_support
 
 from .Effect import AbstractEffect
 from ..Helpers import GridNodeHelper
@@ -71,13 +72,55 @@ class AbstractPointerEffect(AbstractEffect):
     self.setFiducialNodeAs("Target", targetFiducial, targetFiducial.GetName(), self.parameterNode.GetParameter("Radius"))
     self.parameterNode.SetParameter("Update","true")
 
+  def applyCorrectionFromPoints(self, sourcePoints, targetPoints, name):
+    """
+    Same as applyCorrection with the source and target as (N,3) arrays of world positions.
+    No markups nodes are created unless previous corrections have to be modified.
+    """
+    if int(self.parameterNode.GetParameter("ModifiableCorrections")):
+      # previous corrections are modified by the CLI, taking markups nodes
+      sourceFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+      sourceFiducial.SetControlPointPositionsWorld(self.arrayToPoints(sourcePoints))
+      targetFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+      targetFiducial.SetControlPointPositionsWorld(self.arrayToPoints(targetPoints))
+      targetFiducial.SetName(name)
+      self.applyCorrection(sourceFiducial, targetFiducial)
+      return
+    sourcePoints = self.transformPoints(sourcePoints, self.parameterNode.GetNodeReference("OutputGridTransform").GetTransformFromParent()) # undo current
+    self.addControlPoints("Source", sourcePoints, name, self.parameterNode.GetParameter("Radius"))
+    self.addControlPoints("Target", targetPoints, name, self.parameterNode.GetParameter("Radius"))
+    self.parameterNode.SetParameter("Update","true")
+
   def setFiducialNodeAs(self, type, fromNode, name, radius):
-    toNode = self.parameterNode.GetNodeReference(type + "Fiducial")
-    for i in range(fromNode.GetNumberOfControlPoints()):
-      toNode.AddControlPoint(vtk.vtkVector3d(fromNode.GetNthControlPointPosition(i)), name)
-      toNode.SetNthControlPointDescription(toNode.GetNumberOfControlPoints()-1, radius)
+    points = vtk.vtkPoints()
+    fromNode.GetControlPointPositionsWorld(points)
+    self.addControlPoints(type, numpy_support.vtk_to_numpy(points.GetData()), name, radius)
     slicer.mrmlScene.RemoveNode(fromNode)
 
+  def addControlPoints(self, type, points, name, radius):
+    # positions are set at once and the node is modified once
+    toNode = self.parameterNode.GetNodeReference(type + "Fiducial")
+    firstIndex = toNode.GetNumberOfControlPoints()
+    currentPoints = vtk.vtkPoints()
+    toNode.GetControlPointPositionsWorld(currentPoints)
+    currentArray = numpy_support.vtk_to_numpy(currentPoints.GetData()).reshape(-1,3) if firstIndex else np.zeros((0,3))
+    wasModifying = toNode.StartModify()
+    toNode.SetControlPointPositionsWorld(self.arrayToPoints(np.vstack((currentArray, points))))
+    for i in range(firstIndex, toNode.GetNumberOfControlPoints()):
+      toNode.SetNthControlPointLabel(i, name)
+      toNode.SetNthControlPointDescription(i, radius)
+    toNode.EndModify(wasModifying)
+
+  def arrayToPoints(self, array):
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(array, dtype=np.float64).reshape(-1,3), deep=True))
+    return points
+
+  def transformPoints(self, array, transform):
+    transformedPoints = vtk.vtkPoints()
+    transform.TransformPoints(self.arrayToPoints(array), transformedPoints)
+    return numpy_support.vtk_to_numpy(transformedPoints.GetData()).reshape(-1,3)
+
   def modifyPreviousCorrections(self, sourceFiducial, targetFiducial):
     if self.parameterNode.GetNodeReference("TargetFiducial").GetNumberOfControlPoints() == 0:
       return
@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import vtk, slicer
+import numpy as np
+from vtk.util import numpy_support
+
+class CorrectionStore(object):
+  """
+  Source and target control points of a subject's corrections, stored in an HDF5 file
+  as float32 coordinates, an interned label table and radius and selection arrays.
+  The file is only rewritten when the corrections changed, through a temporary file,
+  so an interrupted save leaves the previous one readable. A digest of the stored
+  corrections and the state of the exported legacy markups files are kept as attributes.
+  """
+
+  fileName = 'corrections.h5'
+  version = 1
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.path = os.path.join(directory, self.fileName)
+    self.sourceJSONPath = os.path.join(directory, 'source.json')
+    self.targetJSONPath = os.path.join(directory, 'target.json')
+
+  @staticmethod
+  def importH5py():
+    try:
+      import h5py
+    except:
+      slicer.util.pip_install('h5py')
+      import h5py
+    return h5py
+
+  def exists(self):
+    return os.path.isfile(self.path)
+
+  def readAttributes(self):
+    # digest and json stamp of the stored corrections, None if not available
+    if not self.exists():
+      return None, None
+    h5py = self.importH5py()
+    try:
+      with h5py.File(self.path, 'r') as f:
+        digest = self.decode(f.attrs.get('digest'))
+        jsonStamp = f.attrs.get('jsonStamp')
+    except OSError:
+      return None, None
+    return digest, (None if jsonStamp is None else [int(value) for value in jsonStamp])
+
+  def getJSONStamp(self):
+    # modification time and size of the legacy target file
+    if not os.path.isfile(self.targetJSONPath):
+      return None
+    stat = os.stat(self.targetJSONPath)
+    return [stat.st_mtime_ns, stat.st_size]
+
+  def isJSONModified(self):
+    # whether the legacy markups files were changed after they were last exported or imported
+    jsonStamp = self.getJSONStamp()
+    if jsonStamp is None:
+      return False
+    if not self.exists():
+      return True
+    storedDigest, storedJSONStamp = self.readAttributes()
+    return jsonStamp != storedJSONStamp and jsonStamp[0] > os.stat(self.path).st_mtime_ns
+
+  def save(self, sourceNode, targetNode, exported=False):
+    # set exported if the legacy markups files were just written from the same nodes
+    corrections = self.nodesToArrays(sourceNode, targetNode)
+    digest = self.getDigest(corrections)
+    storedDigest, storedJSONStamp = self.readAttributes()
+    jsonStamp = self.getJSONStamp() if exported else storedJSONStamp
+    if digest == storedDigest and jsonStamp == storedJSONStamp:
+      return
+    self.write(corrections, digest, jsonStamp)
+
+  def load(self):
+    h5py = self.importH5py()
+    with h5py.File(self.path, 'r') as f:
+      count = int(f.attrs['count'])
+      labels = [self.decode(label) for label in f['labels'][()]]
+      labelIndex = f['labelIndex'][:count]
+      corrections = {
+        'source': f['source'][:count],
+        'target': f['target'][:count],
+        'labels': [labels[i] for i in labelIndex],
+        'radius': f['radius'][:count],
+        'selected': f['selected'][:count]
+        }
+    sourceNode = self.arraysToNode(corrections['source'], corrections, 'source')
+    targetNode = self.arraysToNode(corrections['target'], corrections, 'target')
+    return sourceNode, targetNode
+
+  def importJSON(self):
+    # load the legacy markups files and store them
+    sourceNode = slicer.util.loadMarkups(self.sourceJSONPath)
+    targetNode = slicer.util.loadMarkups(self.targetJSONPath)
+    self.save(sourceNode, targetNode, exported=True)
+    return sourceNode, targetNode
+
+  def exportJSON(self, sourceNode, targetNode):
+    # write the legacy markups files and store the corrections with their state
+    slicer.util.saveNode(sourceNode, self.sourceJSONPath)
+    slicer.util.saveNode(targetNode, self.targetJSONPath)
+    self.save(sourceNode, targetNode, exported=True)
+
+  @staticmethod
+  def decode(label):
+    return label.decode('utf-8') if isinstance(label, bytes) else label
+
+  @staticmethod
+  def getDigest(corrections):
+    digest = hashlib.sha1()
+    for name in ['source', 'target', 'radius', 'selected']:
+      digest.update(np.ascontiguousarray(corrections[name]).tobytes())
+    digest.update(json.dumps(corrections['labels']).encode('utf-8'))
+    return digest.hexdigest()
+
+  @staticmethod
+  def nodesToArrays(sourceNode, targetNode):
+    corrections = {}
+    for name, node in [('source', sourceNode), ('target', targetNode)]:
+      points = vtk.vtkPoints()
+      node.GetControlPointPositionsWorld(points)
+      if points.GetNumberOfPoints():
+        corrections[name] = numpy_support.vtk_to_numpy(points.GetData()).astype(np.float32).reshape(-1,3)
+      else:
+        corrections[name] = np.zeros((0,3), dtype=np.float32)
+    numberOfPoints = targetNode.GetNumberOfControlPoints()
+    corrections['labels'] = [targetNode.GetNthControlPointLabel(i) for i in range(numberOfPoints)]
+    corrections['radius'] = np.array([float(targetNode.GetNthControlPointDescription(i) or 0) for i in range(numberOfPoints)], dtype=np.float32)
+    corrections['selected'] = np.array([targetNode.GetNthControlPointSelected(i) for i in range(numberOfPoints)], dtype=np.uint8)
+    return corrections
+
+  @staticmethod
+  def arraysToNode(positions, corrections, name):
+    node = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode', name)
+    node.GetDisplayNode().SetGlyphTypeFromString('Sphere3D')
+    node.GetDisplayNode().SetGlyphScale(1)
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(positions, dtype=np.float64), deep=True))
+    wasModifying = node.StartModify()
+    node.SetControlPointPositionsWorld(points)
+    for i, (label, radius, selected) in enumerate(zip(corrections['labels'], corrections['radius'], corrections['selected'])):
+      node.SetNthControlPointLabel(i, label)
+      node.SetNthControlPointDescription(i, "%.01f" % radius)
+      node.SetNthControlPointSelected(i, bool(selected))
+    node.EndModify(wasModifying)
+    return node
+
+  def write(self, corrections, digest, jsonStamp):
+    h5py = self.importH5py()
+    labels = []
+    labelIndex = self.internLabels(labels, corrections['labels'])
+    with h5py.File(self.path + '.tmp', 'w') as f:
+      f.attrs['version'] = self.version
+      f.create_dataset('labels', shape=(len(labels),), dtype=h5py.string_dtype())
+      if labels:
+        f['labels'][:] = labels
+      f.create_dataset('labelIndex', data=labelIndex)
+      for name in ['source', 'target', 'radius', 'selected']:
+        f.create_dataset(name, data=corrections[name])
+      f.attrs['count'] = len(corrections['labels'])
+      f.attrs['digest'] = digest
+      if jsonStamp is not None:
+        f.attrs['jsonStamp'] = np.array(jsonStamp, dtype=np.int64)
+    os.replace(self.path + '.tmp', self.path)
+
+  @staticmethod
+  def internLabels(labels, newLabels):
+    # indices of newLabels in labels, extended with the ones not present
+    indexOfLabel = {label: i for i, label in enumerate(labels)}
+    labelIndex = np.empty(len(newLabels), dtype=np.int32)
+    for i, label in enumerate(newLabels):
+      if label not in indexOfLabel:
+        indexOfLabel[label] = len(labels)
+        labels.append(label)
+      labelIndex[i] = indexOfLabel[label]
+    return labelIndex
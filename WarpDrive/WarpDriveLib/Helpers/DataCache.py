@@ -0,0 +1,40 @@
+import os
+from collections import OrderedDict
+
+class DataCache(object):
+  """
+  In-process cache of data read from files (template images, atlas poly data)
+  shared across subjects. Keys start with the file path and modification time
+  so that changed files are read again. Least recently used entries are
+  evicted to keep the total size under maximumSizeMB.
+  """
+
+  def __init__(self, maximumSizeMB):
+    self.maximumSize = maximumSizeMB * 1024 * 1024
+    self.size = 0
+    self.entries = OrderedDict()
+
+  @staticmethod
+  def fileKey(filePath, *extraKeys):
+    filePath = os.path.abspath(filePath)
+    return (filePath, os.path.getmtime(filePath)) + extraKeys
+
+  def get(self, key):
+    if key not in self.entries:
+      return None
+    self.entries.move_to_end(key)
+    return self.entries[key][0]
+
+  def add(self, key, value, memorySize):
+    if key in self.entries:
+      self.size -= self.entries.pop(key)[1]
+    if memorySize > self.maximumSize:
+      return
+    self.entries[key] = (value, memorySize)
+    self.size += memorySize
+    while self.size > self.maximumSize:
+      self.size -= self.entries.popitem(last=False)[1][1]
+
+  def clear(self):
+    self.entries.clear()
+    self.size = 0
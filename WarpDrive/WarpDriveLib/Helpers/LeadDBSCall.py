@@ -4,6 +4,8 @@ import json
 import shutil
 import glob
 
+from .CorrectionStore import CorrectionStore
+
 def getApprovedData(normalizationMethodFile):
   with open(normalizationMethodFile, 'r') as f:
     normalizationMethod = json.load(f)
@@ -23,14 +25,17 @@ def applyChanges(correctionsTransformNodeID, nativeReferencePath, templateRefere
     "inputTransform1File": forwardWarpPath,
     "inputTransform2Node": correctionsTransformNodeID,
     "inputReferenceVolumeFile" : templateReferencePath,
-    "outputFileName" : forwardWarpPath
+    "outputFileName" : forwardWarpPath,
+    "boundedRegionTransform" : "Transform2"
     } 
 
   inverseParams = {
     "inputTransform1Node": correctionsTransformNodeID,
+    "invertTransform1": True,
     "inputTransform2File": inverseWarpPath,
     "inputReferenceVolumeFile" : nativeReferencePath,
-    "outputFileName" : inverseWarpPath
+    "outputFileName" : inverseWarpPath,
+    "boundedRegionTransform" : "Transform1"
     }
 
   forwardCliNode = slicer.mrmlScene.AddNode(slicer.cli.createNode(slicer.modules.compositetogridtransform, forwardParams))
@@ -55,8 +60,11 @@ def applyChanges(correctionsTransformNodeID, nativeReferencePath, templateRefere
                     w.children()[1].insertWidget(0,txt);\
                     w.resize(w.width,w.height/2);\
                     qt.QApplication.processEvents();\
-                    forwardCliNode.AddObserver(\'ModifiedEvent\', lambda c,e,w=w,icli=inverseCliNode: [slicer.util.getNode(c.GetParameterAsString(\'inputTransform2Node\')).Inverse(), w.setCurrentCommandLineModuleNode(icli), slicer.cli.run(slicer.modules.compositetogridtransform, icli)] if (c.GetStatus() == c.Completed) else None);\
-                    inverseCliNode.AddObserver(\'ModifiedEvent\', lambda c,e,w=w,: [shutil.rmtree(r\''+tmpScenePath+'\') if os.path.isdir(r\''+tmpScenePath+'\') else None, w.close(), slicer.mrmlScene.Clear(), qt.QApplication.processEvents(), qt.QTimer().singleShot(1000, lambda: slicer.util.exit())] if (c.GetStatus() == c.Completed) else None);\
+                    finished = [];\
+                    onCompleted = lambda c,e,w=w,f=forwardCliNode,i=inverseCliNode,finished=finished: [finished.append(True), shutil.rmtree(r\''+tmpScenePath+'\') if os.path.isdir(r\''+tmpScenePath+'\') else None, w.close(), slicer.mrmlScene.Clear(), qt.QApplication.processEvents(), qt.QTimer().singleShot(1000, lambda: slicer.util.exit())] if (f.GetStatus() == f.Completed and i.GetStatus() == i.Completed and not finished) else None;\
+                    forwardCliNode.AddObserver(\'ModifiedEvent\', onCompleted);\
+                    inverseCliNode.AddObserver(\'ModifiedEvent\', onCompleted);\
+                    slicer.cli.run(slicer.modules.compositetogridtransform, inverseCliNode);\
                     slicer.cli.run(slicer.modules.compositetogridtransform, forwardCliNode);'
 
   if useExternalInstance:
@@ -106,14 +114,200 @@ def applyChanges(correctionsTransformNodeID, nativeReferencePath, templateRefere
     exec(python_commands)
 
 
-def saveSourceTarget(warpDriveSavePath, sourceNode, targetNode):
+class SaveWorkerPool(object):
+  """
+  Save the corrections of queued subjects in the background by running the
+  composite to grid CLI executables directly, instead of a Slicer instance
+  per subject. At most maximumConcurrentSaves subjects are saved at a time, and
+  the saves of the same subject run one after the other, in submission order.
   """
-  Save source and target in subject directory so will be loaded next time
+
+  def __init__(self, maximumConcurrentSaves=2, statusCallback=None):
+    self.maximumConcurrentSaves = maximumConcurrentSaves
+    self.statusCallback = statusCallback
+    self.queue = []
+    self.running = []
+    self.status = {}
+    self.failedSubjectIDs = set()
+    self.exitWhenDone = False
+    self.timer = qt.QTimer()
+    self.timer.setInterval(500)
+    self.timer.connect('timeout()', self.poll)
+
+  def submit(self, subjectID, correctionsTransformNodeID, nativeReferencePath, templateReferencePath, forwardWarpPath, inverseWarpPath, subjectWarpDrivePath):
+    # corrections are written now, the node is removed when going to the next subject
+    import tempfile
+    fileDescriptor, correctionsPath = tempfile.mkstemp(dir=subjectWarpDrivePath, prefix='tmpCorrections', suffix='.h5')
+    os.close(fileDescriptor)
+    fileDescriptor, logPath = tempfile.mkstemp(dir=subjectWarpDrivePath, prefix='save', suffix='.log')
+    os.close(fileDescriptor)
+    slicer.util.saveNode(slicer.util.getNode(correctionsTransformNodeID), correctionsPath)
+    cliPath = self.getCLIExecutablePath(slicer.modules.compositetogridtransform)
+    numberOfThreads = str(max(1, os.cpu_count() // (2 * self.maximumConcurrentSaves)))
+    forwardCommand = [cliPath,
+                      '--inputTransform1File', forwardWarpPath,
+                      '--inputTransform2File', correctionsPath,
+                      '--inputReferenceVolumeFile', templateReferencePath,
+                      '--outputFileName', forwardWarpPath,
+                      '--boundedRegionTransform', 'Transform2',
+                      '--numberOfThreads', numberOfThreads]
+    inverseCommand = [cliPath,
+                      '--inputTransform1File', correctionsPath,
+                      '--invertTransform1',
+                      '--inputTransform2File', inverseWarpPath,
+                      '--inputReferenceVolumeFile', nativeReferencePath,
+                      '--outputFileName', inverseWarpPath,
+                      '--boundedRegionTransform', 'Transform1',
+                      '--numberOfThreads', numberOfThreads]
+    self.queue.append({'subjectID': subjectID,
+                       'commands': [forwardCommand, inverseCommand],
+                       'correctionsPath': correctionsPath,
+                       'logPath': logPath})
+    self.setStatus(subjectID, 'queued')
+    self.startQueuedJobs()
+
+  @staticmethod
+  def getCLIExecutablePath(module):
+    # module path is the shared library if the CLI is not loaded as an executable,
+    # the executable is built next to it
+    executablePath = os.path.join(os.path.dirname(module.path), module.name)
+    if os.name == 'nt':
+      executablePath += '.exe'
+    return executablePath if os.path.isfile(executablePath) else module.path
+
+  def startQueuedJobs(self):
+    import subprocess
+    for job in list(self.queue):
+      if len(self.running) >= self.maximumConcurrentSaves:
+        break
+      if self.isSaving(job['subjectID']):
+        continue # outputs of the running save are the inputs of this one
+      self.queue.remove(job)
+      job['log'] = open(job['logPath'], 'w')
+      job['processes'] = []
+      try:
+        for command in job['commands']:
+          job['processes'].append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=job['log']))
+      except OSError as e:
+        job['log'].write('Could not start %s: %s\n' % (command[0], e))
+        for process in job['processes']:
+          process.kill()
+          process.wait()
+        self.finishJob(job, False)
+        continue
+      self.running.append(job)
+      self.setStatus(job['subjectID'], 'saving')
+    if self.running:
+      self.timer.start()
+
+  def poll(self):
+    for job in list(filter(lambda j: all(p.poll() is not None for p in j['processes']), self.running)):
+      self.running.remove(job)
+      self.finishJob(job, all(p.returncode == 0 for p in job['processes']))
+    self.startQueuedJobs()
+    if not self.isBusy():
+      self.timer.stop()
+      if self.exitWhenDone:
+        slicer.util.exit(0)
+
+  def finishJob(self, job, succeeded):
+    job['log'].close()
+    if os.path.isfile(job['correctionsPath']):
+      os.remove(job['correctionsPath'])
+    if succeeded:
+      os.remove(job['logPath'])
+    else:
+      print("Failed to save subject %s, see %s" % (job['subjectID'], job['logPath']))
+      self.failedSubjectIDs.add(job['subjectID'])
+    if any(j['subjectID'] == job['subjectID'] for j in self.queue):
+      self.setStatus(job['subjectID'], 'queued')
+    else:
+      self.setStatus(job['subjectID'], 'failed' if job['subjectID'] in self.failedSubjectIDs else 'saved')
+
+  def isSaving(self, subjectID):
+    return any(job['subjectID'] == subjectID for job in self.running)
+
+  def isBusy(self):
+    return bool(self.queue or self.running)
+
+  def exitWhenFinished(self):
+    if self.isBusy():
+      self.exitWhenDone = True
+    else:
+      slicer.util.exit(0)
+
+  def setStatus(self, subjectID, status):
+    self.status[subjectID] = status
+    if self.statusCallback is not None:
+      self.statusCallback(self.status)
+
+
+class SubjectPrefetcher(object):
+  """
+  Read the files of the next subject in a background thread while the current
+  one is being corrected, so that they are in the OS file cache when loaded.
+  Creating the nodes has to happen in the main thread, so only the reading
+  (the slow part on network drives and spinning disks) is done in advance.
+  """
+
+  chunkSize = 16 * 1024 * 1024
+
+  def __init__(self):
+    self.thread = None
+    self.stopEvent = None
+
+  def prefetch(self, subject, modality):
+    self.stop()
+    modalities = sorted(subject["anat_files"].keys(), key=lambda m: m != modality) # current modality first
+    fileNames = [subject["forward_transform"], subject["inverse_transform"]] + [subject["anat_files"][m] for m in modalities]
+    import threading
+    self.stopEvent = threading.Event()
+    self.thread = threading.Thread(target=SubjectPrefetcher.readFiles, args=(fileNames, self.stopEvent), daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    if self.thread is not None:
+      self.stopEvent.set()
+      self.thread = None
+
+  @staticmethod
+  def readFiles(fileNames, stopEvent):
+    buffer = bytearray(SubjectPrefetcher.chunkSize)
+    for fileName in fileNames:
+      try:
+        with open(fileName, 'rb') as f:
+          while not stopEvent.is_set() and f.readinto(buffer):
+            pass
+      except OSError:
+        pass
+      if stopEvent.is_set():
+        return
+
+
+def saveSourceTarget(warpDriveSavePath, sourceNode, targetNode, exportJSON=False):
+  """
+  Save source and target in subject directory so will be loaded next time.
+  The legacy source.json and target.json are also written if exportJSON is set.
   """
   if not os.path.isdir(warpDriveSavePath):
     os.mkdir(warpDriveSavePath)  
-  slicer.util.saveNode(sourceNode, os.path.join(warpDriveSavePath, 'source.json'))
-  slicer.util.saveNode(targetNode, os.path.join(warpDriveSavePath, 'target.json'))
+  correctionStore = CorrectionStore(warpDriveSavePath)
+  if exportJSON:
+    correctionStore.exportJSON(sourceNode, targetNode)
+  else:
+    correctionStore.save(sourceNode, targetNode)
+
+def loadSourceTarget(warpDriveSavePath):
+  """
+  Load source and target saved in subject directory, from the correction store or
+  from the legacy markups files if they were modified since. Returns None if there are none.
+  """
+  correctionStore = CorrectionStore(warpDriveSavePath)
+  if correctionStore.isJSONModified():
+    return correctionStore.importJSON()
+  if correctionStore.exists():
+    return correctionStore.load()
+  return None
 
 def getAtlasesNamesInScene():
   shNode = slicer.mrmlScene.GetSubjectHierarchyNode()
@@ -0,0 +1,52 @@
+import numpy as np
+
+# In-process version of the variable radius Gaussian RBF computed by the
+# FiducialRegistrationVariableRBF CLI (same kernels, regularization and truncation).
+
+def findCoefficients(fixedPoints, movingPoints, radius, stiffness, cutoffFactor=4.0):
+  # squared distances between landmarks. P[k,i]: kernel of landmark k at landmark i
+  d2 = np.sum((fixedPoints[:,np.newaxis,:] - fixedPoints[np.newaxis,:,:]) ** 2, axis=2)
+  P = np.exp(-d2 / radius[:,np.newaxis] ** 2)
+  if cutoffFactor > 0:
+    P[d2 > (cutoffFactor * radius[:,np.newaxis]) ** 2] = 0
+  # the system is the same for x, y and z
+  A = P.T @ P
+  if stiffness != 0:
+    prefactor = (np.pi / 2) ** 1.5 / np.mean(radius)
+    r2 = d2 / np.outer(radius, radius)
+    R = prefactor * np.exp(-r2 / 2) * (-10 + (r2 - 5) ** 2)
+    if cutoffFactor > 0:
+      R[r2 > 4 * cutoffFactor ** 2] = 0
+    np.fill_diagonal(R, prefactor * 15)
+    A += stiffness * R
+  b = -P.T @ (fixedPoints - movingPoints)
+  # cholesky when well conditioned, truncated least squares (as the CLI SVD) otherwise
+  try:
+    L = np.linalg.cholesky(A)
+    if (np.min(np.diag(L)) / np.max(np.diag(L))) ** 2 > 1e-10:
+      return np.linalg.solve(L.T, np.linalg.solve(L, b))
+  except np.linalg.LinAlgError:
+    pass
+  return np.linalg.lstsq(A, b, rcond=1e-6)[0]
+
+def addToDisplacementField(displacement, origin, spacing, direction, points, radius, coefficients, cutoffFactor=4.0):
+  # displacement: (k,j,i,3) array of the grid, modified in place
+  # direction: 3x3 orthonormal grid direction matrix
+  # Gaussians are separable along the grid axes, so each landmark block is an outer product
+  size = np.array(displacement.shape[2::-1])
+  gridPoints = (points - origin) @ direction # landmarks in grid axes, physical units
+  extent = cutoffFactor * radius if cutoffFactor > 0 else np.full(len(radius), np.inf)
+  begin = np.clip(np.ceil((gridPoints - extent[:,np.newaxis]) / spacing), 0, size).astype(int)
+  end = np.clip(np.floor((gridPoints + extent[:,np.newaxis]) / spacing) + 1, 0, size).astype(int)
+  for l in range(len(points)):
+    if np.any(end[l] <= begin[l]):
+      continue
+    g = [np.exp(-((np.arange(begin[l,a], end[l,a]) * spacing[a] - gridPoints[l,a]) / radius[l]) ** 2) for a in range(3)]
+    block = g[2][:,np.newaxis,np.newaxis] * g[1][np.newaxis,:,np.newaxis] * g[0][np.newaxis,np.newaxis,:]
+    displacement[begin[l,2]:end[l,2], begin[l,1]:end[l,1], begin[l,0]:end[l,0]] += block[...,np.newaxis] * coefficients[l]
+
+def computeDisplacementField(displacement, origin, spacing, direction, fixedPoints, movingPoints, radius, stiffness, cutoffFactor=4.0):
+  coefficients = findCoefficients(fixedPoints, movingPoints, radius, stiffness, cutoffFactor)
+  displacement[:] = 0
+  addToDisplacementField(displacement, origin, spacing, direction, fixedPoints, radius, coefficients.astype(displacement.dtype), cutoffFactor)
+  return coefficients
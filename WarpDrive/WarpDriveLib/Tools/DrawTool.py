@@ -1,5 +1,6 @@
 import qt, vtk, slicer
 import numpy as np
+from vtk.util import numpy_support
 
 
 from ..Widgets.ToolWidget   import AbstractToolWidget
@@ -33,6 +34,8 @@ class DrawToolWidget(AbstractToolWidget):
 
 class DrawToolEffect(AbstractDrawEffect):
 
+  # model node ID -> model poly data in world coordinates, with its bounds and cell locator
+  hardenedModels = {}
 
   def __init__(self, sliceWidget):
     AbstractDrawEffect.__init__(self, sliceWidget)
@@ -157,8 +160,6 @@ class DrawToolEffect(AbstractDrawEffect):
     return fiducial
 
   def sliceClosestModel(self, point):
-    shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
-    originalModel = None
     # set up plane
     sliceToRAS = self.sliceLogic.GetSliceNode().GetSliceToRAS()
     normal = np.array([sliceToRAS.GetElement(0,2), sliceToRAS.GetElement(1,2), sliceToRAS.GetElement(2,2)])
@@ -169,43 +170,48 @@ class DrawToolEffect(AbstractDrawEffect):
     cutter = vtk.vtkCutter()
     cutter.SetCutFunction(plane)
     cutter.SetGenerateCutScalars(0)
-    cutter.Update()
-    # init point locator and output
-    pointsLocator = vtk.vtkPointLocator() 
-    globalMinDistance = 1000
-    outPolyData = vtk.vtkPolyData()
-    # iterate over models in scene
+    # candidate models: visible, with cells, and crossing the plane
+    candidates = []
+    modelIDs = set()
     nModels = slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLModelNode')
     for i in range(nModels):
       model = slicer.mrmlScene.GetNthNodeByClass(i, 'vtkMRMLModelNode')
-      if model.GetTransformNodeID():
-        try:
-          clonedItemID = slicer.modules.subjecthierarchy.logic().CloneSubjectHierarchyItem(shNode, shNode.GetItemByDataNode(model))
-          tmpNode = shNode.GetItemDataNode(clonedItemID)
-          tmpNode.SetAndObserveTransformNodeID(model.GetTransformNodeID())
-        except:
-          continue
-        tmpNode.HardenTransform()
-        polyData = tmpNode.GetPolyData()
-      else:
-        polyData = model.GetPolyData()
-        tmpNode = None
-      if model.GetDisplayNode() and model.GetDisplayNode().GetVisibility() and polyData.GetNumberOfCells() > 1 and model.GetName()!= 'auxSphereModel': # model visible and cells available
-        cutter.SetInputData(polyData)
-        cutter.Update()
-        cutterOutput = cutter.GetOutput()
-        if cutterOutput.GetNumberOfCells(): # model intersects with plane
-          # get distance from input point to closest point in model
-          pointsLocator.SetDataSet(cutterOutput)
-          pointsLocator.BuildLocator()
-          closestPoint = cutterOutput.GetPoint(pointsLocator.FindClosestPoint(point))
-          localMinDistance = vtk.vtkMath().Distance2BetweenPoints(closestPoint, point)
-          if localMinDistance < globalMinDistance: # new min
-            outPolyData.DeepCopy(cutterOutput)
-            globalMinDistance = localMinDistance
-            originalModel = model
-      if tmpNode:
-        slicer.mrmlScene.RemoveNode(tmpNode)
+      modelIDs.add(model.GetID())
+      polyData = model.GetPolyData()
+      if not (model.GetDisplayNode() and model.GetDisplayNode().GetVisibility() and polyData and polyData.GetNumberOfCells() > 1 and model.GetName()!= 'auxSphereModel'):
+        continue
+      hardenedModel = self.getHardenedModel(model)
+      bounds = hardenedModel['bounds']
+      corners = np.array(np.meshgrid(bounds[0:2], bounds[2:4], bounds[4:6])).reshape(3,-1).T
+      cornersDistance = np.dot(corners - point, normal)
+      if cornersDistance.min() > 0 or cornersDistance.max() < 0: # bounding box not crossing the plane
+        continue
+      # distance to the model surface is a lower bound of the distance to its intersection with the plane
+      closestPoint, cellId, subId, distance2 = [0.0,0.0,0.0], vtk.reference(0), vtk.reference(0), vtk.reference(0.0)
+      hardenedModel['locator'].FindClosestPoint(point, closestPoint, cellId, subId, distance2)
+      candidates.append((float(distance2), model, hardenedModel['polyData']))
+    # forget models removed from the scene
+    for modelID in set(type(self).hardenedModels) - modelIDs:
+      del type(self).hardenedModels[modelID]
+    # cut the closest candidates first, stop once the lower bound is larger than the closest found
+    originalModel = None
+    globalMinDistance = 1000
+    outPolyData = vtk.vtkPolyData()
+    candidates.sort(key=lambda candidate: candidate[0])
+    for surfaceDistance, model, polyData in candidates:
+      if surfaceDistance >= globalMinDistance:
+        break
+      cutter.SetInputData(polyData)
+      cutter.Update()
+      cutterOutput = cutter.GetOutput()
+      if cutterOutput.GetNumberOfCells(): # model intersects with plane
+        # get distance from input point to closest point in model
+        cutPoints = numpy_support.vtk_to_numpy(cutterOutput.GetPoints().GetData())
+        localMinDistance = np.min(np.sum((cutPoints - point) ** 2, axis=1))
+        if localMinDistance < globalMinDistance: # new min
+          outPolyData.DeepCopy(cutterOutput)
+          globalMinDistance = localMinDistance
+          originalModel = model
     # return in case no model found
     if not originalModel:
       return False, False
@@ -219,6 +225,29 @@ class DrawToolEffect(AbstractDrawEffect):
     slicedModel.GetDisplayNode().SetVisibility(0)
     return slicedModel, originalModel
 
+  def getHardenedModel(self, model):
+    # the hardened poly data is only computed again if the model mesh or its transforms changed
+    polyData = model.GetPolyData()
+    transformNode = model.GetParentTransformNode()
+    key = (polyData.GetMTime(), transformNode.GetID() if transformNode else None, transformNode.GetTransformToWorldMTime() if transformNode else 0)
+    hardenedModel = type(self).hardenedModels.get(model.GetID())
+    if hardenedModel is not None and hardenedModel['key'] == key:
+      return hardenedModel
+    if transformNode:
+      transformToWorld = vtk.vtkGeneralTransform()
+      transformNode.GetTransformToWorld(transformToWorld)
+      transformFilter = vtk.vtkTransformPolyDataFilter()
+      transformFilter.SetTransform(transformToWorld)
+      transformFilter.SetInputData(polyData)
+      transformFilter.Update()
+      polyData = transformFilter.GetOutput()
+    locator = vtk.vtkStaticCellLocator()
+    locator.SetDataSet(polyData)
+    locator.BuildLocator()
+    hardenedModel = {'key': key, 'polyData': polyData, 'bounds': np.array(polyData.GetBounds()), 'locator': locator}
+    type(self).hardenedModels[model.GetID()] = hardenedModel
+    return hardenedModel
+
   def cleanup(self):
     slicer.mrmlScene.RemoveNode(self.sourceFiducial)
     self.sourceFiducial = None
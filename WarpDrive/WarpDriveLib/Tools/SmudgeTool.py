@@ -1,5 +1,6 @@
 import qt, vtk, slicer
 import numpy as np
+from vtk.util import numpy_support
 
 
 from ..Widgets.ToolWidget   import AbstractToolWidget
@@ -18,6 +19,8 @@ class SmudgeToolEffect(AbstractCircleEffect):
 
   auxTransformNode = None
   auxTransfromRASToIJK = None
+  previewTransformNode = None
+  sphereKernels = {} # radius (voxels) -> (kernel, buffer of the same shape)
 
   def __init__(self, sliceWidget):
     AbstractCircleEffect.__init__(self, sliceWidget)
@@ -29,12 +32,22 @@ class SmudgeToolEffect(AbstractCircleEffect):
       size = size * (spacing / userSpacing)
       type(self).auxTransformNode = GridNodeHelper.emptyGridTransform(size.astype(int), origin, userSpacing, directionMatrix) 
       type(self).auxTransfromRASToIJK = GridNodeHelper.getTransformRASToIJK(self.auxTransformNode)  
+      type(self).previewTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLGridTransformNode')
 
     # points
     self.interactionPoints = vtk.vtkPoints()
 
     self.previousPoint = np.zeros(3)
     self.smudging = False
+    # grid index region (start, stop in k, j, i) modified by the current stroke
+    self.dirtyExtent = None
+
+    # mouse moves are coalesced, only the latest position is applied once per display frame
+    self.pendingPoint = None
+    self.updateTimer = qt.QTimer()
+    self.updateTimer.setSingleShot(True)
+    self.updateTimer.setInterval(self.getFrameInterval())
+    self.updateTimer.connect('timeout()', self.applyPendingPoint)
 
 
   def processEvent(self, caller=None, event=None):
@@ -42,81 +55,131 @@ class SmudgeToolEffect(AbstractCircleEffect):
     AbstractCircleEffect.processEvent(self, caller, event)
 
     if event == 'LeftButtonPressEvent':
-      self.parameterNode.GetNodeReference("OutputGridTransform").SetAndObserveTransformNodeID(self.auxTransformNode.GetID())    
+      # while smudging, views show a preview transform covering only the modified region of the aux transform
       self.auxTransformArray = slicer.util.array(self.auxTransformNode.GetID())
+      self.dirtyExtent = None
+      self.updatePreviewTransform()
+      self.parameterNode.GetNodeReference("OutputGridTransform").SetAndObserveTransformNodeID(self.previewTransformNode.GetID())
       self.previousPoint = self.xyToRAS(self.interactor.GetEventPosition())
       self.interactionPoints.InsertNextPoint(self.previousPoint)
       self.smudging = True
 
     elif event == 'LeftButtonReleaseEvent' and self.smudging:
+      self.updateTimer.stop()
+      self.applyPendingPoint()
       self.smudging = False
+      self.auxTransformNode.Modified()
+      self.parameterNode.GetNodeReference("OutputGridTransform").SetAndObserveTransformNodeID(self.auxTransformNode.GetID())
       # resample
-      self.resamplePoints()
-      # get source and target
-      sourceFiducial, targetFiducial = self.getSourceTargetFromPoints()
+      sourcePoints = self.resamplePoints()
+      # get target
+      targetPoints = self.transformPoints(sourcePoints, self.auxTransformNode.GetTransformToParent()) # apply smudge
       # apply
-      self.applyCorrection(sourceFiducial, targetFiducial)
+      self.applyCorrectionFromPoints(sourcePoints, targetPoints, slicer.mrmlScene.GenerateUniqueName('smudge'))
       # reset
       self.parameterNode.GetNodeReference("OutputGridTransform").HardenTransform()
       self.interactionPoints = vtk.vtkPoints()
-      self.auxTransformArray[:] = np.zeros(self.auxTransformArray.shape)
-      self.auxTransformNode.Modified()
+      self.clearAuxTransform()
       # qt.QApplication.setOverrideCursor(qt.QCursor(qt.Qt.ArrowCursor))
 
     elif (event == 'RightButtonPressEvent' or (event == 'KeyPressEvent' and self.interactor.GetKeySym()=='Escape')) and self.smudging:
       self.cancelSmudging()
 
     elif event == 'MouseMoveEvent' and self.smudging:
-
-      r = int(round(float(self.parameterNode.GetParameter("Radius")) / self.auxTransformNode.GetTransformFromParent().GetDisplacementGrid().GetSpacing()[0])) # Asume isotropic!
-      sphereResult = self.createSphere(r)
-      currentPoint = np.array(self.xyToRAS(self.interactor.GetEventPosition()))
-      currentIndex = self.getCurrentIndex(r, currentPoint, self.auxTransfromRASToIJK)
-      self.interactionPoints.InsertNextPoint(currentPoint)
-
-      # apply to transform array
-      try:
-        self.auxTransformArray[currentIndex] += np.stack([(sphereResult) * i for i in (self.previousPoint - currentPoint)],3) # original
-      except ValueError: # error when modifing outside the grid
-        self.cancelSmudging()
-
-      # update view
-      self.auxTransformNode.Modified()
-      # update previous point
-      self.previousPoint = currentPoint
-
+      self.pendingPoint = np.array(self.xyToRAS(self.interactor.GetEventPosition()))
+      if not self.updateTimer.isActive():
+        self.updateTimer.start()
+
+  def applyPendingPoint(self):
+    if not self.smudging or self.pendingPoint is None:
+      return
+    currentPoint = self.pendingPoint
+    self.pendingPoint = None
+
+    r = int(round(float(self.parameterNode.GetParameter("Radius")) / self.auxTransformNode.GetTransformFromParent().GetDisplacementGrid().GetSpacing()[0])) # Asume isotropic!
+    kernel, buffer = self.getSphereKernel(r)
+    gridIndex, kernelIndex = self.getClippedIndex(r, currentPoint, self.auxTransfromRASToIJK, self.auxTransformArray.shape)
+    self.interactionPoints.InsertNextPoint(currentPoint)
+
+    # add to transform array in place, the part of the sphere out of the grid is dropped
+    if gridIndex is not None:
+      kernel, buffer = kernel[kernelIndex], buffer[kernelIndex]
+      for c, displacement in enumerate(self.previousPoint - currentPoint):
+        component = self.auxTransformArray[gridIndex + (c,)]
+        np.multiply(kernel, displacement, out=buffer)
+        np.add(component, buffer, out=component)
+      self.expandDirtyExtent(gridIndex)
+
+    # update view
+    self.updatePreviewTransform()
+    # update previous point
+    self.previousPoint = currentPoint
 
   def cancelSmudging(self):
+    self.updateTimer.stop()
+    self.pendingPoint = None
     self.smudging = False
     self.interactionPoints = vtk.vtkPoints()
-    self.auxTransformArray[:] = np.zeros(self.auxTransformArray.shape)
+    self.clearAuxTransform()
+    self.parameterNode.GetNodeReference("OutputGridTransform").SetAndObserveTransformNodeID(self.auxTransformNode.GetID())
+
+  def clearAuxTransform(self):
+    # only the region modified by the stroke needs to be reset
+    if self.dirtyExtent is not None:
+      start, stop = self.dirtyExtent
+      self.auxTransformArray[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]] = 0
+      self.dirtyExtent = None
     self.auxTransformNode.Modified()
-
-  def resamplePoints(self):
-    # resample points 
-    sourceCurve = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsCurveNode')
-    sourceCurve.SetControlPointPositionsWorld(self.interactionPoints)
-    sourceCurve.ResampleCurveWorld(1)  
-    sourceCurve.GetControlPointPositionsWorld(self.interactionPoints)
-    slicer.mrmlScene.RemoveNode(sourceCurve)
-
-  def getSourceTargetFromPoints(self):
-    # source points
-    sourceFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
-    sourceFiducial.GetDisplayNode().SetGlyphTypeFromString('Sphere3D')
-    sourceFiducial.GetDisplayNode().SetGlyphScale(1)
-    sourceFiducial.GetDisplayNode().SetVisibility(0)
-    sourceFiducial.SetControlPointPositionsWorld(self.interactionPoints)
-    # target
-    targetFiducial = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
-    targetFiducial.GetDisplayNode().SetGlyphTypeFromString('Sphere3D')
-    targetFiducial.GetDisplayNode().SetGlyphScale(1)
-    targetFiducial.GetDisplayNode().SetVisibility(0)
-    targetFiducial.SetControlPointPositionsWorld(self.interactionPoints)
-    targetFiducial.ApplyTransform(self.auxTransformNode.GetTransformToParent()) # apply smudge
-    targetFiducial.SetName(slicer.mrmlScene.GenerateUniqueName('smudge'))
-
-    return sourceFiducial, targetFiducial
+    self.updatePreviewTransform()
+
+  def expandDirtyExtent(self, gridIndex):
+    # include the cubic interpolation support, so that the preview is zero on its border as the aux transform
+    margin = 2
+    start = np.maximum([s.start - margin for s in gridIndex], 0)
+    stop = np.minimum([s.stop + margin for s in gridIndex], self.auxTransformArray.shape[:3])
+    if self.dirtyExtent is not None:
+      start = np.minimum(start, self.dirtyExtent[0])
+      stop = np.maximum(stop, self.dirtyExtent[1])
+    self.dirtyExtent = (start, stop)
+
+  def updatePreviewTransform(self):
+    # copy the modified region of the aux transform to the preview transform, which is
+    # re-allocated only when the region grows. An empty region gives a small zero grid.
+    if self.dirtyExtent is None:
+      start, stop = np.zeros(3, dtype=int), np.minimum(4, self.auxTransformArray.shape[:3])
+    else:
+      start, stop = self.dirtyExtent
+    size = (stop - start)[::-1] # i, j, k
+    grid = self.previewTransformNode.GetTransformFromParent().GetDisplacementGrid() if self.previewTransformNode.GetTransformFromParent() else None
+    if grid is None or tuple(grid.GetDimensions()) != tuple(size):
+      _, _, spacing, directionMatrix = GridNodeHelper.getGridDefinition(self.auxTransformNode)
+      GridNodeHelper.emptyGridTransform(size, np.zeros(3), spacing, directionMatrix, self.previewTransformNode)
+      grid = self.previewTransformNode.GetTransformFromParent().GetDisplacementGrid()
+    ijkToRAS = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Invert(self.auxTransfromRASToIJK, ijkToRAS)
+    grid.SetOrigin(ijkToRAS.MultiplyPoint(np.append(start[::-1], 1).tolist())[:3])
+    previewArray = slicer.util.array(self.previewTransformNode.GetID())
+    previewArray[:] = self.auxTransformArray[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+    self.previewTransformNode.Modified()
+
+  def getFrameInterval(self):
+    # milliseconds between display refreshes
+    try:
+      refreshRate = qt.QApplication.primaryScreen().refreshRate()
+    except AttributeError:
+      refreshRate = 0
+    return int(1000 / refreshRate) if refreshRate > 0 else 16
+
+  def resamplePoints(self, sampleDistance = 1):
+    # resample the interaction points along the polyline arc length, keeping both ends
+    points = numpy_support.vtk_to_numpy(self.interactionPoints.GetData()).astype(np.float64)
+    segmentLength = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    points = points[np.concatenate(([True], segmentLength > 0))] # drop repeated points
+    arcLength = np.concatenate(([0], np.cumsum(segmentLength[segmentLength > 0])))
+    if len(points) < 2:
+      return points[:1]
+    samples = np.linspace(0, arcLength[-1], int(np.ceil(arcLength[-1] / sampleDistance)) + 1)
+    return np.stack([np.interp(samples, arcLength, points[:,c]) for c in range(3)], 1)
 
   def createSphere(self, r):
     # create a sphere with redius
@@ -127,6 +190,12 @@ class SmudgeToolEffect(AbstractCircleEffect):
     sphereResult = sphereResult / sphereResult[r][r][r]
     return sphereResult
 
+  def getSphereKernel(self, r):
+    if r not in type(self).sphereKernels:
+      kernel = self.createSphere(r)
+      type(self).sphereKernels[r] = (kernel, np.empty_like(kernel))
+    return type(self).sphereKernels[r]
+
   def getCurrentIndex(self, r, currentPoint, RASToIJK):
     # get current IJK
     pos_i,pos_j,pos_k,aux = RASToIJK.MultiplyDoublePoint(np.append(currentPoint, 1))
@@ -135,8 +204,22 @@ class SmudgeToolEffect(AbstractCircleEffect):
     currentIndex = slice(k-r,k+r+1), slice(j-r,j+r+1), slice(i-r,i+r+1)
     return currentIndex
 
+  def getClippedIndex(self, r, currentPoint, RASToIJK, gridShape):
+    # grid and sphere kernel indexes of the part of the sphere inside the grid (None if outside)
+    gridIndex = []
+    kernelIndex = []
+    for currentSlice, size in zip(self.getCurrentIndex(r, currentPoint, RASToIJK), gridShape[:3]):
+      start, stop = max(currentSlice.start, 0), min(currentSlice.stop, size)
+      if start >= stop:
+        return None, None
+      gridIndex.append(slice(start, stop))
+      kernelIndex.append(slice(start - currentSlice.start, stop - currentSlice.start))
+    return tuple(gridIndex), tuple(kernelIndex)
+
   def cleanup(self):
+    self.updateTimer.stop()
     slicer.mrmlScene.RemoveNode(self.auxTransformNode)
+    slicer.mrmlScene.RemoveNode(self.previewTransformNode)
     type(self).cleanAuxTransform()
     #WarpEffectTool.cleanup(self)
     AbstractCircleEffect.cleanup(self)
@@ -145,3 +228,4 @@ class SmudgeToolEffect(AbstractCircleEffect):
   def cleanAuxTransform(cls):
     cls.auxTransformNode = None
     cls.auxTransfromRASToIJK = None
+    cls.previewTransformNode = None
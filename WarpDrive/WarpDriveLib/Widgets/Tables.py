@@ -7,6 +7,7 @@ from ..Helpers import GridNodeHelper
 import numpy as np
 import glob
 import json
+import difflib
 
 class TextEditDelegate(qt.QItemDelegate):
   def __init__(self, parent, renameControlPointsFunction):
@@ -534,6 +535,12 @@ class WarpDriveCorrectionsManager(WarpDriveCorrectionsTable, VTKObservationMixin
     self.sourceFiducialNodeID = ""
     self.targetFiducialNodeID = ""
     self._updatingFiducials = False
+    self._correctionIndex = None
+    self._updatingTable = False
+    self.setUpWidgetTimer = qt.QTimer()
+    self.setUpWidgetTimer.setSingleShot(True)
+    self.setUpWidgetTimer.setInterval(0)
+    self.setUpWidgetTimer.connect('timeout()', self.setUpWidget)
     self.targetFiducialObservers = []
     self.sourceFiducialObservers = []
     self.parameterNode = WarpDrive.WarpDriveLogic().getParameterNode()
@@ -587,6 +594,7 @@ class WarpDriveCorrectionsManager(WarpDriveCorrectionsTable, VTKObservationMixin
       self.targetFiducialObservers.append(targetFiducialNode.AddObserver(targetFiducialNode.PointRemovedEvent, self.targetFiducialModified))
       self.targetFiducialObservers.append(targetFiducialNode.AddObserver(targetFiducialNode.PointModifiedEvent, self.targetFiducialModified))
       self.targetFiducialObservers.append(targetFiducialNode.AddObserver(targetFiducialNode.PointPositionDefinedEvent, self.onPointPositionDefined))
+      self._correctionIndex = None
       self.setUpWidget()
       self.updateVisibilityWidget()
 
@@ -601,39 +609,61 @@ class WarpDriveCorrectionsManager(WarpDriveCorrectionsTable, VTKObservationMixin
         self.sourceVisibleAction.checked = sourceFiducialNode.GetDisplayNode().GetVisibility()
 
   def targetFiducialModified(self, caller, event):
-    self.setUpWidget()
+    if self._updatingFiducials:
+      return
+    self._correctionIndex = None
+    # point events are coalesced, the table is updated once control returns to the event loop
+    self.setUpWidgetTimer.start()
 
   def setUpWidget(self):
+    # update the table rows to match the corrections in the target fiducial, only the
+    # rows of corrections that were added, removed or modified are changed
     if self._updatingFiducials:
       return
-    self.clearTable()
+    self.setUpWidgetTimer.stop()
     targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
-    newCorrection = {"include": False, "name": "", "radius":""}
+    corrections = []
     for i in range(targetFiducialNode.GetNumberOfControlPoints()):
-      if newCorrection["name"] == targetFiducialNode.GetNthControlPointLabel(i):
+      name = targetFiducialNode.GetNthControlPointLabel(i)
+      if corrections and corrections[-1]["name"] == name:
         continue
-      else:
-        self.addCorrectionToWidget(newCorrection)
-        newCorrection["name"] = targetFiducialNode.GetNthControlPointLabel(i)
-        newCorrection["radius"] = targetFiducialNode.GetNthControlPointDescription(i)
-        newCorrection["include"] = targetFiducialNode.GetNthControlPointSelected(i)
-    self.addCorrectionToWidget(newCorrection)
-
-  def addCorrectionToWidget(self, newCorrection):
+      corrections.append({"include": targetFiducialNode.GetNthControlPointSelected(i), "name": name, "radius": targetFiducialNode.GetNthControlPointDescription(i)})
+    # consecutive points with the same label are one correction, unlabeled points have no row
+    corrections = [correction for correction in corrections if correction["name"] != ""]
+    rowNames = [self.model.data(self.model.index(row, 1)) for row in range(self.model.rowCount())]
+    matcher = difflib.SequenceMatcher(None, rowNames, [correction["name"] for correction in corrections], autojunk=False)
+    self._updatingTable = True
+    try:
+      # from the end so that the row numbers of the following operations stay valid
+      for tag, rowStart, rowStop, correctionStart, correctionStop in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+          for row, correction in zip(range(rowStart, rowStop), corrections[correctionStart:correctionStop]):
+            self.setCorrectionRow(row, correction)
+        else:
+          if rowStop > rowStart:
+            self.model.removeRows(rowStart, rowStop - rowStart)
+          for offset, correction in enumerate(corrections[correctionStart:correctionStop]):
+            self.addCorrectionToWidget(correction, rowStart + offset)
+    finally:
+      self._updatingTable = False
+
+  def addCorrectionToWidget(self, newCorrection, row=None):
     if newCorrection["name"] == "":
       return
-
-    row = self.model.rowCount()
+    row = self.model.rowCount() if row is None else row
     self.model.insertRow(row)
-    for col,val in enumerate(newCorrection.values()):
+    self.setCorrectionRow(row, newCorrection)
+
+  def setCorrectionRow(self, row, correction):
+    for col,val in enumerate(correction.values()):
       index = self.model.index(row, col)
       if col == 0:
         val = qt.Qt.Checked if val else qt.Qt.Unchecked
         role = qt.Qt.CheckStateRole
       else:
         role = qt.Qt.DisplayRole
-
-      self.model.setData(index, val, role)
+      if self.model.data(index, role) != val:
+        self.model.setData(index, val, role)
 
   def onPointPositionDefined(self, caller, event):
     targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
@@ -680,6 +710,7 @@ class WarpDriveCorrectionsManager(WarpDriveCorrectionsTable, VTKObservationMixin
       if ('SnapBackUp' in shNode.GetItemAttributeNames(shNode.GetItemByDataNode(backupNode))):
         targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
         targetFiducialNode.Copy(backupNode)
+        self._correctionIndex = None
         slicer.mrmlScene.RemoveNode(backupNode)
         targetFiducialNode.CreateDefaultDisplayNodes()
         targetFiducialNode.GetDisplayNode().SetGlyphTypeFromString('Sphere3D')
@@ -693,52 +724,65 @@ class WarpDriveCorrectionsManager(WarpDriveCorrectionsTable, VTKObservationMixin
         self.parameterNode.SetParameter("Update","true")
         return True
 
+  def getCorrectionIndex(self):
+    # correction name -> control point indices, built again after the target fiducial is modified
+    if self._correctionIndex is None:
+      targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
+      self._correctionIndex = {}
+      for i in range(targetFiducialNode.GetNumberOfControlPoints()):
+        self._correctionIndex.setdefault(targetFiducialNode.GetNthControlPointLabel(i), []).append(i)
+    return self._correctionIndex
+
+  def modifyCorrectionControlPoints(self, correctionName, modifyFunction):
+    # call modifyFunction(node, indices) for the target and source fiducials, each one in a single modify batch
+    if self.targetFiducialNodeID == "":
+      return False
+    indices = self.getCorrectionIndex().get(correctionName, [])
+    if not indices:
+      return False
+    fiducialNodes = [slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID), slicer.mrmlScene.GetNodeByID(self.sourceFiducialNodeID)]
+    self._updatingFiducials = True
+    try:
+      for fiducialNode in fiducialNodes:
+        wasModifying = fiducialNode.StartModify()
+        modifyFunction(fiducialNode, indices)
+        fiducialNode.EndModify(wasModifying)
+    finally:
+      self._updatingFiducials = False
+    return True
+
   def removeCorrectionByName(self, correctionName):
-    targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
-    sourceFiducialNode = slicer.mrmlScene.GetNodeByID(self.sourceFiducialNodeID)
-    for i in range(targetFiducialNode.GetNumberOfControlPoints()-1,-1,-1):
-      if targetFiducialNode.GetNthControlPointLabel(i) == correctionName:
-        targetFiducialNode.RemoveNthControlPoint(i)
-        sourceFiducialNode.RemoveNthControlPoint(i)
+    def removeControlPoints(fiducialNode, indices):
+      for i in reversed(indices):
+        fiducialNode.RemoveNthControlPoint(i)
+    if self.modifyCorrectionControlPoints(correctionName, removeControlPoints):
+      self._correctionIndex = None
+      self.setUpWidget()
     self.parameterNode.SetParameter("Update","true")
 
   def renameControlPoints(self, previousName, newName):
-    if self.targetFiducialNodeID == "":
-      return
-    self._updatingFiducials = True
-    targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
-    sourceFiducialNode = slicer.mrmlScene.GetNodeByID(self.sourceFiducialNodeID)
-    for i in range(targetFiducialNode.GetNumberOfControlPoints()):
-      if targetFiducialNode.GetNthControlPointLabel(i) == previousName:
-        targetFiducialNode.SetNthControlPointLabel(i, newName)
-        sourceFiducialNode.SetNthControlPointLabel(i, newName)
-    self._updatingFiducials = False
+    def setLabels(fiducialNode, indices):
+      for i in indices:
+        fiducialNode.SetNthControlPointLabel(i, newName)
+    if self.modifyCorrectionControlPoints(previousName, setLabels) and previousName != newName:
+      correctionIndex = self.getCorrectionIndex()
+      correctionIndex[newName] = sorted(correctionIndex.get(newName, []) + correctionIndex.pop(previousName))
 
   def updateRadius(self, controlPointName, value):
-    if self.targetFiducialNodeID == "":
-      return
-    self._updatingFiducials = True
-    targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
-    sourceFiducialNode = slicer.mrmlScene.GetNodeByID(self.sourceFiducialNodeID)
-    for i in range(targetFiducialNode.GetNumberOfControlPoints()):
-      if targetFiducialNode.GetNthControlPointLabel(i) == controlPointName:
-        targetFiducialNode.SetNthControlPointDescription(i, "%.01f"%value)
-        sourceFiducialNode.SetNthControlPointDescription(i, "%.01f"%value)
-        self.parameterNode.SetParameter("Update","true")
-    self._updatingFiducials = False
+    def setDescriptions(fiducialNode, indices):
+      for i in indices:
+        fiducialNode.SetNthControlPointDescription(i, "%.01f"%value)
+    if self.modifyCorrectionControlPoints(controlPointName, setDescriptions):
+      self.parameterNode.SetParameter("Update","true")
 
   def updateSelected(self, controlPointName, value):
-    if self.targetFiducialNodeID == "":
-      return    
-    self._updatingFiducials = True
-    targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
-    sourceFiducialNode = slicer.mrmlScene.GetNodeByID(self.sourceFiducialNodeID)
-    for i in range(targetFiducialNode.GetNumberOfControlPoints()):
-      if targetFiducialNode.GetNthControlPointLabel(i) == controlPointName:
-        targetFiducialNode.SetNthControlPointSelected(i, value)
-        sourceFiducialNode.SetNthControlPointSelected(i, value)
-        self.parameterNode.SetParameter("Update","true")
-    self._updatingFiducials = False
+    if self._updatingTable:
+      return
+    def setSelected(fiducialNode, indices):
+      for i in indices:
+        fiducialNode.SetNthControlPointSelected(i, value)
+    if self.modifyCorrectionControlPoints(controlPointName, setSelected):
+      self.parameterNode.SetParameter("Update","true")
 
   def onSelectionChanged(self):
     if not self.previewSelectedAction.checked:
@@ -751,14 +795,13 @@ class WarpDriveCorrectionsManager(WarpDriveCorrectionsTable, VTKObservationMixin
     targetPoints = vtk.vtkPoints()
     targetFiducialNode = slicer.mrmlScene.GetNodeByID(self.targetFiducialNodeID)
     sourceFiducialNode = slicer.mrmlScene.GetNodeByID(self.sourceFiducialNodeID)
-    for i in range(targetFiducialNode.GetNumberOfControlPoints()):
-      if targetFiducialNode.GetNthControlPointLabel(i) == correctionName:
-        if not jumped:
-          markupsLogic = slicer.modules.markups.logic()
-          markupsLogic.JumpSlicesToNthPointInMarkup(self.targetFiducialNodeID,i,False)
-          jumped = True
-        sourcePoints.InsertNextPoint(sourceFiducialNode.GetNthControlPointPosition(i))
-        targetPoints.InsertNextPoint(targetFiducialNode.GetNthControlPointPosition(i))        
+    for i in self.getCorrectionIndex().get(correctionName, []):
+      if not jumped:
+        markupsLogic = slicer.modules.markups.logic()
+        markupsLogic.JumpSlicesToNthPointInMarkup(self.targetFiducialNodeID,i,False)
+        jumped = True
+      sourcePoints.InsertNextPoint(sourceFiducialNode.GetNthControlPointPosition(i))
+      targetPoints.InsertNextPoint(targetFiducialNode.GetNthControlPointPosition(i))
     tmpNodes = WarpDrive.WarpDriveLogic().previewWarp(sourcePoints, targetPoints)
     for n in tmpNodes:
       qt.QTimer.singleShot(1000, lambda node=n: slicer.mrmlScene.RemoveNode(node))
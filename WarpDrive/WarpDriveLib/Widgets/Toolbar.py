@@ -8,7 +8,9 @@ import re
 
 import WarpDrive
 import ImportAtlas
+from NetstimPreferences import DataCacheSize
 from ..Helpers import LeadDBSCall
+from ..Helpers.DataCache import DataCache
 from ..Widgets import ToolWidget
 
 class reducedToolbar(QToolBar, VTKObservationMixin):
@@ -24,6 +26,11 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     
     self.setWindowTitle(qt.QObject().tr("LeadDBS"))
     self.name = 'LeadDBS'
+
+    self.saveWorkerPool = LeadDBSCall.SaveWorkerPool(statusCallback=self.updateSaveStatus)
+    self.subjectPrefetcher = LeadDBSCall.SubjectPrefetcher()
+    self.dataCache = DataCache(DataCacheSize().getValue())
+    self.modalityImageNodeIDs = {} # loaded anat files of the current subject
   
 
     #
@@ -139,6 +146,18 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     self.nextAction.setText('Save and Exit')
     self.nextAction.connect("triggered(bool)", self.nextSubject)
 
+    #
+    # Save status
+    #
+    self.saveStatusAction = qt.QAction(self)
+    self.saveStatusAction.setIcon(qt.QIcon(":/Icons/Small/SlicerSave.png"))
+    self.saveStatusAction.setEnabled(False)
+    self.saveStatusAction.setVisible(False)
+
+    saveStatusButton = qt.QToolButton()
+    saveStatusButton.setDefaultAction(self.saveStatusAction)
+    saveStatusButton.setToolButtonStyle(qt.Qt.ToolButtonTextBesideIcon)
+
     nextButton = qt.QToolButton()
     nextButton.setFixedWidth(120)
     nextButton.setMenu(menu)
@@ -161,6 +180,7 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     self.addSeparator()
     self.addWidget(templateButton)
     self.addSeparator()
+    self.addWidget(saveStatusButton)
     self.addWidget(nextButton)
 
     #
@@ -191,9 +211,8 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     if not self.parameterNode.GetParameter("TotalNumberOfSubjects"):
       self.parameterNode.SetParameter("TotalNumberOfSubjects", str(numberOfSubjects))
     # Save current subject
-    slicerWillExitAfterSave = False
     if self.parameterNode.GetParameter("CurrentSubject"):
-      slicerWillExitAfterSave = self.saveCurrentSubject(saveInExternalInstance = oneOrMoreRemainingSubjects)
+      self.saveCurrentSubject()
     # Load next subject
     if oneOrMoreRemainingSubjects:
       self.cleanUpNodes()
@@ -201,8 +220,8 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
       self.parameterNode.SetParameter("LeadSubjects", json.dumps(leadSubjects))
       self.parameterNode.SetParameter("CurrentSubjectNumber", str(int(self.parameterNode.GetParameter("TotalNumberOfSubjects")) - len(leadSubjects)))
       self.initializeCurrentSubject()
-    elif (not slicerWillExitAfterSave):
-      slicer.util.exit(0)
+    else:
+      self.saveWorkerPool.exitWhenFinished()
     self.parameterNode.EndModify(wasModified)
 
   def saveSegmentation(self):
@@ -213,6 +232,10 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     for param in ["SourceFiducial", "TargetFiducial", "InputNode", "ImageNode", "OutputGridTransform"]:
       if self.parameterNode.GetNodeReference(param):
         slicer.mrmlScene.RemoveNode(self.parameterNode.GetNodeReference(param))
+    for imageNodeID in self.modalityImageNodeIDs.values():
+      if slicer.mrmlScene.GetNodeByID(imageNodeID):
+        slicer.mrmlScene.RemoveNode(slicer.mrmlScene.GetNodeByID(imageNodeID))
+    self.modalityImageNodeIDs = {}
 
   def initializeCurrentSubject(self):
     currentSubject = json.loads(self.parameterNode.GetParameter("CurrentSubject"))
@@ -229,10 +252,10 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     outputNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLGridTransformNode')
     inputNode.SetAndObserveTransformNodeID(outputNode.GetID())
 
-    if os.path.isfile(os.path.join(currentSubject["warpdrive_path"],'target.json')):
+    sourceTarget = LeadDBSCall.loadSourceTarget(currentSubject["warpdrive_path"])
+    if sourceTarget is not None:
       print("Loading previous session")
-      targetFiducial = slicer.util.loadMarkups(os.path.join(currentSubject["warpdrive_path"],'target.json'))
-      sourceFiducial = slicer.util.loadMarkups(os.path.join(currentSubject["warpdrive_path"],'source.json'))
+      sourceFiducial, targetFiducial = sourceTarget
       if subjectInfo and "inverseApplied" in subjectInfo.keys() and subjectInfo["inverseApplied"]:
         if not useInverse:
           self.invertSourceTargetNodes(sourceFiducial, targetFiducial, inputNode)
@@ -260,9 +283,16 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     self.parameterNode.SetNodeReferenceID("TargetFiducial", targetFiducial.GetID())
     self.parameterNode.EndModify(wasModified)
     print("Finish loading subject %s" % currentSubject["id"])
+    self.prefetchNextSubject()
 
-  def saveCurrentSubject(self, saveInExternalInstance):
-    slicerWillExit = False
+  def prefetchNextSubject(self):
+    leadSubjects = json.loads(self.parameterNode.GetParameter("LeadSubjects"))
+    if isinstance(leadSubjects, dict):
+      leadSubjects = [leadSubjects]
+    if leadSubjects:
+      self.subjectPrefetcher.prefetch(leadSubjects[0], self.parameterNode.GetParameter("modality"))
+
+  def saveCurrentSubject(self):
     slicer.util.setSliceViewerLayers(background=None, foreground=None)
     ToolWidget.AbstractToolWidget.cleanEffects()
     currentSubject = json.loads(self.parameterNode.GetParameter("CurrentSubject"))
@@ -271,20 +301,30 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     if sourceFiducial.GetNumberOfControlPoints(): # corrections made
       if self.hardenChangesAction.checked:
         sourceFiducial.Copy(targetFiducial) # set all as fixed points
-      LeadDBSCall.saveSourceTarget(currentSubject["warpdrive_path"], sourceFiducial, targetFiducial)
+      LeadDBSCall.saveSourceTarget(currentSubject["warpdrive_path"], sourceFiducial, targetFiducial, exportJSON=True)
       LeadDBSCall.saveSceneInfo(currentSubject["warpdrive_path"], self.inverseAction.checked)
       if self.hardenChangesAction.checked:
-        slicerWillExit = True
         if self.inverseAction.checked:
           self.parameterNode.GetNodeReference("OutputGridTransform").Inverse()
-        LeadDBSCall.applyChanges(self.parameterNode.GetNodeReferenceID("OutputGridTransform"), 
-                                self.parameterNode.GetNodeReference("ImageNode").GetStorageNode().GetFileName(), 
-                                os.path.join(self.parameterNode.GetParameter("MNIPath"), "t1.nii"),
-                                currentSubject["forward_transform"], 
-                                currentSubject["inverse_transform"], 
-                                currentSubject["warpdrive_path"],
-                                saveInExternalInstance)
-    return slicerWillExit
+        self.saveWorkerPool.submit(currentSubject["id"],
+                                   self.parameterNode.GetNodeReferenceID("OutputGridTransform"), 
+                                   self.parameterNode.GetNodeReference("ImageNode").GetStorageNode().GetFileName(), 
+                                   os.path.join(self.parameterNode.GetParameter("MNIPath"), "t1.nii"),
+                                   currentSubject["forward_transform"], 
+                                   currentSubject["inverse_transform"], 
+                                   currentSubject["warpdrive_path"])
+
+  def updateSaveStatus(self, status):
+    pending = [subjectID for subjectID, subjectStatus in status.items() if subjectStatus in ['queued', 'saving']]
+    failed = [subjectID for subjectID, subjectStatus in status.items() if subjectStatus == 'failed']
+    if pending:
+      self.saveStatusAction.text = 'Saving %d' % len(pending)
+    elif failed:
+      self.saveStatusAction.text = 'Save failed'
+    else:
+      self.saveStatusAction.text = 'Saved'
+    self.saveStatusAction.toolTip = '\n'.join(['%s: %s' % (subjectID, subjectStatus) for subjectID, subjectStatus in status.items()])
+    self.saveStatusAction.setVisible(True)
 
   def setUpAtlases(self, info):
     print("Set up atlases")
@@ -307,7 +347,7 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     for name in atlasNames:
       print("Loading atlas %s" % name)
       try:
-        ImportAtlas.ImportAtlasLogic().readAtlas(os.path.join(ImportAtlas.ImportAtlasLogic().getAtlasesPath(), name, 'atlas_index.mat'))
+        ImportAtlas.ImportAtlasLogic().readAtlas(os.path.join(ImportAtlas.ImportAtlasLogic().getAtlasesPath(), name, 'atlas_index.mat'), cache=self.dataCache)
       except:
         print("Could not load atlas %s" % name)
     if self.inverseAction.checked:
@@ -339,21 +379,21 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     if modality is None:
       modality = self.modalitiesGroup.checkedAction().text
     print("Loading %s modality" % modality)
-    # find old nodes and delete
-    slicer.mrmlScene.RemoveNode(self.parameterNode.GetNodeReference("ImageNode"))
-    slicer.mrmlScene.RemoveNode(self.parameterNode.GetNodeReference("TemplateNode"))
-    # initialize new image and init
+    # each modality is loaded once per subject, switching only changes the displayed layers
     currentSubject = json.loads(self.parameterNode.GetParameter("CurrentSubject"))
-    imageNode = slicer.util.loadVolume(currentSubject["anat_files"][modality], properties={'show':self.inverseAction.checked})  
+    imageNode = slicer.mrmlScene.GetNodeByID(self.modalityImageNodeIDs[modality]) if modality in self.modalityImageNodeIDs else None
+    if imageNode is None:
+      imageNode = slicer.util.loadVolume(currentSubject["anat_files"][modality], properties={'show':self.inverseAction.checked})
+      self.modalityImageNodeIDs[modality] = imageNode.GetID()
     # change to t1 in case modality not present
     mni_modality = re.findall(r'(?<=T)\d', modality) + ['1']
     mni_modality = mni_modality[0]
     templateFile = glob.glob(os.path.join(self.parameterNode.GetParameter("MNIPath"), "t" + mni_modality + ".nii"))
     templateFile = templateFile[0] if templateFile else os.path.join(self.parameterNode.GetParameter("MNIPath"), "t1.nii")
-    templateNode = slicer.util.loadVolume(templateFile, properties={'show':False})
-    templateNode.GetDisplayNode().AutoWindowLevelOff()
-    templateNode.GetDisplayNode().SetWindow(100)
-    templateNode.GetDisplayNode().SetLevel(70)
+    templateNode = self.parameterNode.GetNodeReference("TemplateNode")
+    if templateNode is None or templateNode.GetStorageNode() is None or templateNode.GetStorageNode().GetFileName() != templateFile:
+      slicer.mrmlScene.RemoveNode(templateNode)
+      templateNode = self.loadTemplate(templateFile)
     # set view
     slicer.util.setSliceViewerLayers(background=imageNode.GetID(), foreground=templateNode.GetID())
     for sliceNode in slicer.util.getNodesByClass('vtkMRMLSliceNode'):
@@ -362,22 +402,41 @@ class reducedToolbar(QToolBar, VTKObservationMixin):
     self.parameterNode.SetParameter("modality", modality)
     self.parameterNode.SetNodeReferenceID("ImageNode", imageNode.GetID())
     self.parameterNode.SetNodeReferenceID("TemplateNode", templateNode.GetID())
-    if self.inverseAction.checked:
-      templateNode.SetAndObserveTransformNodeID(self.parameterNode.GetNodeReferenceID("InputNode"))
-    else:
-      imageNode.SetAndObserveTransformNodeID(self.parameterNode.GetNodeReferenceID("InputNode"))
+    inputNodeID = self.parameterNode.GetNodeReferenceID("InputNode")
+    templateNode.SetAndObserveTransformNodeID(inputNodeID if self.inverseAction.checked else None)
+    imageNode.SetAndObserveTransformNodeID(None if self.inverseAction.checked else inputNodeID)
 
   def updateTemplateImage(self, file):
     slicer.mrmlScene.RemoveNode(self.parameterNode.GetNodeReference("TemplateNode"))
-    templateNode = slicer.util.loadVolume(file, properties={'show':False})
-    templateNode.GetDisplayNode().AutoWindowLevelOff()
-    templateNode.GetDisplayNode().SetWindow(100)
-    templateNode.GetDisplayNode().SetLevel(70)
+    templateNode = self.loadTemplate(file)
     slicer.util.setSliceViewerLayers(foreground=templateNode.GetID())
     self.parameterNode.SetNodeReferenceID("TemplateNode", templateNode.GetID())
     if self.inverseAction.checked:
       templateNode.SetAndObserveTransformNodeID(self.parameterNode.GetNodeReferenceID("InputNode"))
 
+  def loadTemplate(self, file):
+    # templates are the same for all subjects: the image data is kept in the cache and shared
+    key = DataCache.fileKey(file)
+    cached = self.dataCache.get(key)
+    if cached is None:
+      templateNode = slicer.util.loadVolume(file, properties={'show':False})
+      ijkToRAS = vtk.vtkMatrix4x4()
+      templateNode.GetIJKToRASMatrix(ijkToRAS)
+      self.dataCache.add(key, (templateNode.GetImageData(), ijkToRAS), templateNode.GetImageData().GetActualMemorySize() * 1024)
+    else:
+      imageData, ijkToRAS = cached
+      templateNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', os.path.splitext(os.path.basename(file))[0])
+      templateNode.SetIJKToRASMatrix(ijkToRAS)
+      nodeImageData = vtk.vtkImageData()
+      nodeImageData.ShallowCopy(imageData)
+      templateNode.SetAndObserveImageData(nodeImageData)
+      templateNode.AddDefaultStorageNode(file)
+      templateNode.CreateDefaultDisplayNodes()
+    templateNode.GetDisplayNode().AutoWindowLevelOff()
+    templateNode.GetDisplayNode().SetWindow(100)
+    templateNode.GetDisplayNode().SetLevel(70)
+    return templateNode
+
   def onInverseTriggered(self, useInverse):
     wasModified = self.parameterNode.StartModify()
     outputTransformID = self.parameterNode.GetNodeReferenceID("OutputGridTransform")